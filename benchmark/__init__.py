@@ -0,0 +1,8 @@
+"""
+Scan benchmark: generates fake FastStore trees under a temporary directory and times the scan stages of
+check_status on them, with the number of stat, listing, open and database calls of every stage.
+
+    python -m benchmark --layers 10,100,1000 --json results.json
+
+Needs neither BeeGFS nor Hive, Dask or the messaging API.
+"""
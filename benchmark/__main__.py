@@ -0,0 +1,161 @@
+"""
+Time every scan stage on a generated tree and count the calls it makes, at several scales.
+
+    python -m benchmark --layers 10,100,1000 [--rscm-datasets 2] [--cycles 3] [--json results.json]
+
+Every scale runs in its own process on its own temporary tree and database (module-level caches
+and settings don't leak between scales). Sleeps inside the stages are recorded instead of waited for.
+"""
+import argparse
+import contextlib
+import io
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.environment import REPO_ROOT, create_database, redirect_settings
+from benchmark.syscalls import counting
+from benchmark.tree import generate
+
+TREE_OPTIONS = ['rscm_datasets', 'layers', 'channels', 'ribbons', 'rscm_imaged',
+                'mesospim_datasets', 'tiles', 'mesospim_imaged', 'queue_files', 'cbpy_jobs', 'processed_datasets']
+SHOWN_CALLS = ['stat', 'scandir', 'open', 'sqlite_connect']
+
+
+class recorded_sleep:
+    """
+    time.sleep returns right away inside, the seconds asked for are added up
+    """
+    def __enter__(self):
+        self.seconds = 0
+        self._sleep = time.sleep
+
+        def sleep(seconds):
+            self.seconds += seconds
+        time.sleep = sleep
+        return self
+
+    def __exit__(self, *exc):
+        time.sleep = self._sleep
+        return False
+
+
+def run_scale(options):
+    """
+    Generate a tree, then run every scan stage in order for options.cycles cycles. The first cycle
+    finds the datasets, the next ones are steady state. Every dataset is checked in every cycle.
+    :return: dict with the tree counts and a row per stage and cycle
+    """
+    root = tempfile.mkdtemp(prefix='micro_status_benchmark_')
+    sys.path.insert(0, REPO_ROOT)
+    from micro_status import settings
+    redirect_settings(settings, root)
+    create_database(settings.DB_LOCATION)
+    started = time.perf_counter()
+    tree = generate(settings, **{name: getattr(options, name) for name in TREE_OPTIONS})
+    tree['seconds'] = round(time.perf_counter() - started, 2)
+
+    import check_status
+    from micro_status.scheduler import wake_all_datasets
+    from micro_status.utils import start_new_cycle
+
+    rows = []
+    try:
+        for cycle in range(options.cycles):
+            start_new_cycle()
+            wake_all_datasets()
+            for stage in check_status.SCAN_STAGES:
+                error = None
+                output = io.StringIO()
+                with counting() as calls, recorded_sleep() as slept, contextlib.redirect_stdout(output):
+                    started = time.perf_counter()
+                    try:
+                        stage.func()
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                    seconds = time.perf_counter() - started
+                rows.append({
+                    'cycle': cycle,
+                    'stage': stage.name,
+                    'seconds': round(seconds, 4),
+                    'slept': slept.seconds,
+                    'calls': dict(calls),
+                    'error': error,
+                })
+    finally:
+        if not options.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return {'options': {name: getattr(options, name) for name in TREE_OPTIONS}, 'tree': tree, 'stages': rows}
+
+
+def print_report(results):
+    for result in results:
+        options = result['options']
+        tree = result['tree']
+        print(f"\n{options['rscm_datasets']} RSCM datasets x {options['layers']} layers x {options['channels']} "
+              f"channels x {options['ribbons']} ribbons, {options['mesospim_datasets']} MesoSPIM datasets x "
+              f"{options['tiles']} tiles, {tree['processed_datasets']} RSCM datasets in processing: "
+              f"{tree['files']} files (generated in {tree['seconds']} s)")
+        header = f"{'stage':<28}{'cycle':>6}{'seconds':>10}{'slept':>8}" + "".join(f"{name:>16}" for name in SHOWN_CALLS)
+        print(header)
+        for row in result['stages']:
+            calls = row['calls']
+            line = f"{row['stage']:<28}{row['cycle']:>6}{row['seconds']:>10.3f}{row['slept']:>8.0f}"
+            line += "".join(f"{calls.get(name, 0):>16}" for name in SHOWN_CALLS)
+            if row['error']:
+                line += f"  {row['error']}"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scan stages on generated acquisition trees")
+    parser.add_argument('--layers', default='10,100,1000', help="comma separated, one run per value")
+    parser.add_argument('--rscm-datasets', type=int, default=2)
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--ribbons', type=int, default=10)
+    parser.add_argument('--rscm-imaged', type=float, default=0.5, help="part of the layers imaged")
+    parser.add_argument('--mesospim-datasets', type=int, default=1)
+    parser.add_argument('--tiles', type=int, default=20)
+    parser.add_argument('--mesospim-imaged', type=float, default=0.5, help="part of the tiles imaged")
+    parser.add_argument('--queue-files', type=int, default=40)
+    parser.add_argument('--cbpy-jobs', type=int, default=2)
+    parser.add_argument('--processed-datasets', type=int, default=1,
+                        help="RSCM datasets in each processing state: started, stitched, denoised, finished")
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--keep', action='store_true', help="keep the generated tree")
+    parser.add_argument('--json', help="write the results to this file too")
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)  # one scale, result on stdout
+    args = parser.parse_args(argv)
+
+    if args.single:
+        args.layers = int(args.layers)
+        print(json.dumps(run_scale(args)))
+        return 0
+
+    results = []
+    failed = False
+    for layers in [int(value) for value in args.layers.split(',')]:
+        cmd = [sys.executable, '-m', 'benchmark', '--single', '--layers', str(layers)]
+        for name in TREE_OPTIONS + ['cycles']:
+            if name != 'layers':
+                cmd += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        if args.keep:
+            cmd.append('--keep')
+        process = subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True)
+        if process.returncode != 0:
+            print(f"Run with {layers} layers failed:\n{process.stderr}", file=sys.stderr)
+            failed = True
+            continue
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed or any(row['error'] for result in results for row in result['stages']) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
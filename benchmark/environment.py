@@ -0,0 +1,117 @@
+"""
+Point the status checker at a temporary directory instead of FastStore and Hive, with its own database.
+Has to run before anything imports the settings by name (from .settings import *).
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORAGE_PREFIXES = ('/CBI_FastStore', '/h20')
+UNREACHABLE_DASHBOARD = 'http://127.0.0.1:9/'  # connection refused right away
+
+# tables that exist in the production database but aren't in create_db.py
+BASE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS "pi" (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `name` TEXT NOT NULL,
+        `public_folder_name` TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `clnumber` (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `name` TEXT NOT NULL UNIQUE,
+        `pi` INTEGER,
+        FOREIGN KEY(`pi`) REFERENCES pi(id) ON DELETE SET NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS "dataset" (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `name` TEXT,
+        `path_on_fast_store` TEXT,
+        `cl_number` INTEGER,
+        `pi` INTEGER,
+        `imaging_status` TEXT NOT NULL DEFAULT 'in_progress',
+        `processing_status` TEXT NOT NULL DEFAULT 'not_started',
+        `path_on_hive` TEXT,
+        `job_number` TEXT,
+        `imaris_file_path` TEXT,
+        `channels` INTEGER NOT NULL DEFAULT 1,
+        `z_layers_total` INTEGER,
+        `z_layers_current` INTEGER,
+        `ribbons_total` INTEGER,
+        `ribbons_finished` INTEGER,
+        `tiles_total` INTEGER,
+        `tiles_finished` INTEGER,
+        `tiles_x` INTEGER,
+        `tiles_y` INTEGER,
+        `resolution_xy` TEXT,
+        `resolution_z` TEXT,
+        `imaging_no_progress_time` TEXT,
+        `processing_no_progress_time` TEXT,
+        `processing_summary` TEXT,
+        `z_layers_checked` INTEGER,
+        `keep_composites` INTEGER DEFAULT 0,
+        `delete_405` INTEGER DEFAULT 0,
+        `created` TEXT DEFAULT NULL,
+        `modality` TEXT DEFAULT NULL,
+        `is_brain` INTEGER DEFAULT 0,
+        `peace_json_created` INTEGER DEFAULT 0,
+        `imaging_summary` TEXT,
+        `moved` INTEGER DEFAULT 0,
+        `moving` INTEGER DEFAULT 0,
+        `paused` INTEGER DEFAULT 0,
+        FOREIGN KEY(`cl_number`) REFERENCES clnumber (id) ON DELETE SET NULL,
+        FOREIGN KEY(`pi`) REFERENCES pi (id) ON DELETE SET NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `warning` (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `type` TEXT NOT NULL,
+        `message_sent` INTEGER DEFAULT 0,
+        `active` INTEGER DEFAULT 1
+    )
+    """,
+]
+
+
+def redirect_path(value, root):
+    if isinstance(value, str) and value.startswith(STORAGE_PREFIXES):
+        return os.path.join(root, value.lstrip('/'))
+    if isinstance(value, dict):
+        return {key: redirect_path(item, root) for key, item in value.items()}
+    return value
+
+
+def redirect_settings(settings, root):
+    """
+    Move every FastStore / Hive path of the settings module under root, create the directories,
+    turn messages off and point the Dask dashboard to a port nothing listens on
+    """
+    for name in dir(settings):
+        if name.isupper():
+            setattr(settings, name, redirect_path(getattr(settings, name), root))
+    settings.MESSAGES_ENABLED = False
+    settings.DASK_DASHBOARD = UNREACHABLE_DASHBOARD
+    for folder in [
+        settings.RSCM_FASTSTORE_ACQUISITION_FOLDER, settings.MESOSPIM_FASTSTORE_ACQUISITION_FOLDER,
+        settings.RSCM_HIVE_ACQUISITION_FOLDER, settings.MESOSPIM_HIVE_ACQUISITION_FOLDER,
+        settings.RSCM_FOLDER_STITCHING, settings.RSCM_FOLDER_BUILDING_IMS, settings.CBPY_FOLDER,
+        settings.MANIFEST_FOLDER, settings.JOB_LOG_FOLDER, os.path.dirname(settings.DB_LOCATION),
+    ] + list(settings.TRASH_LOCATIONS.values()):
+        os.makedirs(folder, exist_ok=True)
+
+
+def create_database(db_file):
+    con = sqlite3.connect(db_file)
+    for query in BASE_TABLES:
+        con.execute(query)
+    con.commit()
+    con.close()
+    subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'create_db.py'), db_file],
+                   check=True, stdout=subprocess.DEVNULL)
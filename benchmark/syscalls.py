@@ -0,0 +1,84 @@
+"""
+Count filesystem and other expensive calls made by the Python code, by kind.
+
+Audit events cover open, directory listings (os.scandir, os.listdir, os.walk and glob go through them),
+renames, removals, sqlite connections, subprocesses and sockets. os.stat and os.lstat (and os.path.exists,
+isdir, getsize... which use them) don't raise audit events, so they're wrapped.
+Stats of os.scandir entries aren't counted, they mostly come with the listing.
+"""
+import os
+import sys
+import threading
+from collections import Counter
+
+AUDIT_EVENTS = {
+    'open': 'open',
+    'os.scandir': 'scandir',
+    'os.listdir': 'listdir',
+    'glob.glob': 'glob',
+    'os.rename': 'rename',
+    'os.remove': 'remove',
+    'os.rmdir': 'rmdir',
+    'os.mkdir': 'mkdir',
+    'shutil.rmtree': 'rmtree',
+    'sqlite3.connect': 'sqlite_connect',
+    'subprocess.Popen': 'subprocess',
+    'socket.connect': 'socket_connect',
+}
+
+_counter = None
+_lock = threading.Lock()
+_installed = False
+
+
+def _count(kind):
+    counter = _counter
+    if counter is not None:
+        with _lock:
+            counter[kind] += 1
+
+
+def _audit(event, args):
+    kind = AUDIT_EVENTS.get(event)
+    if kind is not None:
+        _count(kind)
+
+
+def _wrap(name):
+    original = getattr(os, name)
+
+    def counted(*args, **kwargs):
+        _count(name)
+        return original(*args, **kwargs)
+    counted.__wrapped__ = original
+    setattr(os, name, counted)
+
+
+def install():
+    """
+    Audit hooks can't be removed, so this is done once and the counting is switched on and off by counting()
+    """
+    global _installed
+    if _installed:
+        return
+    sys.addaudithook(_audit)
+    _wrap('stat')
+    _wrap('lstat')
+    _installed = True
+
+
+class counting:
+    """
+    with counting() as counts: ...  counts is a Counter of the calls made inside, from any thread
+    """
+    def __enter__(self):
+        global _counter
+        install()
+        self.counts = Counter()
+        _counter = self.counts
+        return self.counts
+
+    def __exit__(self, *exc):
+        global _counter
+        _counter = None
+        return False
@@ -0,0 +1,225 @@
+"""
+Fake acquisition trees laid out like FastStore: RSCM and MesoSPIM datasets, clusterStitch queues and CBPy jobs,
+and RSCM datasets further along in processing, with their database records.
+Files are tiny (valid 1x1 TIFFs), only the number of files and directories is realistic.
+"""
+import os
+import pickle
+import sqlite3
+import struct
+
+PIS = ['smith', 'jones', 'garcia', 'chen']
+# processing_status of the seeded datasets, each one exercises a part of check_RSCM_processing / move_files / check_moving
+PROCESSING_STATES = ['started', 'stitched', 'denoised', 'finished']
+COMPOSITES_DIR_NAME = 'composites_RSCM_v0.1'
+
+
+def tiny_tiff():
+    """
+    Uncompressed 1x1 8-bit grayscale TIFF: header, one IFD with the baseline tags, one pixel
+    """
+    entries = [  # tag, type (3 SHORT, 4 LONG), value
+        (256, 3, 1),   # ImageWidth
+        (257, 3, 1),   # ImageLength
+        (258, 3, 8),   # BitsPerSample
+        (259, 3, 1),   # Compression: none
+        (262, 3, 1),   # PhotometricInterpretation: black is zero
+        (273, 4, 0),   # StripOffsets, set below
+        (278, 3, 1),   # RowsPerStrip
+        (279, 4, 1),   # StripByteCounts
+    ]
+    ifd_size = 2 + 12 * len(entries) + 4
+    pixel_offset = 8 + ifd_size
+    ifd = struct.pack('<H', len(entries))
+    for tag, kind, value in entries:
+        if tag == 273:
+            value = pixel_offset
+        packed = struct.pack('<HH', value, 0) if kind == 3 else struct.pack('<I', value)
+        ifd += struct.pack('<HHI', tag, kind, 1) + packed
+    ifd += struct.pack('<I', 0)  # no next IFD
+    return b'II*\x00' + struct.pack('<I', 8) + ifd + b'\x00'
+
+
+def write(path, content):
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(path, mode) as f:
+        f.write(content)
+
+
+def make_rscm_dataset(acquisition_folder, pi, cl_number, sample, layers, channels, ribbons, imaged=1.0):
+    """
+    {pi}/{cl_number}/{sample}_stack with vs_series.dat and {sample}_layer{z:03}/{channel}/images/*col*.tif.
+    Layers are imaged from the top: with imaged < 1 the lower layers don't exist yet
+    and the lowest one there is half done.
+    :return: (dataset path, files written)
+    """
+    path = os.path.join(acquisition_folder, pi, cl_number, f"{sample}_stack")
+    os.makedirs(path, exist_ok=True)
+    write(os.path.join(path, 'vs_series.dat'),
+          '<?xml version="1.0"?>\n<vs_series>\n'
+          f'  <stack_slice_count>{layers}</stack_slice_count>\n'
+          f'  <grid_cols>{ribbons}</grid_cols>\n'
+          '</vs_series>\n')
+    tiff = tiny_tiff()
+    channel_names = ['405', '488', '561', '647'][:channels]
+    imaged_layers = max(int(round(layers * imaged)), 1)
+    files = 1
+    for i, z in enumerate(range(layers - 1, layers - 1 - imaged_layers, -1)):
+        in_progress = imaged < 1 and i == imaged_layers - 1
+        layer_name = f"{sample}_layer{str(z).zfill(3) if z < 1000 else str(z)}"
+        for channel in channel_names:
+            images_dir = os.path.join(path, layer_name, channel, 'images')
+            os.makedirs(images_dir, exist_ok=True)
+            for col in range(ribbons // 2 if in_progress else ribbons):
+                write(os.path.join(images_dir, f"{sample}_z{z}_ch{channel}_col{col:03}.tif"), tiff)
+                files += 1
+    return path, files
+
+
+def make_mesospim_dataset(acquisition_folder, pi, cl_number, name, tiles, lasers=2, imaged=1.0):
+    """
+    {pi}/{cl_number}/{name} with a .bin acquisition list, a .btf per imaged tile and its .btf_meta.txt
+    :return: (dataset path, files written)
+    """
+    path = os.path.join(acquisition_folder, pi, cl_number, name)
+    os.makedirs(path, exist_ok=True)
+    acquisition_list = [{'laser': f"{488 + 100 * (tile % lasers)} nm", 'tile': tile} for tile in range(tiles)]
+    with open(os.path.join(path, f"{name}.bin"), 'wb') as f:
+        pickle.dump(acquisition_list, f)
+    files = 1
+    for tile in range(max(int(round(tiles * imaged)), 1)):
+        tile_name = f"{name}_tile{tile:04}.btf"
+        write(os.path.join(path, tile_name), b'\x00' * 1024)
+        write(os.path.join(path, tile_name + '_meta.txt'), "[Pixelsize in um] 5\n[z_stepsize] 5.0\n")
+        files += 2
+    return path, files
+
+
+def make_stitch_queues(stitching_folder, queue_files):
+    """
+    clusterStitch queue directories with queue_files txt files spread over them
+    """
+    states = ['complete', 'error', 'processing', 'queueStitch', 'tempQueue']
+    for state in states:
+        os.makedirs(os.path.join(stitching_folder, state), exist_ok=True)
+    for i in range(queue_files):
+        state = 'complete' if i % 4 else states[i % len(states)]
+        write(os.path.join(stitching_folder, state, f"{90000 + i:05}_pi_CL{i}_old_dataset_{i}.txt"),
+              f'rootDir="/nowhere/{i}"\nkeepComposites=True\nmoveToHive=False')
+    return queue_files
+
+
+def make_cbpy(cbpy_folder, jobs, queued_per_job=10, composites_per_job=20):
+    """
+    CBPy queueGPU with queued files and active job xmls pointing to output directories with denoised composites
+    """
+    tiff = tiny_tiff()
+    os.makedirs(os.path.join(cbpy_folder, 'queueGPU'), exist_ok=True)
+    os.makedirs(os.path.join(cbpy_folder, 'active'), exist_ok=True)
+    files = 0
+    for job in range(jobs):
+        out_dir = os.path.join(cbpy_folder, 'output', f"job_{job}")
+        os.makedirs(out_dir, exist_ok=True)
+        write(os.path.join(cbpy_folder, 'active', f"job_{job}.xml"),
+              f'<?xml version="1.0"?>\n<job><outFilePathUnix>{out_dir}</outFilePathUnix></job>\n')
+        for i in range(queued_per_job):
+            write(os.path.join(cbpy_folder, 'queueGPU', f"job_{job}_{i:04}.txt"), '')
+        for i in range(composites_per_job):
+            write(os.path.join(out_dir, f"composite_{i:04}.tif"), tiff)
+        files += 1 + queued_per_job + composites_per_job
+    return files
+
+
+def insert_dataset(db_file, pi, cl_number, path, **fields):
+    """
+    Record of a dataset the imaging check would have created, pi and cl number records too
+    :return: dataset id
+    """
+    con = sqlite3.connect(db_file)
+    cur = con.cursor()
+    cur.execute('INSERT INTO pi(name) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM pi WHERE name = ?)', (pi, pi))
+    pi_id = cur.execute('SELECT id FROM pi WHERE name = ?', (pi,)).fetchone()[0]
+    cur.execute('INSERT OR IGNORE INTO clnumber(name, pi) VALUES(?, ?)', (cl_number, pi_id))
+    cl_number_id = cur.execute('SELECT id FROM clnumber WHERE name = ?', (cl_number,)).fetchone()[0]
+    fields = dict(fields, name=os.path.basename(path), path_on_fast_store=path, pi=pi_id, cl_number=cl_number_id)
+    cur.execute(f"INSERT INTO dataset({', '.join(fields)}) VALUES({', '.join('?' for _ in fields)})", list(fields.values()))
+    dataset_id = cur.lastrowid
+    con.commit()
+    con.close()
+    return dataset_id
+
+
+def make_processed_dataset(settings, state, pi, cl_number, sample, job_number, layers, channels, ribbons):
+    """
+    Fully imaged RSCM dataset in the given processing_status, with the outputs the status check expects by then:
+    started - queue file in processing, half of the composites;
+    stitched - queue file in complete, all composites, half of them denoised in the job dir;
+    denoised - all composites denoised, the Imaris file being built (.ims.part);
+    finished - the Imaris file built, ready to be moved.
+    :return: files written
+    """
+    path, files = make_rscm_dataset(settings.RSCM_FASTSTORE_ACQUISITION_FOLDER, pi, cl_number, sample,
+                                    layers, channels, ribbons)
+    dataset_id = insert_dataset(
+        settings.DB_LOCATION, pi, cl_number, path, imaging_status='finished', processing_status=state,
+        job_number=None if state == 'started' else str(job_number), channels=channels, z_layers_total=layers,
+        z_layers_current=layers, ribbons_total=layers * channels * ribbons, ribbons_finished=layers * channels * ribbons,
+        created='2026-01-01_00-00-00', modality='rscm',
+    )
+    queue_state = 'processing' if state == 'started' else 'complete'
+    write(os.path.join(settings.RSCM_FOLDER_STITCHING, queue_state,
+                       f"{str(dataset_id).zfill(5)}_{pi}_{cl_number}_{os.path.basename(path)}.txt"),
+          f'rootDir="{path}"\nkeepComposites=True\nmoveToHive=False')
+    files += 1
+
+    tiff = tiny_tiff()
+    composites_dir = os.path.join(path, COMPOSITES_DIR_NAME)
+    job_dir = os.path.join(composites_dir, f"job_{job_number}")
+    os.makedirs(job_dir if state != 'started' else composites_dir, exist_ok=True)
+    composites = [f"composite_z{z:04}_ch{channel}.tif" for z in range(layers) for channel in range(channels)]
+    for name in composites[:len(composites) // 2] if state == 'started' else composites:
+        write(os.path.join(composites_dir, name), tiff)
+        files += 1
+    if state == 'started':
+        return files
+    for name in composites[:len(composites) // 2] if state == 'stitched' else composites:
+        write(os.path.join(job_dir, name), tiff)
+        files += 1
+    imaris_file = os.path.join(job_dir, f"{COMPOSITES_DIR_NAME}_job_{job_number}.ims")
+    if state == 'denoised':
+        write(imaris_file + '.part', b'\x00' * 1024)
+        files += 1
+    elif state == 'finished':
+        write(imaris_file, b'\x00' * 1024)
+        files += 1
+    return files
+
+
+def generate(settings, rscm_datasets=2, layers=100, channels=3, ribbons=10, rscm_imaged=0.5,
+             mesospim_datasets=1, tiles=20, mesospim_imaged=0.5, queue_files=40, cbpy_jobs=2, processed_datasets=1):
+    """
+    Generate a tree in the folders of the (already redirected) settings module
+    :param processed_datasets: RSCM datasets seeded in each of PROCESSING_STATES
+    :return: counts of what was generated
+    """
+    counts = {'rscm_datasets': rscm_datasets, 'mesospim_datasets': mesospim_datasets,
+              'processed_datasets': processed_datasets * len(PROCESSING_STATES), 'files': 0}
+    for i in range(rscm_datasets):
+        pi = PIS[i % len(PIS)]
+        _, files = make_rscm_dataset(settings.RSCM_FASTSTORE_ACQUISITION_FOLDER, pi, f"CL{100 + i}", f"sample{i}",
+                                     layers, channels, ribbons, rscm_imaged)
+        counts['files'] += files
+    for i in range(mesospim_datasets):
+        pi = PIS[i % len(PIS)]
+        _, files = make_mesospim_dataset(settings.MESOSPIM_FASTSTORE_ACQUISITION_FOLDER, pi, f"CL{200 + i}",
+                                         f"tiles{i}", tiles, imaged=mesospim_imaged)
+        counts['files'] += files
+    counts['files'] += make_stitch_queues(settings.RSCM_FOLDER_STITCHING, queue_files)
+    for i in range(processed_datasets):
+        for j, state in enumerate(PROCESSING_STATES):
+            pi = PIS[(i + j) % len(PIS)]
+            counts['files'] += make_processed_dataset(settings, state, pi, f"CL{300 + i * len(PROCESSING_STATES) + j}",
+                                                      f"{state}{i}", 500 + i * len(PROCESSING_STATES) + j,
+                                                      layers, channels, ribbons)
+    counts['files'] += make_cbpy(settings.CBPY_FOLDER, cbpy_jobs)
+    return counts
@@ -62,7 +62,6 @@ import re
 import requests
 import shutil
 import subprocess
-import sqlite3
 import time
 import traceback
 from datetime import datetime
@@ -72,37 +71,59 @@ from pathlib import Path, PureWindowsPath
 import tifffile
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from imaris_ims_file_reader import ims
 
+from micro_status.cbpy_monitor import get_cbpy_snapshot
+from micro_status.dask_cluster import get_cluster_snapshot
 from micro_status.dataset import Dataset
+from micro_status.db import connect
+from micro_status.ims_progress import format_duration
+from micro_status.ims_probe import OK as IMS_OK, probe as probe_ims
+from micro_status.job_launcher import Job, poll_jobs
+from micro_status.leases import shard, start_heartbeat
 from micro_status.mesospim_dataset import MesoSPIMDataset
+from micro_status.notifications import flush as flush_notifications
+from micro_status.outbox import start_sender
+from micro_status.queue_index import get_queue_index
 from micro_status.rscm_dataset import RSCMDataset
+from micro_status.scheduler import due_stages, is_due, reschedule, wait_for_next_run, wake_dataset, wake_stage
 from micro_status.settings import *  # TODO replace this with normal import
+from micro_status.stage_executor import Stage, for_each, run_stages
+from micro_status.storage import forecast, sample_mounts
+from micro_status.transfers import JOB_PREFIX, schedule_moves
+from micro_status.trash import purge, register_untracked
+from micro_status.usage_accountant import account, describe_top_consumers
 from micro_status.warning import Warning
-from micro_status.utils import can_be_moved
+from micro_status.utils import start_new_cycle
 
 
-console_handler = logging.StreamHandler()
 LOG_FILE_NAME_PATTERN = "/CBI_FastStore/Iana/bot_logs/{}_{}.txt"
-file_handler = logging.FileHandler(
-    LOG_FILE_NAME_PATTERN.format(
-        os.uname().nodename,
-        datetime.now().strftime(DATETIME_FORMAT)
-    )
-)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(name)s - %(levelname)s - %(message)s',
-    handlers=[console_handler, file_handler]
-)
 log = logging.getLogger(__name__)
 
 
+def setup_logging():
+    """
+    Log to the console and to a file per worker run. Not done on import, so the stages can be imported
+    without the log folder (e.g. by the benchmarks).
+    """
+    console_handler = logging.StreamHandler()
+    file_handler = logging.FileHandler(
+        LOG_FILE_NAME_PATTERN.format(
+            os.uname().nodename,
+            datetime.now().strftime(DATETIME_FORMAT)
+        )
+    )
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(name)s - %(levelname)s - %(message)s',
+        handlers=[console_handler, file_handler]
+    )
+
+
 def check_if_new(file_path):
     """
     Check that vs_series file with given path is not in the database.
     """
-    con = sqlite3.connect(DB_LOCATION)
+    con = connect()
     con.row_factory = lambda cursor, row: row[0]
     cur = con.cursor()
     records = cur.execute('SELECT path_on_fast_store FROM dataset').fetchall()
@@ -111,7 +132,7 @@ def check_if_new(file_path):
 
 
 # def read_dataset_record(file_path):
-#     con = sqlite3.connect(DB_LOCATION)
+#     con = connect()
 #     cur = con.cursor()
 #     record = cur.execute(f'SELECT * FROM dataset WHERE path_on_fast_store="{str(file_path)}"').fetchone()
 #     con.close()
@@ -123,7 +144,7 @@ def check_if_new(file_path):
 #     # print("Record", record)
 #
 #     pi_id = record[4]
-#     con = sqlite3.connect(DB_LOCATION)
+#     con = connect()
 #     cur = con.cursor()
 #     pi_name = cur.execute(f'SELECT name FROM pi WHERE id="{pi_id}"').fetchone()
 #     con.close()
@@ -131,7 +152,7 @@ def check_if_new(file_path):
 #         pi_name = pi_name[0]
 #
 #     cl_number_id = record[3]
-#     con = sqlite3.connect(DB_LOCATION)
+#     con = connect()
 #     cur = con.cursor()
 #     cl_number = cur.execute(f'SELECT name FROM clnumber WHERE id="{cl_number_id}"').fetchone()
 #     con.close()
@@ -174,11 +195,15 @@ def check_RSCM_imaging():
                 if 'stack' in str(file_path.name):
                     datasets.append(str(file_path))
     print("Unique datasets found: ", len(datasets))
+    datasets = shard(datasets, 'rscm_dataset')
+    print("Datasets handled by this worker: ", len(datasets))
 
+    existing = []
     for file_path in datasets:
         print("Working on: ", file_path)
         is_new = check_if_new(file_path)
         if is_new:
+            # one at a time, creating a dataset can create its pi and cl number records
             log.info("-----------------------New dataset--------------------------")
             dataset = RSCMDataset.create(file_path)
             if "demo" in dataset.name.lower():
@@ -191,47 +216,67 @@ def check_RSCM_imaging():
                 continue
             dataset.send_message('imaging_started')
         else:
-            dataset = RSCMDataset(file_path)
-            if dataset.imaging_status == 'in_progress':
-                print("Imaging status is 'in-progress'")
-                got_finished, has_progress, error_flag = dataset.check_imaging_progress()
-                if error_flag:
+            existing.append(file_path)
+    for_each([file_path for file_path in existing if is_due(file_path)], check_RSCM_imaging_progress)
+
+
+def check_RSCM_imaging_progress(file_path):
+    kind, active = check_RSCM_dataset_imaging(file_path)
+    reschedule(file_path, kind, active)
+
+
+def check_RSCM_dataset_imaging(file_path):
+    """
+    :return: (kind of dataset for the scheduler, whether it had progress)
+    """
+    dataset = RSCMDataset(file_path)
+    if dataset.imaging_status == 'in_progress':
+        print("Imaging status is 'in-progress'")
+        got_finished, has_progress, error_flag = dataset.check_imaging_progress()
+        if HASH_DURING_ACQUISITION and MOVE_VERIFY_HASH:  # the hashes are only compared when moving with hashes
+            dataset.hash_new_ribbons(finished=got_finished)
+        if error_flag:
+            dataset.mark_paused()
+            dataset.send_message('broken_tiff_file')
+            return 'imaging_paused', True
+        print("Imaging finished:", got_finished)
+        if got_finished:
+            dataset.mark_imaging_finished()
+            dataset.send_message('imaging_finished')
+            if dataset.delete_405:
+                print("------------Deleting 405 channel")
+                dataset.delete_channel_405()  # in the background, check_RSCM_processing starts processing after it
+            elif '_cont_' not in dataset.name.lower():
+                dataset.start_processing()
+                wake_stage('check_RSCM_processing')
+            return 'finished', True
+        print("Imaging has progress:", has_progress)
+        if has_progress:
+            if dataset.imaging_no_progress_time:
+                dataset.mark_has_imaging_progress()
+            return 'imaging', True
+        else:
+            if not dataset.imaging_no_progress_time:
+                dataset.mark_no_imaging_progress()
+            else:
+                progress_stopped_at = datetime.strptime(dataset.imaging_no_progress_time, DATETIME_FORMAT)
+                if (datetime.now() - progress_stopped_at).total_seconds() > PROGRESS_TIMEOUT:
                     dataset.mark_paused()
-                    dataset.send_message('broken_tiff_file')
-                    continue
-                print("Imaging finished:", got_finished)
-                if got_finished:
-                    dataset.mark_imaging_finished()
-                    dataset.send_message('imaging_finished')
-                    if dataset.delete_405:
-                        print("------------Deleting 405 channel")
-                        dataset.delete_channel_405()
-                    if '_cont_' not in dataset.name.lower():
-                        dataset.start_processing()
-                    continue
-                print("Imaging has progress:", has_progress)
-                if has_progress:
-                    if dataset.imaging_no_progress_time:
-                        dataset.mark_has_imaging_progress()
-                    continue
-                else:
-                    if not dataset.imaging_no_progress_time:
-                        dataset.mark_no_imaging_progress()
-                    else:
-                        progress_stopped_at = datetime.strptime(dataset.imaging_no_progress_time, DATETIME_FORMAT)
-                        if (datetime.now() - progress_stopped_at).total_seconds() > PROGRESS_TIMEOUT:
-                            dataset.mark_paused()
-                            dataset.send_message('imaging_paused')
-            elif dataset.imaging_status == 'paused':
-                print("Imaging status is 'paused'")
-                finished, has_progress, error_flag = dataset.check_imaging_progress()  # maybe imaging resumed
-                if not has_progress:
-                    continue
-                else:
-                    dataset.mark_has_imaging_progress()
-                    dataset.mark_resumed()
-                    # response = dataset.send_message('imaging_resumed')
-                    # print(response)
+                    dataset.send_message('imaging_paused')
+                    return 'imaging_paused', True
+            return 'imaging', False
+    elif dataset.imaging_status == 'paused':
+        print("Imaging status is 'paused'")
+        finished, has_progress, error_flag = dataset.check_imaging_progress()  # maybe imaging resumed
+        if not has_progress:
+            return 'imaging_paused', False
+        else:
+            dataset.mark_has_imaging_progress()
+            dataset.mark_resumed()
+            # response = dataset.send_message('imaging_resumed')
+            # print(response)
+            return 'imaging', True
+    return 'finished', False
 
 
 def check_mesoSPIM_imaging():
@@ -245,6 +290,8 @@ def check_mesoSPIM_imaging():
                 file_path = file_path.parent
                 datasets.add(str(file_path))
     print("Unique datasets found: ", len(datasets))
+    datasets = set(shard(sorted(datasets), 'mesospim_dataset'))
+    print("Datasets handled by this worker: ", len(datasets))
     print(*datasets, sep="\n")
 
     for file_path in list(datasets):
@@ -260,23 +307,30 @@ def check_mesoSPIM_imaging():
                 dataset.send_message('ignoring_demo_dataset')
                 dataset.mark_imaging_finished()
                 dataset.update_processing_status('finished')
+                datasets.remove(file_path)
                 continue
             dataset.send_message('imaging_started')
-        dataset = MesoSPIMDataset(file_path)
-        # check whether imaging finished or paused
-        if dataset.imaging_status == 'in_progress':
-            dataset.check_imaging_progress()
-        # elif dataset.imaging_status == "finished" and not dataset.moved and dataset.moving:
-        #     dataset.check_if_moved()
-        # elif dataset.imaging_status == "finished" and not dataset.moved and not dataset.moving:
-        #     dataset.start_moving()  # TODO
-        # elif dataset.imaging_status == "finished" and dataset.moved and dataset.path_on_hive is not None and dataset.processing_status == 'not_started':
-        elif dataset.imaging_status == "finished" and dataset.processing_status == "not_started":
-            dataset.start_processing()
+    for_each([file_path for file_path in datasets if is_due(file_path)], check_mesoSPIM_imaging_progress)
+
+
+def check_mesoSPIM_imaging_progress(file_path):
+    dataset = MesoSPIMDataset(file_path)
+    # check whether imaging finished or paused
+    reschedule(file_path, 'imaging' if dataset.imaging_status == 'in_progress' else 'finished', True)
+    if dataset.imaging_status == 'in_progress':
+        dataset.check_imaging_progress()
+    # elif dataset.imaging_status == "finished" and not dataset.moved and dataset.moving:
+    #     dataset.check_if_moved()
+    # elif dataset.imaging_status == "finished" and not dataset.moved and not dataset.moving:
+    #     dataset.start_moving()  # TODO
+    # elif dataset.imaging_status == "finished" and dataset.moved and dataset.path_on_hive is not None and dataset.processing_status == 'not_started':
+    elif dataset.imaging_status == "finished" and dataset.processing_status == "not_started":
+        if dataset.start_processing():
             dataset.update_processing_status('in_progress')
             dataset.send_message('processing_started')
-        elif dataset.imaging_status == "paused":
-            pass  # TODO check status again
+            wake_stage('check_mesoSPIM_processing')
+    elif dataset.imaging_status == "paused":
+        pass  # TODO check status again
 
 
 def get_total_MesoSPIM_tiles(settings_bin_file):
@@ -330,7 +384,7 @@ def list_and_kill_jobs(user, job_name=None):
 
 
 def check_RSCM_processing():
-    con = sqlite3.connect(DB_LOCATION)
+    con = connect()
     cur = con.cursor()
     records = cur.execute(
         f'SELECT * FROM dataset WHERE processing_status="not_started" AND imaging_status="finished"'
@@ -350,32 +404,48 @@ def check_RSCM_processing():
         if dataset.check_being_stitched():
             dataset.update_processing_status('started')
             dataset.send_message('processing_started')
+        elif (dataset.delete_405 or dataset.processing_held) and \
+                get_queue_index().state_of(dataset.rscm_txt_file_name) is None:
+            # not queued yet: waiting for the 405 channel to be deleted, or for room (admitted once there is)
+            if dataset.check_channel_deletion() and '_cont_' not in dataset.name.lower():
+                dataset.start_processing()
 
     # =========================  check stitching  ============================
+    queue_index = get_queue_index()
+    print("Stitching queues:", queue_index.summary())
 
     records = cur.execute(
         'SELECT * FROM dataset WHERE processing_status="started"'
     ).fetchall()
     print("\nDataset instances where stitching started:")
-    for record in records:
-        dataset = RSCMDataset.initialize_from_db(record)
+    datasets = [RSCMDataset.initialize_from_db(record) for record in records]
+    if any(dataset.check_being_stitched() for dataset in datasets):
+        snapshot = get_cluster_snapshot()
+        print("Dask cluster:", snapshot, snapshot.task_counts)
+    for dataset in datasets:
         print("-----", dataset)
         if dataset.check_stitching_complete():
             print("File in complete dir")
             # path_on_hive = os.path.join(HIVE_ACQUISITION_FOLDER, dataset.pi, dataset.cl_number, dataset.name)
             # if os.path.exists(path_on_hive):  # copying started
-            if dataset.check_all_raw_composites_present() and dataset.check_all_raw_composites_same_size():
+            all_present = dataset.check_all_raw_composites_present()
+            all_same_size = dataset.check_all_raw_composites_same_size()
+            if all_present and all_same_size:
                 print("All composites present and same size")
                 dataset.update_processing_status('stitched')
             else:
-                print("All composites present: ", dataset.check_all_raw_composites_present())
-                print("All composites same size: ", dataset.check_all_raw_composites_same_size())
+                print("All composites present: ", all_present)
+                print("All composites same size: ", all_same_size)
+                manifest = dataset.raw_composites_manifest
+                print("Composite sizes:", dict(manifest.size_histogram), "outliers:", manifest.outliers[:10])
         elif dataset.check_stitching_errored():
             print("File in error dir")
             dataset.update_processing_status('paused')
             dataset.send_message('stitching_error')
         elif dataset.check_being_stitched():
-            print("File in processing dir")
+            print(f"File in processing dir for {queue_index.time_in_state(dataset.rscm_txt_file_name):.0f} s")
+            # progress comes from the dataset's composites, cluster activity isn't per dataset
+            # (see RSCMDataset.check_stitching_progress)
             has_progress = dataset.check_stitching_progress()
             if has_progress:
                 if dataset.processing_no_progress_time:
@@ -398,6 +468,9 @@ def check_RSCM_processing():
         'SELECT * FROM dataset WHERE processing_status="stitched"'
     ).fetchall()
     print("\nDatasets that have been stitched:")
+    if records:
+        cbpy_snapshot = get_cbpy_snapshot()
+        print("CBPy:", cbpy_snapshot.summary())
     # if records:  # there's something to be denoised
     #     script_name = './run_cbpy.sh'
     #     result = subprocess.run([script_name], check=True, text=True, capture_output=True)
@@ -410,16 +483,15 @@ def check_RSCM_processing():
     for record in records:
         dataset = RSCMDataset.initialize_from_db(record)
         print("-----", dataset)
+        dataset.refresh_paths()
         print("Job dir", dataset.job_dir)
         if dataset.job_dir:
             print("Job dir is there")
-            job_number = re.findall(r"\d+", os.path.basename(dataset.job_dir))[-1]
-            dataset.update_job_number(job_number)
-            denoising_started = len(glob(os.path.join(dataset.job_dir, "composite*.tif"))) > 0
+            denoising_started = dataset.denoised_composites_manifest.count > 0
             print("Denoising started:", denoising_started)
             if not denoising_started:
                 # TODO: check the # of queued files == number of composites ?
-                in_queue = len(glob(os.path.join(CBPY_FOLDER, 'queueGPU', f"job_{dataset.job_number}*"))) > 0
+                in_queue = cbpy_snapshot.queued_for_job(dataset.job_number) > 0
                 print("In queue:", in_queue)
                 if in_queue:
                     if dataset.processing_no_progress_time:
@@ -481,13 +553,12 @@ def check_RSCM_processing():
     for record in records:
         dataset = RSCMDataset.initialize_from_db(record)
         print("-----", dataset)
+        dataset.refresh_paths()
         if os.path.exists(dataset.full_path_to_imaris_file):
             print("Imaris file exists")
-            try:
-                # try to open imaris file
-                ims_file = ims(dataset.full_path_to_imaris_file)
-            except Exception as e:
-                log.error(f"ERROR opening imaris file: {e}")
+            verdict = probe_ims(dataset.full_path_to_imaris_file)
+            if verdict != IMS_OK:
+                log.error(f"ERROR checking imaris file: {verdict}")
                 dataset.send_message("broken_ims_file")
                 dataset.update_processing_status('paused')
                 # dataset.requeue_ims()
@@ -496,7 +567,8 @@ def check_RSCM_processing():
                 processing_summary = dataset.get_processing_summary()
                 value_from_db = processing_summary.get('building_ims')
                 if value_from_db:
-                    value_from_db.update({'ims_size': 0})
+                    value_from_db.update({'ims_size': 0, 'samples': []})
+                    value_from_db.pop('eta_reported', None)
                     dataset.update_processing_summary({'building_ims': value_from_db})
                 continue
             else:
@@ -526,6 +598,27 @@ def check_RSCM_processing():
         else:
             # ims file is not being built
             print("Imaris file is not being built")
+            job = Job.get_latest(dataset.db_id, 'build_ims')
+            print("Imaris build job:", job)
+            if job is None or not job.is_active:
+                # the job ended without an Imaris file (failed, lost with its host, or finished without output)
+                retries = dataset.get_processing_summary().get('ims_build_retries', 0)
+                if job is not None and retries >= JOB_RETRIES.get('build_ims', 0):
+                    log.error(f"{job} ended without an Imaris file, see {job.log_path}")
+                    dataset.update_processing_summary({
+                        'ims_build_retries': 0,  # a dataset resumed by hand gets its retries again
+                        'ims_build_failed': {
+                            'job': job.db_id, 'status': job.status, 'exit_code': job.exit_code,
+                            'log_path': job.log_path
+                        }
+                    })
+                    dataset.update_processing_status('paused')
+                    dataset.send_message('ims_build_failed')
+                else:
+                    if job is not None:
+                        log.error(f"{job} ended without an Imaris file, launching it again")
+                        dataset.update_processing_summary({'ims_build_retries': retries + 1})
+                    dataset.build_imaris_file()
             # in_queue = os.path.exists(os.path.join(RSCM_FOLDER_BUILDING_IMS, 'queueIMS', dataset.imsqueue_file_name))
             # if dataset.in_imaris_queue:
             #     if dataset.processing_no_progress_time:
@@ -561,17 +654,22 @@ def check_RSCM_processing():
     ).fetchall()
     for record in records:
         dataset = RSCMDataset.initialize_from_db(record)
+        if not is_due(('finished', dataset.db_id)):
+            continue
+        reschedule(('finished', dataset.db_id), 'finished', False)
+        dataset.refresh_paths()
         path_on_hive = os.path.join(HIVE_ACQUISITION_FOLDER, dataset.pi, dataset.cl_number, dataset.name)
         if os.path.exists(os.path.join(path_on_hive, 'vs_series.dat')):
             dataset.update_path_on_hive(path_on_hive)
         final_ims_file_path = os.path.join(path_on_hive, 'composites_RSCM_v0.1', f'job_{dataset.job_number}', dataset.imaris_file_name)
+        if dataset.imaris_file_path == final_ims_file_path:
+            continue
         if os.path.exists(final_ims_file_path):
-            try:
-                ims_file = ims(final_ims_file_path)
-            except Exception as e:
+            verdict = probe_ims(final_ims_file_path)
+            if verdict != IMS_OK:
                 # probably still copying
-                # TODO check size?
-                log.error(e)
+                log.error(f"Imaris file {final_ims_file_path}: {verdict}")
+                reschedule(('finished', dataset.db_id), 'finished', True)
                 continue
             else:
                 # update db, send msg
@@ -581,37 +679,38 @@ def check_RSCM_processing():
 
     # ==================== Handle 'paused' processing status ==================
     records = cur.execute(
-        'SELECT * FROM dataset WHERE processing_status="paused"'
+        'SELECT * FROM dataset WHERE modality = "rscm" AND processing_status="paused"'
     ).fetchall()
     print("\nDatasets that are in paused status:")
     for record in records:
-        dataset = Dataset.initialize_from_db(record)
+        dataset = RSCMDataset.initialize_from_db(record)
         print("-----", dataset)
-        # TODO: see what stage processing is in
-        guessed_processing_status = dataset.guess_processing_status()
-        print("guessed_processing_status:", guessed_processing_status)
-        # TODO: see if there's any progress at this stage
-        progress_methods_map = {
-            "started": dataset.check_stitching_progress,
-            "stitched": dataset.check_denoising_progress,
-            "denoised": dataset.check_ims_building_progress,
-            # "built_ims": dataset.check_finalization_progress
-        }
-        has_progress = progress_methods_map[guessed_processing_status]()
-        print("has progress", has_progress)
-        if has_progress:
+        if dataset.rscm_txt_file_name in queue_index.changed:  # e.g. requeued by hand
+            wake_dataset(dataset.db_id)
+        if not is_due(('paused', dataset.db_id)):
+            print("Not checking until later")
+            continue
+        if dataset.get_processing_summary().get('move_failed'):
+            print("Moving failed, waiting to be resumed by hand")  # by setting processing_status back to finished
+            continue
+        dataset.refresh_paths()
+        confirmed_stage, has_progress = dataset.recover()
+        print("confirmed stage:", confirmed_stage, "has progress:", has_progress)
+        reschedule(('paused', dataset.db_id), 'processing_paused', has_progress)
+        if confirmed_stage == "finished":
             dataset.mark_has_processing_progress()
-            dataset.update_processing_status(guessed_processing_status)
-        print("guessed_processing_status", guessed_processing_status)
-        print("dataset.job_dir", dataset.job_dir)
-        print("os.path.exists(dataset.job_dir)", os.path.exists(dataset.job_dir))
-        if guessed_processing_status == "finished" and dataset.job_dir.startswith('/CBI_FastStore') and os.path.exists(dataset.job_dir):
-            dataset.start_moving()
+            dataset.update_processing_status('finished')
+            print("dataset.job_dir", dataset.job_dir)
+            if dataset.job_dir and dataset.job_dir.startswith('/CBI_FastStore') and os.path.exists(dataset.job_dir):
+                dataset.start_moving()
+        elif has_progress:
+            dataset.mark_has_processing_progress()
+            dataset.update_processing_status(confirmed_stage)
 
 
 def check_moving():
     print("Checking MesoSPIM moving")
-    con = sqlite3.connect(DB_LOCATION)
+    con = connect()
     cur = con.cursor()
     records = cur.execute(
         f'SELECT path_on_fast_store FROM dataset WHERE processing_status="finished" AND moved=0'
@@ -636,7 +735,7 @@ def check_moving():
 
 def check_mesoSPIM_processing():
     print("Checking MesoSPIM processing")
-    con = sqlite3.connect(DB_LOCATION)
+    con = connect()
     cur = con.cursor()
     records = cur.execute(
         f'SELECT path_on_fast_store FROM dataset WHERE modality = "mesospim" AND processing_status="in_progress"'
@@ -656,102 +755,172 @@ def check_mesoSPIM_processing():
                     dataset.update_processing_status('finished')
                     dataset.send_message('processing_finished')
                     dataset.start_moving()
+                    continue
                 else:
                     print("Found broken ims files")
             else:
                 print("processing still in progress")
-    # TODO message if processing paused
+            job = Job.get_latest(dataset.db_id, 'mesospim_convert')
+            print("Conversion job:", job)
+            if job is None or not job.is_active:
+                # the job ended without all Imaris files (failed, lost with its host, or finished without output)
+                retries = dataset.get_processing_summary().get('mesospim_convert_retries', 0)
+                if job is not None and retries >= JOB_RETRIES.get('mesospim_convert', 0):
+                    log.error(f"{job} ended without all Imaris files, see {job.log_path}")
+                    dataset.update_processing_summary({
+                        'mesospim_convert_retries': 0,  # a dataset resumed by hand gets its retries again
+                        'mesospim_convert_failed': {
+                            'job': job.db_id, 'status': job.status, 'exit_code': job.exit_code,
+                            'log_path': job.log_path
+                        }
+                    })
+                    dataset.update_processing_status('paused')
+                    dataset.send_message('mesospim_convert_failed')
+                else:
+                    if job is not None:
+                        log.error(f"{job} ended without all Imaris files, launching it again")
+                        dataset.update_processing_summary({'mesospim_convert_retries': retries + 1})
+                    dataset.start_processing()
 
 
 def check_storage():
+    def activate(warning_type, details=None):
+        """
+        if active warning exists and message sent - do nothing
+        elif active warning exists and message not sent - send warning msg
+        elif inactive warning exists - make warning active, send warning msg
+        else create new active warning, send warning msg
+        """
+        warning = Warning.get_from_db(warning_type)
+        if warning and warning.active:
+            if not warning.message_sent:
+                warning.send_message(details)
+        elif warning and not warning.active:
+            warning.mark_as_active()
+            warning.send_message(details)
+        else:  # record doesn't exist
+            warning = Warning.create(warning_type)
+            warning.send_message(details)
+
+    def deactivate(warning_type):
+        # if active warning exists, make it inactive, make message_sent=False
+        warning = Warning.get_from_db(warning_type)
+        if warning and warning.active:
+            warning.mark_as_inactive()
+
     def check(used_percent, storage_unit):
         """
         :param used_percent:
         :param storage_unit: "hive" or "faststore"
         :return:
         """
+        details = f"at {used_percent:.1f}%; {describe_top_consumers(storage_unit)}".rstrip('; ')
         if used_percent >= MAX_ALLOWED_STORAGE_PERCENT:
-            # if active warning exists and message sent - do nothing
-            # elif active warning exists and message not sent - send warning msg
-            # elif inactive warning exists - make warning active, send warning msg
-            # else create new active warning, send warning msg
-            warning = Warning.get_from_db(f'low_space_{storage_unit}')
-            if warning and warning.active:
-                if not warning.message_sent:
-                    warning.send_message()
-            elif warning and not warning.active:
-                warning.mark_as_active()
-                warning.send_message()
-            else:  # record doesn't exist
-                warning = Warning.create(f'low_space_{storage_unit}')
-                warning.send_message()
+            activate(f'low_space_{storage_unit}', details)
         elif used_percent >= STORAGE_THRESHOLD_1:
-            warning = Warning.get_from_db(f'space_{storage_unit}_thr1')
-            if warning and warning.active:
-                if not warning.message_sent:
-                    warning.send_message()
-            elif warning and not warning.active:
-                warning.mark_as_active()
-                warning.send_message()
-            else:  # record doesn't exist
-                warning = Warning.create(f'space_{storage_unit}_thr1')
-                warning.send_message()
+            activate(f'space_{storage_unit}_thr1', details)
             # inactivate more critical warning
-            warning = Warning.get_from_db(f'low_space_{storage_unit}')
-            if warning and warning.active:
-                warning.mark_as_inactive()
+            deactivate(f'low_space_{storage_unit}')
         elif used_percent >= STORAGE_THRESHOLD_0:
-            warning = Warning.get_from_db(f'space_{storage_unit}_thr0')
-            if warning and warning.active:
-                if not warning.message_sent:
-                    warning.send_message()
-            elif warning and not warning.active:
-                warning.mark_as_active()
-                warning.send_message()
-            else:  # record doesn't exist
-                warning = Warning.create(f'space_{storage_unit}_thr0')
-                warning.send_message()
+            activate(f'space_{storage_unit}_thr0', details)
             # inactivate more critical warning
-            warning = Warning.get_from_db(f'space_{storage_unit}_thr1')
-            if warning and warning.active:
-                warning.mark_as_inactive()
+            deactivate(f'space_{storage_unit}_thr1')
         else:
-            warning = Warning.get_from_db(f'space_{storage_unit}_thr0')
-            # if active warning exists, make it inactive, make message_sent=False
-            if warning and warning.active:
-                warning.mark_as_inactive()
-            # else do nothing
-
-    cmd = ["df", "-h"]
-    ret = subprocess.run(cmd, capture_output=True)
-    output = ret.stdout.decode()
-    output_rows = output.split('\n')
-    beegfs_nodes = [x for x in output_rows if x.startswith('beegfs')]
-    hive = [x for x in beegfs_nodes if x.endswith('h20')][0]
-    faststore = [x for x in beegfs_nodes if x.endswith('FastStore')][0]
-    faststore_used_percent_str = [x for x in faststore.split() if x.endswith("%")][0]
-    hive_used_percent_str = [x for x in hive.split() if x.endswith("%")][0]
-    faststore_used_percent = int(faststore_used_percent_str.replace("%", ""))
-    hive_used_percent = int(hive_used_percent_str.replace("%", ""))
-    check(hive_used_percent, "hive")
-    check(faststore_used_percent, "faststore")
+            deactivate(f'space_{storage_unit}_thr0')
+
+    def check_forecast(usage, storage_unit):
+        """
+        Warn before a threshold is crossed if the fill rate of the last STORAGE_FORECAST_WINDOW
+        reaches it within STORAGE_FORECAST_HORIZON
+        """
+        prediction = forecast(storage_unit, usage)
+        for percent, warning_type in [
+            (STORAGE_THRESHOLD_1, f'forecast_space_{storage_unit}_thr1'),
+            (MAX_ALLOWED_STORAGE_PERCENT, f'forecast_low_space_{storage_unit}'),
+        ]:
+            seconds = prediction[percent]
+            if seconds is not None and 0 < seconds <= STORAGE_FORECAST_HORIZON:
+                print(f"{storage_unit} reaches {percent}% in {format_duration(seconds)}")
+                rate_tb_per_hour = prediction['rate'] * 3600 / 2 ** 40
+                details = f"in about {format_duration(seconds)} at {rate_tb_per_hour:.2f} TB/h"
+                consumers = describe_top_consumers(storage_unit)
+                activate(warning_type, f"{details}; {consumers}" if consumers else details)
+            else:  # not filling up that fast, or already crossed and warned about by check()
+                deactivate(warning_type)
+
+    for storage_unit, usage in sample_mounts().items():
+        print(f"{storage_unit}: {usage['used_percent']:.2f}% used, {usage['available_bytes'] / 2 ** 40:.2f} TB available")
+        check(usage['used_percent'], storage_unit)
+        check_forecast(usage, storage_unit)
+
+
+def account_usage():
+    """
+    Bytes used per dataset, cl number and pi, recomputed only for directories that changed
+    """
+    for storage_unit, root in USAGE_ROOTS.items():
+        account(storage_unit, root)
+        print(f"{storage_unit} {describe_top_consumers(storage_unit)}")
+
+
+def update_reservations():
+    """
+    Projected and written bytes of the datasets still imaging or processing, what new processing is admitted
+    against. Finished datasets get one more update that marks their stages complete, the ratios are learned from them.
+    """
+    con = connect()
+    cur = con.cursor()
+    condition = 'processing_status != "finished" OR id IN (SELECT dataset_id FROM volume_reservation WHERE complete = 0)'
+    rscm_records = cur.execute(f'SELECT * FROM dataset WHERE modality = "rscm" AND ({condition})').fetchall()
+    mesospim_paths = cur.execute(
+        f'SELECT path_on_fast_store FROM dataset WHERE modality = "mesospim" AND ({condition})'
+    ).fetchall()
+    con.close()
+    for_each(rscm_records, lambda record: RSCMDataset.initialize_from_db(record).update_volume())
+    for_each([path for path, in mesospim_paths], lambda path: MesoSPIMDataset(path).update_volume())
+
+
+def purge_trash():
+    """
+    Free the space of what's been in the trash long enough, or sooner when the storage is filling up
+    """
+    for storage_unit, location in TRASH_LOCATIONS.items():
+        if not os.path.exists(location):
+            continue
+        register_untracked(storage_unit, location)
+        reclaimed = purge(storage_unit, location)
+        print(f"{storage_unit} trash: {reclaimed / 2 ** 40:.2f} TB reclaimed")
 
 
 def move_files():
-    print("Can data be moved now? ", can_be_moved())
-    if can_be_moved():
-        # move all files from tempQueue to QueueStitch
-        files_in_temp_queue = sorted(glob(os.path.join(RSCM_FOLDER_STITCHING, 'tempQueue', '*move.txt')))
-        for file in files_in_temp_queue:
-            path_in_queue = os.path.join(RSCM_FOLDER_STITCHING, 'queueStitch', os.path.basename(file))
+    """
+    Keep in queueStitch only the move files the transfer scheduler releases, the rest wait in tempQueue.
+    Native moves (move_dataset jobs) are started when released.
+    """
+    queue_index = get_queue_index()
+    stitching_active = len(queue_index.files_in('processing')) > len(queue_index.files_in('processing', 'move.txt'))
+    release = schedule_moves(queue_index, stitching_active)
+    for file_name in queue_index.files_in('tempQueue', 'move.txt'):
+        if file_name in release:
+            file = queue_index.path(file_name, 'tempQueue')
+            path_in_queue = queue_index.path(file_name, 'queueStitch')
             print("moving", file, "to", path_in_queue)
             shutil.move(file, path_in_queue)
-    else:
-        # move all files from QueueStitch to tempQueue
-        files_in_queue = sorted(glob(os.path.join(RSCM_FOLDER_STITCHING, 'queueStitch', '*move.txt')))
-        for file in files_in_queue:
-            path_in_temp_queue = os.path.join(RSCM_FOLDER_STITCHING, 'tempQueue', os.path.basename(file))
-            shutil.move(file, path_in_temp_queue)
+            queue_index.record_move(file_name, 'queueStitch')
+    for file_name in queue_index.files_in('queueStitch', 'move.txt'):
+        if file_name not in release:
+            shutil.move(queue_index.path(file_name, 'queueStitch'), queue_index.path(file_name, 'tempQueue'))
+            queue_index.record_move(file_name, 'tempQueue')
+    running = len(Job.get_by_status('running', 'move_dataset'))
+    queued = {f"{JOB_PREFIX}{job.db_id}": job for job in Job.get_by_status('queued', 'move_dataset')}
+    for job in [queued[name] for name in release if name in queued]:  # by priority
+        if running < JOB_CONCURRENCY['move_dataset']:
+            try:
+                if job.start():
+                    running += 1
+            except OSError as e:
+                log.error(f"Could not start {job}: {e}")
+                job.mark_finished(None)
 
 
 def check_analysis():
@@ -759,7 +928,7 @@ def check_analysis():
     If the finished dataset is a brain, send it for analysis by PEACE pipeline
     """
     print("Checking analysis...")
-    con = sqlite3.connect(DB_LOCATION)
+    con = connect()
     cur = con.cursor()
     records = cur.execute(
         f'SELECT * FROM dataset WHERE processing_status="finished" AND is_brain=1'
@@ -773,25 +942,33 @@ def check_analysis():
 
 def scan():
     try:
-        check_storage()
-        check_RSCM_imaging()
-        check_mesoSPIM_imaging()
-        check_RSCM_processing()
-        check_mesoSPIM_processing()
-        move_files()
-        check_moving()
-        # TODO db_backup()
-        # check_analysis()
+        start_new_cycle()
+        for job in poll_jobs():
+            # react to finished jobs in this cycle instead of the next scheduled run
+            wake_dataset(job.dataset_id)
+            wake_stage({
+                'build_ims': 'check_RSCM_processing',
+                'move_dataset': 'check_moving',
+            }.get(job.command_name, 'check_mesoSPIM_processing'))
+        # stages that aren't split by dataset run on one worker only
+        own_stages = shard([stage.name for stage in SCAN_STAGES if not stage.sharded], 'stage')
+        run_stages([stage for stage in due_stages(SCAN_STAGES) if stage.sharded or stage.name in own_stages])
     except Exception as e:
         log.error(f"\nEXCEPTION: {e}\n")
         print(traceback.format_exc())
+    finally:
+        flush_notifications()
 
-    print("========================== Waiting 61 seconds ========================")
-    time.sleep(61)
+    wait_for_next_run(SCAN_STAGES)
 
 
 def scan_debug():
+    start_new_cycle()
+    poll_jobs()
     check_storage()
+    account_usage()
+    update_reservations()
+    purge_trash()
     check_RSCM_imaging()
     check_mesoSPIM_imaging()
     check_RSCM_processing()
@@ -800,12 +977,29 @@ def scan_debug():
     check_moving()
     # TODO db_backup()
     # check_analysis()
+    flush_notifications()
     time.sleep(10)
 
 
+# stages that write queue files or start moving come after the ones that produce them
+SCAN_STAGES = [
+    Stage(check_storage),
+    Stage(account_usage),
+    Stage(update_reservations),
+    Stage(purge_trash),
+    Stage(check_RSCM_imaging, sharded=True),
+    Stage(check_mesoSPIM_imaging, sharded=True),
+    Stage(check_RSCM_processing, after=['check_RSCM_imaging']),
+    Stage(check_mesoSPIM_processing, after=['check_mesoSPIM_imaging']),
+    Stage(move_files, after=['check_RSCM_processing']),
+    Stage(check_moving, after=['move_files', 'check_mesoSPIM_processing']),
+]
+
+
 if __name__ == "__main__":
+    setup_logging()
+    start_heartbeat()
+    start_sender()
     while True:
         scan()
         # scan_debug()
-        print("========================== Waiting 59 seconds ========================")
-        time.sleep(59)
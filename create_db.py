@@ -1,7 +1,8 @@
 import sqlite3
+import sys
 
-# Specify the path and name of the database file
-db_file = "/CBI_FastStore/Iana/RSCM_MesoSPIM_datasets.db"  # File will be created in the current working directory
+# Specify the path and name of the database file, e.g. python create_db.py /tmp/test.db
+db_file = sys.argv[1] if len(sys.argv) > 1 else "/CBI_FastStore/Iana/RSCM_MesoSPIM_datasets.db"
 
 # Connect to the database (this creates the file if it doesn't exist)
 connection = sqlite3.connect(db_file)
@@ -260,3 +261,252 @@ connection = sqlite3.connect(db_file)
 # finally:
 #     # Close the connection
 #     connection.close()
+
+
+# ### Background jobs (IMS builds, MesoSPIM conversion)
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `job` (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `dataset_id` INTEGER,
+        `command_name` TEXT NOT NULL,
+        `cmd` TEXT NOT NULL,
+        `status` TEXT NOT NULL DEFAULT 'queued',
+        `pid` INTEGER,
+        `exit_code` INTEGER,
+        `log_path` TEXT,
+        `created` TEXT,
+        `started` TEXT,
+        `finished` TEXT,
+        `host` TEXT,
+        FOREIGN KEY(`dataset_id`) REFERENCES dataset (id) ON DELETE SET NULL
+    )
+    """
+    cursor.execute(create_table_query)
+    print("Table 'job' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Slack messages waiting to be delivered
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `outbox` (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `created` TEXT,
+        `payload` TEXT NOT NULL,
+        `status` TEXT NOT NULL DEFAULT 'pending',
+        `attempts` INTEGER DEFAULT 0,
+        `next_attempt` REAL,
+        `error` TEXT,
+        `ts` TEXT,
+        `sent` TEXT,
+        `dataset_id` INTEGER,
+        `warning_id` INTEGER,
+        `msg_type` TEXT,
+        `in_thread` INTEGER DEFAULT 0,
+        `thread_ts` TEXT,
+        FOREIGN KEY(`dataset_id`) REFERENCES dataset (id) ON DELETE SET NULL,
+        FOREIGN KEY(`warning_id`) REFERENCES warning (id) ON DELETE SET NULL
+    )
+    """
+    cursor.execute(create_table_query)
+    print("Table 'outbox' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Host the job was started on, only that host can check its pid
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(job)").fetchall()]
+    if 'host' not in columns:  # tables created before the column existed
+        alter_table_query = """
+        ALTER TABLE job
+        ADD COLUMN `host` TEXT
+        """
+        cursor.execute(alter_table_query)
+        print("Column 'host' added successfully to the 'job' table.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Leases: which check_status worker handles which dataset or stage
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `lease` (
+        `name` TEXT NOT NULL PRIMARY KEY,
+        `owner` TEXT NOT NULL,
+        `acquired` REAL,
+        `expires` REAL NOT NULL
+    )
+    """
+    cursor.execute(create_table_query)
+    print("Table 'lease' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Storage usage samples, written by check_storage
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `storage_sample` (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `unit` TEXT NOT NULL,
+        `taken` REAL NOT NULL,
+        `used_percent` REAL,
+        `size_bytes` INTEGER,
+        `used_bytes` INTEGER,
+        `available_bytes` INTEGER
+    )
+    """
+    cursor.execute(create_table_query)
+    cursor.execute("CREATE INDEX IF NOT EXISTS `storage_sample_unit_taken` ON `storage_sample` (`unit`, `taken`)")
+    print("Table 'storage_sample' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Disk usage accounting: per-directory cache and totals per pi, cl number and dataset
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `dir_usage` (
+        `path` TEXT NOT NULL PRIMARY KEY,
+        `mtime` REAL NOT NULL,
+        `file_bytes` INTEGER NOT NULL,
+        `file_count` INTEGER NOT NULL,
+        `subdirs` TEXT NOT NULL,
+        `scanned` REAL NOT NULL
+    )
+    """
+    cursor.execute(create_table_query)
+    print("Table 'dir_usage' added successfully.")
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `usage_total` (
+        `unit` TEXT NOT NULL,
+        `level` TEXT NOT NULL,
+        `name` TEXT NOT NULL,
+        `bytes` INTEGER NOT NULL,
+        `files` INTEGER NOT NULL,
+        `updated` REAL NOT NULL,
+        PRIMARY KEY (`unit`, `level`, `name`)
+    )
+    """
+    cursor.execute(create_table_query)
+    print("Table 'usage_total' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Expected volume of every stage of a dataset, reserved on the storage unit it's written to
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `volume_reservation` (
+        `dataset_id` INTEGER NOT NULL,
+        `stage` TEXT NOT NULL,
+        `unit` TEXT NOT NULL,
+        `projected_bytes` INTEGER NOT NULL,
+        `written_bytes` INTEGER NOT NULL DEFAULT 0,
+        `admitted` INTEGER NOT NULL DEFAULT 0,
+        `complete` INTEGER NOT NULL DEFAULT 0,
+        `updated` REAL NOT NULL,
+        PRIMARY KEY (`dataset_id`, `stage`)
+    )
+    """
+    cursor.execute(create_table_query)
+    print("Table 'volume_reservation' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Trash entries: what was moved to the trash, and when it was purged
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `trash_entry` (
+        `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `dataset_id` INTEGER,
+        `kind` TEXT NOT NULL,
+        `unit` TEXT NOT NULL,
+        `path` TEXT NOT NULL,
+        `bytes` INTEGER NOT NULL,
+        `files` INTEGER NOT NULL,
+        `trashed` REAL NOT NULL,
+        `purged` REAL
+    )
+    """
+    cursor.execute(create_table_query)
+    print("Table 'trash_entry' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
+
+
+# ### Datasets covered by a digest message, the digest becomes their thread
+try:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS `outbox_dataset` (
+        `outbox_id` INTEGER NOT NULL,
+        `dataset_id` INTEGER NOT NULL,
+        PRIMARY KEY (`outbox_id`, `dataset_id`),
+        FOREIGN KEY(`outbox_id`) REFERENCES outbox (id) ON DELETE CASCADE,
+        FOREIGN KEY(`dataset_id`) REFERENCES dataset (id) ON DELETE CASCADE
+    )
+    """
+    cursor.execute(create_table_query)
+    cursor.execute("CREATE INDEX IF NOT EXISTS `outbox_dataset_dataset` ON `outbox_dataset` (`dataset_id`)")
+    print("Table 'outbox_dataset' added successfully.")
+
+except sqlite3.Error as e:
+    print(f"An error occurred: {e}")
+finally:
+    connection.close()
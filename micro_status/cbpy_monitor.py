@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+
+from bs4 import BeautifulSoup
+
+from .settings import *
+from .utils import current_cycle
+
+log = logging.getLogger(__name__)
+
+_snapshot = None
+_lock = threading.Lock()
+# job xml path -> (mtime, output directory)
+_xml_cache = {}
+# output directory -> [(time, denoised composites)]
+_history = {}
+
+
+def count_composites(directory):
+    try:
+        with os.scandir(directory) as it:
+            return sum(1 for entry in it if entry.name.startswith('composite') and entry.name.endswith('.tif'))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+
+
+def parse_job_xml(path, mtime):
+    """
+    Output directory of a CBPy job, the xml is parsed again only if it changed.
+    """
+    cached = _xml_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'r') as f:
+        content = f.read()
+    out_dir = None
+    if len(content):
+        soup = BeautifulSoup(content, "xml")
+        tag = soup.find('outFilePathUnix')
+        out_dir = tag.text if tag else None
+    _xml_cache[path] = (mtime, out_dir)
+    return out_dir
+
+
+class CBPySnapshot:
+    """
+    State of the CBPy denoising queue, taken once per scan cycle and shared by all stitched datasets.
+    queued: file names in queueGPU
+    active: list of {'xml': path, 'out_dir': str, 'denoised': int} for the jobs in 'active'
+    """
+    def __init__(self, queued=None, active=None, taken_at=None, cycle=None):
+        self.queued = queued or []
+        self.active = active or []
+        self.taken_at = taken_at or time.time()
+        self.cycle = cycle
+
+    def __str__(self):
+        return f"CBPySnapshot({self.queue_depth} queued, {len(self.active)} active)"
+
+    @classmethod
+    def take(cls, folder=None):
+        folder = folder or CBPY_FOLDER
+        now = time.time()
+        try:
+            with os.scandir(os.path.join(folder, 'queueGPU')) as it:
+                queued = sorted(entry.name for entry in it)
+        except FileNotFoundError:
+            log.error(f"CBPy queue {os.path.join(folder, 'queueGPU')} doesn't exist")
+            queued = []
+
+        active = []
+        try:
+            with os.scandir(os.path.join(folder, 'active')) as it:
+                xml_entries = sorted((entry for entry in it if '.xml' in entry.name), key=lambda x: x.name)
+                xml_files = [(entry.path, entry.stat().st_mtime) for entry in xml_entries]
+        except FileNotFoundError:
+            xml_files = []
+        for path, mtime in xml_files:
+            try:
+                out_dir = parse_job_xml(path, mtime)
+            except OSError:  # job finished while we were looking
+                continue
+            if not out_dir:
+                continue
+            denoised = count_composites(out_dir)
+            history = _history.setdefault(out_dir, [])
+            history.append((now, denoised))
+            del history[:-CBPY_HISTORY_LENGTH]
+            active.append({'xml': path, 'out_dir': out_dir, 'denoised': denoised})
+        active_dirs = set(job['out_dir'] for job in active)
+        for out_dir in list(_history):
+            if out_dir not in active_dirs:
+                del _history[out_dir]
+        return cls(queued=queued, active=active, taken_at=now, cycle=current_cycle())
+
+    @property
+    def queue_depth(self):
+        return len(self.queued)
+
+    def queued_for_job(self, job_number):
+        prefix = f"job_{job_number}"
+        # job_12 must not count as job_1
+        return sum(
+            1 for name in self.queued
+            if name.startswith(prefix) and not name[len(prefix):len(prefix) + 1].isdigit()
+        )
+
+    def rate(self, out_dir):
+        """
+        :return: composites denoised per minute over the recent history of the job
+        """
+        history = _history.get(out_dir, [])
+        if len(history) < 2 or history[-1][0] <= history[0][0]:
+            return 0
+        (t0, n0), (t1, n1) = history[0], history[-1]
+        return max(n1 - n0, 0) / (t1 - t0) * 60
+
+    @property
+    def total_rate(self):
+        return sum(self.rate(job['out_dir']) for job in self.active)
+
+    @property
+    def backlog_eta(self):
+        """
+        :return: minutes to denoise everything in queueGPU at the current rate, None if nothing is moving
+        """
+        if not self.queue_depth:
+            return 0
+        if not self.total_rate:
+            return None
+        return self.queue_depth / self.total_rate
+
+    def summary(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'active': [
+                {'out_dir': job['out_dir'], 'denoised': job['denoised'],
+                 'per_minute': round(self.rate(job['out_dir']), 2)}
+                for job in self.active
+            ],
+            'backlog_eta_minutes': None if self.backlog_eta is None else round(self.backlog_eta),
+        }
+
+
+def get_cbpy_snapshot():
+    """
+    CBPy snapshot for the current scan cycle, taken on first use.
+    """
+    global _snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.cycle != current_cycle():
+            _snapshot = CBPySnapshot.take()
+        return _snapshot
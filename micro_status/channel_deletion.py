@@ -0,0 +1,141 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .leases import acquire, holds, release
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+_running = {}  # dataset id -> ChannelDeletion running in this process
+_lock = threading.Lock()
+
+
+def channel_dirs(root, layer_names, channel):
+    """
+    {root}/{layer}/{channel}* of every layer. Layers are listed only until one has the channel, to learn
+    the name of its directory, the other paths are built from the layer names (a deletion that was
+    interrupted may have to list a few). If none of the layers is there under the expected name,
+    root is listed once for them.
+    """
+    layers = [os.path.join(root, name) for name in layer_names]
+    if not any(os.path.isdir(layer) for layer in layers[:1] + layers[-1:]):
+        with os.scandir(root) as it:
+            layers = sorted(entry.path for entry in it if entry.is_dir() and 'layer' in entry.name)
+    for layer in layers:
+        try:
+            with os.scandir(layer) as it:
+                names = [entry.name for entry in it if entry.name.startswith(channel) and entry.is_dir()]
+        except FileNotFoundError:
+            continue
+        if names:
+            return [os.path.join(layer, name) for layer in layers for name in names]
+    return []
+
+
+def delete_dir(path):
+    """
+    :return: bytes freed, 0 if it was already gone
+    """
+    freed = 0
+    try:
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    freed += os.lstat(os.path.join(dir_path, file_name)).st_size
+                except FileNotFoundError:
+                    continue
+        shutil.rmtree(path)
+    except FileNotFoundError:
+        pass
+    return freed
+
+
+class ChannelDeletion:
+    """
+    Deletion of one channel of a dataset, a directory per layer on CHANNEL_DELETE_WORKERS threads.
+    on_progress is called with the summary every CHANNEL_DELETE_PROGRESS_INTERVAL, on_complete once at the end.
+    """
+    def __init__(self, dataset_id, root, channel, layer_names, on_progress=None, on_complete=None):
+        self.dataset_id = dataset_id
+        self.root = root
+        self.channel = channel
+        self.layer_names = layer_names
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.dirs = 0
+        self.deleted = 0
+        self.freed_bytes = 0
+        self.started = None
+        self._lock = threading.Lock()
+        self._last_progress = 0
+
+    @property
+    def lease(self):
+        return f"channel_deletion:{self.dataset_id}"
+
+    def summary(self, state='running'):
+        with self._lock:
+            return {
+                'channel': self.channel,
+                'state': state,
+                'dirs': self.dirs,
+                'deleted': self.deleted,
+                'freed_bytes': self.freed_bytes,
+                'started': self.started,
+                'updated': time.time(),
+            }
+
+    def delete(self, path):
+        freed = delete_dir(path)
+        with self._lock:
+            self.deleted += 1
+            self.freed_bytes += freed
+            report = time.time() - self._last_progress > CHANNEL_DELETE_PROGRESS_INTERVAL
+            if report:
+                self._last_progress = time.time()
+        if report:
+            log.info(f"Deleting channel {self.channel} of dataset {self.dataset_id}: {self.deleted}/{self.dirs} "
+                     f"directories, {self.freed_bytes / 2 ** 30:.1f} GB freed")
+            if self.on_progress:
+                self.on_progress(self.summary())
+
+    def run(self):
+        try:
+            self.started = time.time()
+            paths = [path for path in channel_dirs(self.root, self.layer_names, self.channel) if os.path.isdir(path)]
+            self.dirs = len(paths)
+            log.info(f"Deleting channel {self.channel} of dataset {self.dataset_id}: {self.dirs} directories in {self.root}")
+            with ThreadPoolExecutor(max_workers=CHANNEL_DELETE_WORKERS, thread_name_prefix='channel') as pool:
+                list(pool.map(self.delete, paths))
+            summary = self.summary('done')
+            log.info(f"Deleted channel {self.channel} of dataset {self.dataset_id}: {self.deleted} directories, "
+                     f"{self.freed_bytes / 2 ** 30:.1f} GB freed in {time.time() - self.started:.0f} s")
+            if self.on_complete:
+                self.on_complete(summary)
+        except Exception as e:  # retried from the start by the next check, deleted directories aren't found again
+            log.error(f"Deleting channel {self.channel} of dataset {self.dataset_id} failed: {e}")
+        finally:
+            with _lock:
+                _running.pop(self.dataset_id, None)
+            release(self.lease)
+
+
+def start_deletion(dataset_id, root, channel, layer_names, on_progress=None, on_complete=None):
+    """
+    Start deleting the channel in the background, unless it's already being deleted here or by another worker
+    (which holds the lease of the deletion until it's done).
+    :return: True if it's being deleted by this worker
+    """
+    deletion = ChannelDeletion(dataset_id, root, channel, layer_names, on_progress, on_complete)
+    with _lock:
+        if dataset_id in _running:
+            return True
+        if not holds(deletion.lease) and not acquire(deletion.lease):
+            return False
+        _running[dataset_id] = deletion
+    threading.Thread(target=deletion.run, name=f"delete channel {dataset_id}", daemon=True).start()
+    return True
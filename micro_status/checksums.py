@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .manifest import file_hash, load_manifest
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+_hasher = None
+_lock = threading.Lock()
+
+
+def acquisition_manifest_path(dataset_id):
+    return os.path.join(MANIFEST_FOLDER, f"{str(dataset_id).zfill(5)}_acquisition.jsonl")
+
+
+class IOBudget:
+    """
+    Shared by the hashing threads: every read reserves its share of time, together they stay under bytes_per_second.
+    """
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_free = time.time()
+
+    def consume(self, n):
+        with self._lock:
+            now = time.time()
+            # idle time isn't saved up for a burst later
+            start = max(self._next_free, now)
+            self._next_free = start + n / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+class DatasetChecksums:
+    """
+    Checksum manifest of one dataset being acquired, appended to a file as ribbons get hashed.
+    hashed: relative path -> (size, mtime, hash)
+    queued: relative paths waiting for the hashing pool
+    complete_dirs: image directories with all ribbons hashed, not listed again
+    """
+    def __init__(self, dataset_id, root, on_complete=None):
+        self.dataset_id = dataset_id
+        self.root = root
+        self.path = acquisition_manifest_path(dataset_id)
+        self.hashed = load_manifest(self.path) if os.path.exists(self.path) else {}
+        self.queued = set()
+        self.complete_dirs = set()
+        self.finished = False  # imaging finished, nothing new will come
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+
+    def record(self, relative_path, size, mtime, digest):
+        line = json.dumps({'path': relative_path, 'size': size, 'mtime': mtime, 'hash': digest})
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+            self.hashed[relative_path] = (size, mtime, digest)
+            self.queued.discard(relative_path)  # with the hash, so a summary doesn't count it twice
+
+    def summary(self):
+        with self.lock:
+            return {
+                'files': len(self.hashed),
+                'bytes': sum(size for size, _, _ in self.hashed.values()),
+                'queued': len(self.queued),
+                'complete': self.finished and not self.queued,
+                'updated': time.time(),
+            }
+
+
+class AcquisitionHasher:
+    """
+    Hashes ribbon images in the background while a dataset is being acquired,
+    on a bounded thread pool (hashlib releases the GIL) within an I/O budget.
+    """
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='checksum')
+        self.budget = IOBudget(HASH_IO_BUDGET * 2 ** 20)
+        self.datasets = {}
+        self._lock = threading.Lock()
+
+    def checksums(self, dataset_id, root, on_complete=None):
+        with self._lock:
+            if dataset_id not in self.datasets:
+                self.datasets[dataset_id] = DatasetChecksums(dataset_id, root, on_complete)
+            return self.datasets[dataset_id]
+
+    def queued(self):
+        with self._lock:
+            return sum(len(checksums.queued) for checksums in self.datasets.values())
+
+    def submit(self, checksums, files, limit=True):
+        """
+        :param files: {relative path: (size, mtime)}, the ones already queued are skipped
+        :param limit: at most HASH_QUEUE_LIMIT files wait in the pool, the rest are found again next time
+        """
+        room = HASH_QUEUE_LIMIT - self.queued()
+        for relative_path, (size, mtime) in files.items():
+            if limit and room <= 0:
+                break
+            with checksums.lock:
+                if relative_path in checksums.queued:
+                    continue
+                checksums.queued.add(relative_path)
+            self.pool.submit(self.hash_file, checksums, relative_path, size, mtime)
+            room -= 1
+
+    def hash_file(self, checksums, relative_path, size, mtime):
+        path = os.path.join(checksums.root, relative_path)
+        try:
+            digest = file_hash(path, self.budget.consume)
+            stat = os.stat(path)
+            if (stat.st_size, stat.st_mtime) == (size, mtime):
+                checksums.record(relative_path, size, mtime, digest)
+            # else changed while hashing, it's found again next time
+        except FileNotFoundError:  # e.g. 405 channel deleted
+            pass
+        except Exception as e:
+            log.error(f"Could not hash {path}: {e}")
+        finally:
+            with checksums.lock:
+                checksums.queued.discard(relative_path)
+                done = checksums.finished and not checksums.queued
+        if done:
+            self.forget(checksums)
+
+    def forget(self, checksums, notify=True):
+        with self._lock:
+            if self.datasets.get(checksums.dataset_id) is not checksums:
+                return
+            del self.datasets[checksums.dataset_id]
+        log.info(f"Checksum manifest of dataset {checksums.dataset_id} complete: {checksums.path}")
+        if notify and checksums.on_complete:
+            checksums.on_complete(checksums.summary())
+
+
+def get_hasher():
+    global _hasher
+    with _lock:
+        if _hasher is None:
+            _hasher = AcquisitionHasher()
+        return _hasher
+
+
+def find_new_ribbons(checksums, ribbons_in_z_layer, settle_time):
+    """
+    List the image directories ({layer}/{color}/images) that aren't complete yet.
+    :return: {relative path: (size, mtime)} of ribbons not hashed yet that weren't modified for settle_time
+    """
+    now = time.time()
+    new = {}
+    for layer in os.scandir(checksums.root):
+        if not layer.is_dir() or 'layer' not in layer.name:
+            continue
+        for color in os.scandir(layer.path):
+            if not color.is_dir():
+                continue
+            images_dir = os.path.join(layer.name, color.name, 'images')
+            if images_dir in checksums.complete_dirs:
+                continue
+            try:
+                entries = [entry for entry in os.scandir(os.path.join(checksums.root, images_dir)) if entry.is_file()]
+            except FileNotFoundError:
+                continue
+            complete = len(entries) >= ribbons_in_z_layer
+            for entry in entries:
+                relative_path = os.path.join(images_dir, entry.name)
+                stat = entry.stat()
+                previous = checksums.hashed.get(relative_path)
+                if previous and previous[:2] == (stat.st_size, stat.st_mtime):
+                    continue
+                complete = False
+                if now - stat.st_mtime > settle_time:
+                    new[relative_path] = (stat.st_size, stat.st_mtime)
+            if complete:
+                checksums.complete_dirs.add(images_dir)
+    return new
+
+
+def hash_new_ribbons(dataset_id, root, ribbons_in_z_layer, finished=False, on_complete=None):
+    """
+    Queue the ribbons written since the last call for hashing.
+    :param finished: imaging finished, the last ribbons are queued without waiting for them to settle
+    :param on_complete: called with the summary when the manifest is complete
+    :return: summary for processing_summary
+    """
+    if not os.path.exists(MANIFEST_FOLDER):
+        os.makedirs(MANIFEST_FOLDER)
+    hasher = get_hasher()
+    checksums = hasher.checksums(dataset_id, root, on_complete)
+    new = find_new_ribbons(checksums, ribbons_in_z_layer, 0 if finished else HASH_SETTLE_TIME)
+    hasher.submit(checksums, new, limit=not finished)
+    with checksums.lock:
+        checksums.finished = finished
+        done = finished and not checksums.queued
+    summary = checksums.summary()
+    if done:  # nothing was left to hash, the summary is returned
+        hasher.forget(checksums, notify=False)
+    print(f"Checksums of dataset {dataset_id}: {summary['files']} files hashed, {summary['queued']} queued")
+    return summary
@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+_cache = {}
+_lock = threading.Lock()
+
+
+class CompositeManifest:
+    """
+    Composite tiffs (composite*.tif) of a composites or job directory, listed in one pass.
+    files: file name -> size
+    """
+    def __init__(self, directory, dir_mtime=None, files=None, newest_mtime=0, built_at=None):
+        self.directory = directory
+        self.dir_mtime = dir_mtime
+        self.files = files or {}
+        self.newest_mtime = newest_mtime
+        self.built_at = built_at or time.time()
+
+    def __str__(self):
+        return f"CompositeManifest({self.directory}, {self.count} composites, sizes {dict(self.size_histogram)})"
+
+    @classmethod
+    def build(cls, directory):
+        try:
+            dir_mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            return cls(directory)
+        files = {}
+        newest_mtime = 0
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not (entry.name.startswith('composite') and entry.name.endswith('.tif')):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # moved to trash while listing
+                    continue
+                files[entry.name] = stat.st_size
+                newest_mtime = max(newest_mtime, stat.st_mtime)
+        return cls(directory, dir_mtime=dir_mtime, files=files, newest_mtime=newest_mtime)
+
+    @property
+    def count(self):
+        return len(self.files)
+
+    @property
+    def size_histogram(self):
+        """size -> number of composites of that size"""
+        return Counter(self.files.values())
+
+    @property
+    def is_uniform(self):
+        return len(self.size_histogram) == 1
+
+    @property
+    def outliers(self):
+        """Composites that don't have the most common size (truncated or still being written)"""
+        if not self.files:
+            return []
+        common_size = self.size_histogram.most_common(1)[0][0]
+        return sorted(name for name, size in self.files.items() if size != common_size)
+
+    @property
+    def settled(self):
+        """
+        The directory mtime doesn't change while a composite is being written,
+        so a listing with recently modified files is not reused.
+        """
+        return self.built_at - self.newest_mtime > MANIFEST_SETTLE_TIME
+
+
+def get_manifest(directory):
+    """
+    Manifest of the directory, reused until the directory mtime changes.
+    """
+    if not directory:
+        return CompositeManifest(directory)
+    try:
+        dir_mtime = os.stat(directory).st_mtime
+    except FileNotFoundError:
+        return CompositeManifest(directory)
+    with _lock:
+        manifest = _cache.get(directory)
+    if manifest and manifest.dir_mtime == dir_mtime and manifest.settled:
+        return manifest
+    manifest = CompositeManifest.build(directory)
+    with _lock:
+        _cache[directory] = manifest
+    return manifest
@@ -0,0 +1,194 @@
+"""
+Copy (or move) a directory tree with parallel workers, resumable through a journal.
+
+    python -m micro_status.copy_engine SOURCE DESTINATION [--workers 8] [--delete-source] [--hash]
+
+Doesn't depend on the status checker settings, works between any two local directories.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from micro_status.manifest import list_tree, verify_tree
+
+log = logging.getLogger(__name__)
+
+JOURNAL_NAME = '.copy_journal.jsonl'
+CHUNK_SIZE = 64 * 2 ** 20
+DEFAULT_WORKERS = 8
+PROGRESS_INTERVAL = 30  # seconds between progress lines
+MAX_REPORTED_ERRORS = 10
+
+
+def copy_file_data(src, dst, size):
+    """
+    Copy file contents in the kernel when possible: copy_file_range, then sendfile, then a large buffer.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        copied = 0
+        for method in ('copy_file_range', 'sendfile'):
+            if not hasattr(os, method):
+                continue
+            try:
+                while copied < size:
+                    if method == 'copy_file_range':
+                        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(CHUNK_SIZE, size - copied))
+                    else:
+                        n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, min(CHUNK_SIZE, size - copied))
+                    if n == 0:
+                        break
+                    copied += n
+                break
+            except OSError as e:
+                if copied:  # failed half way, not a matter of support
+                    raise
+                log.debug(f"{method} not supported for {src}: {e}")
+        if copied < size:
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+
+
+class TreeCopy:
+    """
+    Copy of one directory tree. Every finished file is appended to the journal in the destination,
+    a restarted copy skips them. Only directories and regular files are copied, a tree with symlinks
+    or special files isn't copied at all.
+    """
+    def __init__(self, source, destination, workers=DEFAULT_WORKERS, delete_source=False, hash_files=False):
+        self.source = source
+        self.destination = destination
+        self.workers = workers
+        self.delete_source = delete_source
+        self.hash_files = hash_files
+        self.journal_path = os.path.join(destination, JOURNAL_NAME)
+        self.copied_bytes = 0
+        self.copied_files = 0
+        self.skipped_files = 0
+        self._lock = threading.Lock()
+        self._journal = None
+        self._last_progress = 0
+        self.started = None
+
+    def read_journal(self):
+        done = {}
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # interrupted while writing the line
+                        continue
+                    done[record['path']] = (record['size'], record['mtime'])
+        except FileNotFoundError:
+            pass
+        return done
+
+    def copy_one(self, relative_path, size, mtime):
+        src = os.path.join(self.source, relative_path)
+        dst = os.path.join(self.destination, relative_path)
+        partial = dst + '.part'
+        copy_file_data(src, partial, size)
+        shutil.copystat(src, partial)
+        os.replace(partial, dst)
+        with self._lock:
+            self._journal.write(json.dumps({'path': relative_path, 'size': size, 'mtime': mtime}) + '\n')
+            self._journal.flush()
+            self.copied_bytes += size
+            self.copied_files += 1
+            self.report_progress()
+
+    def report_progress(self, force=False):
+        now = time.time()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        elapsed = max(now - self.started, 1e-6)
+        print(f"Copied {self.copied_files} files, {self.copied_bytes / 2 ** 30:.1f} GB, "
+              f"{self.copied_bytes / elapsed / 2 ** 20:.0f} MB/s, {self.skipped_files} already there", flush=True)
+
+    def verify(self, files):
+        """
+        Compare the destination with the source manifest, sizes and mtimes (and contents with hash_files)
+        :return: ManifestDiff
+        """
+        source_manifest = None if self.hash_files else {path: (size, mtime, None) for path, (size, mtime) in files.items()}
+        diff, _ = verify_tree(self.source, self.destination, source_manifest, hash_files=self.hash_files,
+                              workers=self.workers, exclude=(JOURNAL_NAME,))
+        return diff
+
+    def run(self):
+        """
+        :return: True if everything was copied and verified (and the source deleted if asked)
+        """
+        self.started = time.time()
+        others = []
+        dirs, files = list_tree(self.source, self.workers, exclude=(JOURNAL_NAME,), others=others)
+        if others:
+            # neither copied nor in the manifest the copy is verified against, deleting the source would lose them
+            log.error(f"{len(others)} symlinks or special files in {self.source}, not copying it: "
+                      f"{', '.join(sorted(others)[:MAX_REPORTED_ERRORS])}")
+            return False
+        os.makedirs(self.destination, exist_ok=True)
+        for relative_dir in sorted(dirs):
+            os.makedirs(os.path.join(self.destination, relative_dir), exist_ok=True)
+
+        done = self.read_journal()
+        todo = []
+        for relative_path, (size, mtime) in files.items():
+            if done.get(relative_path) == (size, mtime) and os.path.exists(os.path.join(self.destination, relative_path)):
+                self.skipped_files += 1
+            else:
+                todo.append((relative_path, size, mtime))
+        # big files first, so one of them doesn't end up alone at the end
+        todo.sort(key=lambda x: x[1], reverse=True)
+        print(f"{len(files)} files in {self.source}, {len(todo)} to copy to {self.destination}", flush=True)
+
+        failed = []
+        with open(self.journal_path, 'a') as self._journal:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self.copy_one, *item): item[0] for item in todo}
+                for future, relative_path in futures.items():
+                    e = future.exception()
+                    if e is not None:
+                        if len(failed) < MAX_REPORTED_ERRORS:
+                            log.error(f"Failed to copy {relative_path}: {e}")
+                        failed.append(relative_path)
+        self.report_progress(force=True)
+        if failed:
+            log.error(f"{len(failed)} files failed, run again to resume")
+            return False
+
+        diff = self.verify(files)
+        if not diff.clean:
+            log.error(f"Destination doesn't match the source after copying: {diff.summary()}")
+            return False
+        os.remove(self.journal_path)
+        if self.delete_source:
+            print(f"Verified, deleting {self.source}", flush=True)
+            shutil.rmtree(self.source)
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy a directory tree in parallel, resumable")
+    parser.add_argument('source')
+    parser.add_argument('destination')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--delete-source', action='store_true', help="move: delete the source after verifying the copy")
+    parser.add_argument('--hash', action='store_true', help="compare file contents too when verifying")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+    copy = TreeCopy(args.source, args.destination, workers=args.workers, delete_source=args.delete_source,
+                    hash_files=args.hash)
+    return 0 if copy.run() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
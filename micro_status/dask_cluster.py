@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+from .settings import *
+from .utils import current_cycle
+
+log = logging.getLogger(__name__)
+
+_session = None
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DASK_HTTP_WORKERS)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+class ClusterSnapshot:
+    """
+    State of the Dask cluster at one moment, shared by all datasets during a scan cycle.
+    workers: worker address -> list of keys of the tasks the worker is processing
+    counts: scheduler task counts by state (from json/counts.json), empty if not available
+    """
+    def __init__(self, workers=None, counts=None, ok=True, taken_at=None, cycle=None):
+        self.workers = workers or {}
+        self.counts = counts or {}
+        self.ok = ok
+        self.taken_at = taken_at or time.time()
+        self.cycle = cycle
+
+    def __str__(self):
+        return f"ClusterSnapshot({len(self.workers)} workers, ok={self.ok})"
+
+    @property
+    def task_counts(self):
+        """Number of processing tasks per worker"""
+        return {worker: len(keys) for worker, keys in self.workers.items()}
+
+    @classmethod
+    def take(cls, dashboard=None):
+        dashboard = dashboard or DASK_DASHBOARD
+        session = get_session()
+        started = time.time()
+        try:
+            worker_urls = cls._list_workers(session, dashboard)
+        except (requests.RequestException, ValueError, AttributeError, KeyError) as e:
+            log.error(f"Dask dashboard {dashboard} is not available: {e}")
+            return cls(ok=False, cycle=current_cycle())
+        counts = {}
+        try:
+            response = session.get(f'{dashboard}json/counts.json', timeout=DASK_HTTP_TIMEOUT)
+            response.raise_for_status()
+            counts = response.json()
+        except (requests.RequestException, ValueError) as e:
+            log.info(f"No task counts from the scheduler: {e}")
+
+        ok = True
+        workers = {}
+        with ThreadPoolExecutor(max_workers=DASK_HTTP_WORKERS) as executor:
+            results = executor.map(lambda url: cls._worker_tasks(session, url), worker_urls.values())
+            for worker, tasks in zip(worker_urls, results):
+                if tasks is None:
+                    ok = False
+                    continue
+                workers[worker] = tasks
+        log.info(f"Dask snapshot of {len(workers)} workers took {time.time() - started:.1f} s")
+        return cls(workers=workers, counts=counts, ok=ok, taken_at=started, cycle=current_cycle())
+
+    @staticmethod
+    def _list_workers(session, dashboard):
+        """
+        :return: worker address -> url of the worker's info page
+        """
+        try:
+            response = session.get(f'{dashboard}json/identity.json', timeout=DASK_HTTP_TIMEOUT)
+            response.raise_for_status()
+            addresses = sorted(response.json()['workers'])
+            return {address: f"{dashboard}info/worker/{quote(address, safe='')}.html" for address in addresses}
+        except (requests.HTTPError, ValueError, KeyError):
+            pass
+        # older schedulers: scrape the workers table
+        response = session.get(f'{dashboard}info/main/workers.html', timeout=DASK_HTTP_TIMEOUT)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.content, "html.parser")
+        workers = {}
+        for tr in soup.select('tr')[1:]:
+            a = tr.find('td').find('a')
+            workers[a.text] = a.attrs['href'].replace('../', f'{dashboard}info/')
+        return workers
+
+    @staticmethod
+    def _worker_tasks(session, worker_url):
+        try:
+            response = session.get(worker_url, timeout=DASK_HTTP_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            log.error(f"Failed to get {worker_url}: {e}")
+            return None
+        soup = BeautifulSoup(response.content, "html.parser")
+        tables = soup.select('table')
+        if len(tables) < 3:
+            return []
+        # third table lists the tasks being processed, task key in the first column
+        rows = tables[2].select("tr")[1:]
+        return [row.find('td').get_text(strip=True) if row.find('td') else '' for row in rows]
+
+
+def get_cluster_snapshot():
+    """
+    Snapshot of the cluster for the current scan cycle, taken on first use.
+    """
+    global _snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.cycle != current_cycle():
+            _snapshot = ClusterSnapshot.take()
+        return _snapshot
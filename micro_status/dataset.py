@@ -2,10 +2,10 @@ import json
 import logging
 import os
 import re
-import requests
 import shutil
-import sqlite3
 import subprocess
+import sys
+import threading
 import time
 from datetime import datetime
 from glob import glob
@@ -14,22 +14,36 @@ from pathlib import Path, PureWindowsPath
 import tifffile
 from bs4 import BeautifulSoup
 # from dotenv import load_dotenv
-from imaris_ims_file_reader import ims
 
+from micro_status.checksums import acquisition_manifest_path
+from micro_status.db import connect
+from micro_status.ims_probe import is_intact
+from micro_status.ims_progress import describe_build, describe_progress
+from micro_status.job_launcher import Job, launch
+from micro_status.leases import acquire, holds, release
+from micro_status.manifest import build_manifest, load_manifest, save_manifest, verify_tree
+from micro_status.notifications import add_event
+from micro_status.queue_index import get_queue_index
+from micro_status.scheduler import wake_dataset, wake_stage
 from micro_status.settings import *
+from micro_status.volume import admit, describe_shortage, mark_admitted, record_projection, record_written, stage_complete, stage_unit
 
 log = logging.getLogger(__name__)
 
+# datasets whose source manifest is being saved by this worker before they're queued for moving
+_manifests_running = set()
+_manifest_lock = threading.Lock()
+
 
 class Dataset:
     def __init__(self, path_on_fast_store, **kwargs):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         record = cur.execute(f'SELECT * FROM dataset WHERE path_on_fast_store="{str(path_on_fast_store)}"').fetchone()
         con.close()
 
         pi_id = record[4]
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         pi_name = cur.execute(f'SELECT name FROM pi WHERE id="{pi_id}"').fetchone()
         con.close()
@@ -37,7 +51,7 @@ class Dataset:
             pi_name = pi_name[0]
 
         cl_number_id = record[3]
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         cl_number = cur.execute(f'SELECT name FROM clnumber WHERE id="{cl_number_id}"').fetchone()
         con.close()
@@ -86,11 +100,18 @@ class Dataset:
 
     @classmethod
     def create(cls, file_path):
-        file_path = Path(file_path)   # TODO remove RSCM_FASTSTORE_ACQUISITION_FOLDER from the path
+        file_path = Path(file_path)
         path_parts = file_path.parts
+        # pi folder is the first one in the acquisition folder
+        acquisition_folder = next(
+            (folder for folder in (RSCM_FASTSTORE_ACQUISITION_FOLDER, MESOSPIM_FASTSTORE_ACQUISITION_FOLDER)
+             if str(file_path).startswith(folder)),
+            RSCM_FASTSTORE_ACQUISITION_FOLDER
+        )
+        pi_index = len(Path(acquisition_folder).parts)
         last_name_pattern = r"^[A-Za-z '-_]+$"
-        pi_name = path_parts[4] if re.findall(last_name_pattern, path_parts[4]) else None  # TODO make it more general
-        con = sqlite3.connect(DB_LOCATION)
+        pi_name = path_parts[pi_index] if re.findall(last_name_pattern, path_parts[pi_index]) else None  # TODO make it more general
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'SELECT id FROM pi WHERE name = "{pi_name}"')
         pi_id = res.fetchone()
@@ -98,7 +119,7 @@ class Dataset:
         if pi_id:
             pi_id = pi_id[0]
         else:
-            con = sqlite3.connect(DB_LOCATION)
+            con = connect()
             cur = con.cursor()
             res = cur.execute(f'INSERT OR IGNORE INTO pi(name) VALUES("{pi_name}")')
             pi_id = cur.lastrowid
@@ -111,7 +132,7 @@ class Dataset:
 
         cl_number = [x for x in path_parts if 'CL' in x.upper()]
         cl_number = '00CL00' if len(cl_number) == 0 else cl_number[0]
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'SELECT id FROM clnumber WHERE name = "{cl_number}"')
         cl_number_id = res.fetchone()
@@ -120,7 +141,7 @@ class Dataset:
         if cl_number_id:
             cl_number_id = cl_number_id[0]
         else:
-            con = sqlite3.connect(DB_LOCATION)
+            con = connect()
             cur = con.cursor()
             res = cur.execute(f'INSERT OR IGNORE INTO clnumber(name, pi) VALUES("{cl_number}", {pi_id})')
             cl_number_id = cur.lastrowid
@@ -131,7 +152,7 @@ class Dataset:
 
         print("Path", file_path, "pi_name", pi_name, "cl_number", cl_number, "dataset_name", dataset_name)
 
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(
             f'''INSERT OR IGNORE INTO dataset(name, path_on_fast_store, cl_number, pi, 
@@ -170,7 +191,7 @@ class Dataset:
         raise NotImplementedError("Subclasses must implement this method")
 
     def update_db_field(self, field_name, field_value):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET {field_name} = "{field_value}" WHERE id={self.db_id}')
         con.commit()
@@ -190,12 +211,19 @@ class Dataset:
             'stitching_stuck': "*WARNING: Stitching of {} {} {} could be stuck. Check cluster.*",
             'denoising_stuck': "*WARNING: Denoising of {} {} {} could be stuck. Check CBPy.*",
             'ims_build_stuck': "*WARNING: Building of Imaris file for {} {} {} seems to be stuck.*",
+            'ims_build_failed': "*WARNING: Building of Imaris file for {} {} {} failed ({}). Log: {}*",
+            'mesospim_convert_failed': "*WARNING: Converting {} {} {} to Imaris files failed ({}). Log: {}*",
+            'move_failed': "*WARNING: Moving {} {} {} to h20 failed ({}), moving paused. Log: {}*",
             'broken_tiff_file': "*WARNING: Broken tiff file in {} {} {} z-layer {}*",
-            'built_ims': "Imaris file built for {} {} {}. Check it out at {}",
+            'built_ims': "Imaris file built for {} {} {}. Check it out at {} {}",
+            'building_ims': "Building Imaris file for {} {} {}: {}",
             'ignoring_demo_dataset': "Ignoring demo dataset {} {} {}",
             'requeue_ims': "Requeuing ims build task for {} {} {}",
             'peace_json_created': "Created analysis task for brain dataset {} {} {}",
-            'moved': "Dataset {} {} {} has been moved to h20"
+            'moved': "Dataset {} {} {} has been moved to h20",
+            'move_verification_failed': "*WARNING: Dataset {} {} {} on h20 doesn't match FastStore: {}*",
+            'processing_held': "*WARNING: Processing of {} {} {} held back, not enough space: {}*",
+            'volume_warning': "*WARNING: Imaging of {} {} {} may not fit: {}*"
         }
         if msg_type in ['imaging_paused', 'broken_tiff_file']:
             msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, self.z_layers_current)
@@ -203,29 +231,41 @@ class Dataset:
             imaris_file_path = self.full_path_to_imaris_file
             # ims_folder = str(PureWindowsPath(str(Path(imaris_file_path).parent).replace('/CBI_Hive', 'H:')))
             ims_folder = str(PureWindowsPath(str(Path(imaris_file_path).parent).replace('/h20', 'H:').replace('/CBI_FastStore', 'Z:')))
-            msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, ims_folder)
+            build_summary = describe_build(self.get_processing_summary().get('building_ims', {}))
+            msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, ims_folder, build_summary).strip()
+        elif msg_type == 'move_verification_failed':
+            verification = self.get_processing_summary().get('move_verification', {})
+            differences = ", ".join(
+                f"{value['count']} {kind}" for kind, value in verification.items() if isinstance(value, dict)
+            )
+            msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, differences)
+        elif msg_type == 'processing_held':
+            shortage = self.get_processing_summary().get('admission', {}).get('shortage')
+            msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, describe_shortage(shortage))
+        elif msg_type == 'volume_warning':
+            shortage = self.get_processing_summary().get('volume', {}).get('shortage')
+            msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, describe_shortage(shortage))
+        elif msg_type in ('ims_build_failed', 'mesospim_convert_failed', 'move_failed'):
+            failed = self.get_processing_summary().get(msg_type, {})
+            if failed.get('status') == 'failed':
+                reason = f"exit code {failed.get('exit_code')}"
+            else:
+                reason = {'lost': "job lost", 'finished': "no Imaris file written"}.get(failed.get('status'), "job not found")
+            msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, reason, failed.get('log_path'))
+        elif msg_type == 'building_ims':
+            progress = describe_progress(self.get_processing_summary().get('building_ims', {}))
+            msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name, progress)
         else:
             msg_text = msg_map[msg_type].format(self.pi, self.cl_number, self.name)
         log.info(f"Message text: {msg_text}")
-        payload = {
-            "channel": SLACK_CHANNEL_ID,
-            "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": msg_text
-                    }
-                }
-            ]
-        }
         if MESSAGES_ENABLED:  # doing this check here to be able to save message to logs
-            response = requests.post(SLACK_URL, data=json.dumps(payload), headers=SLACK_HEADERS)
+            # posted at the end of the scan cycle, together with other messages
+            add_event(self.db_id, msg_type, msg_text)
         return True
 
     def mark_no_imaging_progress(self):
         progress_stopped_at = datetime.now().strftime(DATETIME_FORMAT)
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET imaging_no_progress_time = "{progress_stopped_at}" WHERE id={self.db_id}')
         con.commit()
@@ -233,7 +273,7 @@ class Dataset:
         self.imaging_no_progress_time = progress_stopped_at
 
     def mark_paused(self):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET imaging_status = "paused", paused = 1 WHERE id={self.db_id}')
         con.commit()
@@ -242,7 +282,7 @@ class Dataset:
         self.paused = True
 
     def mark_has_imaging_progress(self):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET imaging_no_progress_time = null WHERE id={self.db_id}')
         con.commit()
@@ -250,7 +290,7 @@ class Dataset:
         self.imaging_no_progress_time = None
 
     def mark_resumed(self):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET imaging_status = "in_progress" WHERE id={self.db_id}')
         con.commit()
@@ -258,7 +298,7 @@ class Dataset:
         self.imaging_status = "in_progress"
 
     def mark_imaging_finished(self):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET imaging_status = "finished" WHERE id={self.db_id}')
         con.commit()
@@ -268,7 +308,7 @@ class Dataset:
     @classmethod
     def initialize_from_db(cls, record):
         pi_id = record[4]
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         pi_name = cur.execute(f'SELECT name FROM pi WHERE id="{pi_id}"').fetchone()
         con.close()
@@ -276,7 +316,7 @@ class Dataset:
             pi_name = pi_name[0]
 
         cl_number_id = record[3]
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         cl_number = cur.execute(f'SELECT name FROM clnumber WHERE id="{cl_number_id}"').fetchone()
         con.close()
@@ -323,7 +363,7 @@ class Dataset:
         return obj
 
     def update_path_on_hive(self, path_on_hive):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET path_on_hive = "{path_on_hive}" WHERE id={self.db_id}')
         con.commit()
@@ -331,7 +371,7 @@ class Dataset:
         self.path_on_hive = path_on_hive
 
     def update_processing_status(self, processing_status):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET processing_status = "{processing_status}" WHERE id={self.db_id}')
         con.commit()
@@ -339,7 +379,7 @@ class Dataset:
         self.processing_status = processing_status
 
     def update_imaris_file_path(self, ims_file_path):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET imaris_file_path = "{ims_file_path}" WHERE id={self.db_id}')
         con.commit()
@@ -348,7 +388,7 @@ class Dataset:
 
     def get_processing_summary(self):
         processing_summary = {}
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         processing_summary_str = cur.execute(f'SELECT processing_summary FROM dataset WHERE id={self.db_id}').fetchone()
         con.close()
@@ -357,19 +397,27 @@ class Dataset:
         return processing_summary
 
     def update_processing_summary(self, to_update):
-        processing_summary = self.get_processing_summary()
-        print("processing_summary before:", processing_summary)
-        processing_summary.update(to_update)
-        print("processing_summary after", processing_summary)
-        processing_summary_str = json.dumps(processing_summary)
-        con = sqlite3.connect(DB_LOCATION)
+        """
+        Set the given keys in one statement, stages and background threads (hashing, channel deletion,
+        transfer sizes) update the summary at the same time and each only writes its own keys.
+        """
+        if not to_update:
+            return
+        paths = ", ".join("?, json(?)" for _ in to_update)
+        params = []
+        for key, value in to_update.items():
+            params.extend([f'$."{key}"', json.dumps(value)])
+        con = connect()
         cur = con.cursor()
-        res = cur.execute(f"UPDATE dataset SET processing_summary = '{processing_summary_str}' WHERE id={self.db_id}")
+        res = cur.execute(
+            f"UPDATE dataset SET processing_summary = json_set(COALESCE(processing_summary, '{{}}'), {paths}) WHERE id = ?",
+            params + [self.db_id]
+        )
         con.commit()
         con.close()
 
     def mark_has_processing_progress(self):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET processing_no_progress_time = null WHERE id={self.db_id}')
         con.commit()
@@ -379,7 +427,7 @@ class Dataset:
 
     def mark_no_processing_progress(self):
         progress_stopped_at = datetime.now().strftime(DATETIME_FORMAT)
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(
             f'UPDATE dataset SET processing_no_progress_time = "{progress_stopped_at}" WHERE id={self.db_id}')
@@ -387,6 +435,84 @@ class Dataset:
         con.close()
         self.processing_no_progress_time = progress_stopped_at
 
+    def project_volume(self):
+        """
+        :return: stage -> bytes the dataset is expected to take once the stage is written, None if it can't be told yet
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def volume_written(self, projection):
+        """
+        :return: stage -> bytes written so far
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def update_volume(self):
+        """
+        Record the projected and written bytes of every stage in the reservation ledger.
+        The raw data is reserved from the start, the processing stages once processing is admitted.
+        :return: projection, None if there's nothing to project from yet
+        """
+        projection = self.project_volume()
+        if projection is None:
+            return None
+        written = self.volume_written(projection)
+        processing_admitted = self.processing_status != 'not_started'
+        for stage, projected in projection.items():
+            record_projection(self.db_id, stage, projected, admitted=stage == 'raw' or processing_admitted)
+            record_written(self.db_id, stage, written.get(stage, 0),
+                           stage_complete(stage, self.imaging_status, self.processing_status))
+
+        volume = self.get_processing_summary().get('volume', {})
+        to_update = {'projected': projection, 'written': written}
+        if self.imaging_status == 'in_progress' and not volume.get('checked'):
+            # once per acquisition, imaging can't be held back, only warned about
+            ok, shortage = admit(self.db_id, {stage_unit('raw'): projection['raw'] - written.get('raw', 0)})
+            to_update.update({'checked': True, 'shortage': shortage})
+            if not ok:
+                log.warning(f"Imaging of {self} may not fit: {describe_shortage(shortage)}")
+        volume.update(to_update)
+        self.update_processing_summary({'volume': volume})
+        if to_update.get('shortage'):
+            self.send_message('volume_warning')
+        return projection
+
+    def admit_processing(self):
+        """
+        Processing is held back while what it's going to write doesn't fit next to
+        what the datasets already imaging or processing are still going to write.
+        :return: True if processing can start
+        """
+        projection = self.update_volume()
+        if projection is None:
+            return True
+        written = self.get_processing_summary()['volume']['written']
+        demand = {}
+        for stage, projected in projection.items():
+            if stage == 'raw':
+                continue
+            unit = stage_unit(stage)
+            demand[unit] = demand.get(unit, 0) + max(projected - written.get(stage, 0), 0)
+        ok, shortage = admit(self.db_id, demand)
+        admission = self.get_processing_summary().get('admission', {})
+        if ok:
+            mark_admitted(self.db_id)
+            if admission.get('held'):
+                log.info(f"Processing of {self} admitted after being held back")
+            self.update_processing_summary({'admission': {'held': False, 'admitted': time.time()}})
+            return True
+        log.warning(f"Holding processing of {self} back: {describe_shortage(shortage)}")
+        self.update_processing_summary({'admission': {
+            'held': True, 'since': admission.get('since', time.time()), 'shortage': shortage
+        }})
+        if not admission.get('held'):
+            self.send_message('processing_held')
+        return False
+
+    @property
+    def processing_held(self):
+        return self.get_processing_summary().get('admission', {}).get('held', False)
+
 
     # @property
     # def imsqueue_file_name(self):
@@ -418,37 +544,143 @@ class Dataset:
     #     return False
 
     def check_imaris_file_built(self):
-        file_opens = False
-        file_exists = os.path.exists(self.full_path_to_imaris_file)
-        if file_exists:
-            try:
-                # try to open imaris file
-                ims_file = ims(self.full_path_to_imaris_file)
-                file_opens = True
-            except:
-                file_opens = False
-        return file_exists and file_opens
+        return is_intact(self.full_path_to_imaris_file)
 
 
     # def check_finalization_progress(self):
     #     pass
 
     def start_moving(self):
+        """
+        Save the manifest of the source and then queue the move, in the background: the manifest lists
+        the whole dataset, too long for a stage. Until the move is queued the dataset isn't marked moving,
+        a worker that stops in between leaves it to be started again. The lease keeps other workers
+        from doing the same at the same time.
+        """
+        print("Starting to move")
+        lease = f"source_manifest:{self.db_id}"
+        with _manifest_lock:
+            if self.db_id in _manifests_running:
+                return
+            if not holds(lease) and not acquire(lease):
+                log.info(f"Manifest of {self} is being saved by another worker")
+                return
+            _manifests_running.add(self.db_id)
+        wake_dataset(self.db_id)
+        threading.Thread(
+            target=self.save_manifest_and_queue_move, args=(lease,), name=f"manifest {self.db_id}", daemon=True
+        ).start()
+
+    def save_manifest_and_queue_move(self, lease):
+        try:
+            self.save_source_manifest()
+            self.queue_move()
+        except Exception as e:
+            log.error(f"Could not queue moving {self}: {e}")
+        finally:
+            with _manifest_lock:
+                _manifests_running.discard(self.db_id)
+            release(lease)
+
+    def queue_move(self):
         """create txt file in the RSCM queue stitch directory
         file name: {dataset_id}_{pi_name}_{cl_number}_{dataset_name}_move.txt
         this way the earlier datasets go in first
+        With MOVE_METHOD = 'native' queue a move_dataset job instead, move_files starts it.
         """
-        print("Starting to move")
+        if MOVE_METHOD == 'native':
+            self.queue_native_move()
+            return
         dat_file_path = Path(self.path_on_fast_store)
         # txt_file_path = os.path.join(RSCM_FOLDER_STITCHING, 'queueStitch', self.rscm_move_txt_file_name)
         txt_file_path = os.path.join(RSCM_FOLDER_STITCHING, 'tempQueue', self.rscm_move_txt_file_name)
         contents = f'rootDir="{str(dat_file_path)}"\nIMS=False\ndenoise=False\nmoveOnly=True'
         with open(txt_file_path, "w") as f:
             f.write(contents)
+        get_queue_index().record_move(self.rscm_move_txt_file_name, 'tempQueue')
         log.info("-----------------------Queue moving to Hive. Text file : ---------------------")
         log.info(contents)
         self.moving = True
         self.update_db_field('moving', 1)
+        wake_stage('move_files')
+
+    @property
+    def hive_destination(self):
+        return self.path_on_fast_store.replace(FASTSTORE_ACQUISITION_FOLDER, HIVE_ACQUISITION_FOLDER)
+
+    @property
+    def source_manifest_path(self):
+        return os.path.join(MANIFEST_FOLDER, f"{str(self.db_id).zfill(5)}_source.jsonl")
+
+    def save_source_manifest(self):
+        """
+        Both ways of moving delete the source, its manifest is what the copy on Hive is verified against.
+        Hashes from the acquisition checksum manifest are reused, with MOVE_VERIFY_HASH the ribbons it's missing
+        (e.g. the status checker was restarted after imaging finished) are hashed here, before the move is queued.
+        """
+        if not os.path.exists(MANIFEST_FOLDER):
+            os.makedirs(MANIFEST_FOLDER)
+        known = None
+        if os.path.exists(acquisition_manifest_path(self.db_id)):
+            known = load_manifest(acquisition_manifest_path(self.db_id))
+        try:
+            manifest = build_manifest(self.path_on_fast_store, MOVE_VERIFY_HASH, MANIFEST_WORKERS, known=known)
+        except FileNotFoundError as e:
+            log.error(f"Could not list {self.path_on_fast_store}: {e}")
+            return
+        save_manifest(manifest, self.source_manifest_path)
+        reused = sum(1 for path, record in manifest.items() if record[2] and (known or {}).get(path) == record)
+        log.info(f"Saved manifest of {len(manifest)} files to {self.source_manifest_path}, {reused} acquisition hashes reused")
+
+    def verify_move(self):
+        """
+        Compare the dataset on Hive with the manifest saved before moving, or with FastStore if that's still there.
+        A failed verification is repeated after MOVE_VERIFY_RETRY seconds.
+        :return: True if the copy on Hive is complete
+        """
+        verification = self.get_processing_summary().get('move_verification', {})
+        if verification.get('checked') and time.time() - verification['checked'] < MOVE_VERIFY_RETRY:
+            return False
+        source_manifest = None
+        if os.path.exists(self.source_manifest_path):
+            source_manifest = load_manifest(self.source_manifest_path)
+        elif not os.path.exists(self.path_on_fast_store):
+            # queued for moving before manifests were saved, nothing left to compare with
+            log.warning(f"No manifest of {self} to verify the move, accepting {self.hive_destination}")
+            return os.path.exists(self.hive_destination)
+        try:
+            diff, stats = verify_tree(self.path_on_fast_store, self.hive_destination, source_manifest,
+                                      hash_files=MOVE_VERIFY_HASH, check_mtime=MOVE_VERIFY_MTIME.get(MOVE_METHOD, False),
+                                      workers=MANIFEST_WORKERS)
+        except FileNotFoundError as e:
+            log.error(f"Could not verify moving {self}: {e}")
+            return False
+        summary = diff.summary()
+        summary.update(stats)
+        summary['checked'] = time.time()
+        if not diff.clean:
+            log.error(f"{self.hive_destination} doesn't match {self.path_on_fast_store}: {diff}")
+            summary['reported'] = True
+            self.update_processing_summary({'move_verification': summary})
+            if not verification.get('reported'):
+                self.send_message('move_verification_failed')
+            return False
+        self.update_processing_summary({'move_verification': summary})
+        return True
+
+    def queue_native_move(self):
+        cmd = [
+            sys.executable, '-m', 'micro_status.copy_engine',
+            self.path_on_fast_store,
+            self.hive_destination,
+            '--workers', str(COPY_WORKERS),
+            '--delete-source'
+        ]
+        launch(self, 'move_dataset', cmd, start=False)
+        log.info(f"Queued moving {self.path_on_fast_store} to {self.hive_destination}")
+        self.moving = True
+        self.update_db_field('moving', 1)
+        wake_stage('move_files')
 
     # @property
     # def in_imaris_queue(self):
@@ -516,7 +748,7 @@ class Dataset:
         print("Created JSON")
         json_created_time = datetime.now().strftime(DATETIME_FORMAT)
         self.peace_json_created = json_created_time
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(
             f'UPDATE dataset SET peace_json_created = "{json_created_time}" WHERE id={self.db_id}')
@@ -529,13 +761,38 @@ class Dataset:
         return f"{str(self.db_id).zfill(5)}_{self.pi}_{self.cl_number}_{self.name}_move.txt"
 
     def check_if_moved(self):
-        moved = os.path.exists(os.path.join(RSCM_FOLDER_STITCHING, 'complete', self.rscm_move_txt_file_name))
-        if moved:
+        if MOVE_METHOD == 'native':
+            job = Job.get_latest(self.db_id, 'move_dataset')
+            if job is None or job.status in ('failed', 'lost'):
+                retries = self.get_processing_summary().get('move_retries', 0)
+                if job is not None and retries >= JOB_RETRIES.get('move_dataset', 0):
+                    log.error(f"{job} didn't finish, see {job.log_path}")
+                    self.update_processing_summary({
+                        'move_retries': 0,  # a dataset resumed by hand gets its retries again
+                        'move_failed': {
+                            'job': job.db_id, 'status': job.status, 'exit_code': job.exit_code,
+                            'log_path': job.log_path
+                        }
+                    })
+                    self.update_processing_status('paused')
+                    self.send_message('move_failed')
+                    return
+                if job is not None:
+                    # the copy journal in the destination lets the next job pick up where this one stopped
+                    log.error(f"Moving {self} didn't finish ({job}), queueing it again")
+                    self.update_processing_summary({'move_retries': retries + 1, 'move_failed': None})
+                self.queue_native_move()
+                return
+            moved = job.status == 'finished'
+        else:
+            moved = get_queue_index().is_in(self.rscm_move_txt_file_name, 'complete')
+        if moved and self.verify_move():
             self.update_db_field('moved', 1)
             self.moved = True
             self.update_db_field('moving', 0)
             self.moving = False
-            path_on_hive = self.path_on_fast_store.replace(FASTSTORE_ACQUISITION_FOLDER, HIVE_ACQUISITION_FOLDER)
+            wake_dataset(self.db_id)  # its path on Hive is picked up by the next check of finished datasets
+            path_on_hive = self.hive_destination
             if os.path.exists(path_on_hive):
                 self.update_db_field('path_on_hive', path_on_hive)
                 self.path_on_hive = path_on_hive
@@ -0,0 +1,12 @@
+import sqlite3
+
+from .settings import *
+
+
+def connect():
+    """
+    Connection to the status database. Stages, the datasets within them, the outbox sender and the lease
+    heartbeat write at the same time, so a locked database is waited for up to DB_TIMEOUT
+    (sqlite's default of 5 s isn't enough).
+    """
+    return sqlite3.connect(DB_LOCATION, timeout=DB_TIMEOUT)
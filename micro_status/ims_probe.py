@@ -0,0 +1,126 @@
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import h5py
+
+log = logging.getLogger(__name__)
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+UNDEFINED_ADDRESS = 0xffffffffffffffff
+# the superblock is at 0 or, after a user block, at 512, 1024, 2048 ...
+SUPERBLOCK_OFFSETS = [0] + [512 * 2 ** i for i in range(12)]
+IMARIS_DATA_GROUP = 'DataSet/ResolutionLevel 0'
+
+OK = 'ok'
+MISSING = 'missing'
+NOT_HDF5 = 'not_hdf5'
+TRUNCATED = 'truncated'
+OPEN_FOR_WRITE = 'open_for_write'
+NO_IMARIS_DATA = 'no_imaris_data'
+UNREADABLE = 'unreadable'
+
+CACHE_SIZE = 1000  # verdicts kept, the least recently used go first
+
+# (path, size, mtime) -> verdict
+_verdicts = OrderedDict()
+_lock = threading.Lock()
+
+
+def read_superblock(f, size):
+    """
+    :return: (base address, end of file address, file consistency flags) of the first HDF5 superblock, None if there's none
+    """
+    for offset in SUPERBLOCK_OFFSETS:
+        if offset + 64 > size:
+            break
+        f.seek(offset)
+        header = f.read(64)
+        if header[:8] != HDF5_SIGNATURE:
+            continue
+        version = header[8]
+        if version in (0, 1):
+            size_of_offsets = header[13]
+            flags = 0  # unused before version 3
+            addresses_start = 24 if version == 0 else 28
+        elif version in (2, 3):
+            size_of_offsets = header[9]
+            flags = header[11] if version == 3 else 0
+            addresses_start = 12
+        else:
+            return None
+        fmt = {4: '<I', 8: '<Q'}.get(size_of_offsets)
+        if fmt is None:
+            return None
+        addresses = [
+            struct.unpack_from(fmt, header, addresses_start + i * size_of_offsets)[0]
+            for i in range(3)
+        ]
+        # v0/1: base, free-space info, end of file; v2/3: base, superblock extension, end of file
+        base_address, end_of_file_address = addresses[0], addresses[2]
+        if base_address == UNDEFINED_ADDRESS:
+            base_address = offset
+        return base_address, end_of_file_address, flags
+    return None
+
+
+def check_file(path):
+    """
+    Check an .ims file without reading its data:
+    HDF5 signature, superblock end of file address vs. the real file size, and the Imaris resolution level 0 group.
+    :return: verdict, one of OK, MISSING, NOT_HDF5, TRUNCATED, OPEN_FOR_WRITE, NO_IMARIS_DATA, UNREADABLE
+    """
+    try:
+        size = os.stat(path).st_size
+        with open(path, 'rb') as f:
+            superblock = read_superblock(f, size)
+    except FileNotFoundError:
+        return MISSING
+    except OSError as e:
+        log.error(f"Can't read {path}: {e}")
+        return UNREADABLE
+    if superblock is None:
+        return NOT_HDF5
+    base_address, end_of_file_address, flags = superblock
+    if end_of_file_address != UNDEFINED_ADDRESS and base_address + end_of_file_address > size:
+        # still being copied or the writer died
+        return TRUNCATED
+    if flags & 0x1:
+        return OPEN_FOR_WRITE
+    try:
+        with h5py.File(path, 'r') as f:
+            if IMARIS_DATA_GROUP not in f:
+                return NO_IMARIS_DATA
+    except OSError as e:
+        log.error(f"Can't open {path}: {e}")
+        return UNREADABLE
+    return OK
+
+
+def probe(path):
+    """
+    Verdict of check_file(), reused while the size and mtime of the file don't change.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return MISSING
+    key = (path, stat.st_size, stat.st_mtime)
+    with _lock:
+        verdict = _verdicts.get(key)
+        if verdict is not None:
+            _verdicts.move_to_end(key)
+            return verdict
+    verdict = check_file(path)
+    log.info(f"Imaris file {path}: {verdict}")
+    with _lock:
+        _verdicts[key] = verdict
+        while len(_verdicts) > CACHE_SIZE:
+            _verdicts.popitem(last=False)
+    return verdict
+
+
+def is_intact(path):
+    return probe(path) == OK
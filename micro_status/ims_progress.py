@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import tifffile
+
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+
+def pyramid_factor(shape):
+    """
+    Size of all resolution levels relative to the full resolution one.
+    Imaris halves x and y for every level until the image fits in IMS_PYRAMID_MIN_SIDE.
+    """
+    height, width = shape[-2:]
+    factor, level = 1.0, 1.0
+    while max(height, width) > IMS_PYRAMID_MIN_SIDE:
+        height, width = (height + 1) // 2, (width + 1) // 2
+        level /= 4
+        factor += level
+    return factor
+
+
+def predict_ims_size(manifest):
+    """
+    Expected size of the .ims file built from the composites of the manifest:
+    composites * pixels per composite * bytes per pixel * resolution levels
+    :return: bytes, None if there are no composites to look at
+    """
+    if not manifest.count:
+        return None
+    first_composite = os.path.join(manifest.directory, sorted(manifest.files)[0])
+    try:
+        with tifffile.TiffFile(first_composite) as tif:
+            series = tif.series[0]
+            shape = series.shape
+            composite_size = series.dtype.itemsize
+            for dimension in shape:
+                composite_size *= dimension
+    except Exception as e:
+        log.error(f"Can't read {first_composite}: {e}")
+        return None
+    return int(manifest.count * composite_size * pyramid_factor(shape) * IMS_SIZE_RATIO)
+
+
+def update_build_progress(building_ims, size, now=None):
+    """
+    Add a .ims.part size sample and estimate the rest of the build.
+    :param building_ims: processing_summary['building_ims'] of the dataset, updated in place
+    :return: building_ims with 'samples' [[time, size]], 'mb_per_s', 'percent', 'eta' (seconds) and 'stalled'
+    """
+    now = now or time.time()
+    samples = building_ims.get('samples', [])
+    if samples and size < samples[-1][1]:
+        log.info(f"Imaris file got smaller ({samples[-1][1]} -> {size}), build started over")
+        samples = []
+        building_ims.pop('eta_reported', None)
+    if not samples:
+        building_ims['started'] = now
+    if not samples or size != samples[-1][1]:
+        samples.append([now, size])
+    samples = samples[-IMS_PROGRESS_SAMPLES:]
+    building_ims['samples'] = samples
+    building_ims['ims_size'] = size
+
+    first_time, first_size = samples[0]
+    rate = (size - first_size) / (now - first_time) if now > first_time else 0
+    building_ims['mb_per_s'] = round(rate / 2 ** 20, 2)
+    predicted_size = building_ims.get('predicted_size')
+    if predicted_size:
+        building_ims['percent'] = round(min(100 * size / predicted_size, 99.9), 1)
+        building_ims['eta'] = round(max(predicted_size - size, 0) / rate) if rate else None
+
+    # the file grows in bursts, so the build stalled only if it's been quiet for much longer than usual
+    usual_interval = (samples[-1][0] - first_time) / (len(samples) - 1) if len(samples) > 1 else 0
+    quiet_time = now - samples[-1][0]
+    building_ims['stalled'] = quiet_time > max(IMS_STALL_MIN_TIME, IMS_STALL_FACTOR * usual_interval)
+    return building_ims
+
+
+def format_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h {rest // 60:02d}m"
+
+
+def describe_progress(building_ims):
+    """One line for the status output and messages"""
+    text = f"{building_ims.get('ims_size', 0) / 2 ** 30:.1f} GB, {building_ims.get('mb_per_s', 0)} MB/s"
+    if building_ims.get('percent') is not None:
+        text += f", {building_ims['percent']}% done"
+    if building_ims.get('eta') is not None:
+        finish = datetime.now() + timedelta(seconds=building_ims['eta'])
+        text += f", ETA {format_duration(building_ims['eta'])} ({finish.strftime('%a %H:%M')})"
+    if building_ims.get('stalled'):
+        text += ", stalled"
+    return text
+
+
+def describe_build(building_ims):
+    """How long the finished build took, for the built_ims message"""
+    samples = building_ims.get('samples')
+    if not samples or not building_ims.get('started'):
+        return ""
+    duration = samples[-1][0] - building_ims['started']
+    text = f"Built in {format_duration(duration)}"
+    if duration > 0:
+        text += f" at {samples[-1][1] / duration / 2 ** 20:.1f} MB/s"
+    if building_ims.get('predicted_size'):
+        text += f", {samples[-1][1] / building_ims['predicted_size']:.2f}x the predicted size"
+    return text + "."
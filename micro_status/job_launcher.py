@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+from datetime import datetime
+
+from micro_status.db import connect
+from micro_status.leases import HOST, acquire, holds, live_workers
+from micro_status.settings import *
+
+log = logging.getLogger(__name__)
+
+# Popen objects of the jobs started by this process, by job id
+_processes = {}
+JOBS_LEASE = 'jobs'
+# commands started by the transfer scheduler (move_files), not as soon as the concurrency limit allows
+SCHEDULED_COMMANDS = ('move_dataset',)
+# scan stages run concurrently, the concurrency limits are checked and applied under this lock
+_lock = threading.Lock()
+
+
+class Job:
+    """
+    External command (IMS build, MesoSPIM conversion, ...) started in the background for a dataset.
+    status: queued -> running -> finished / failed / lost
+    """
+    def __init__(self, **kwargs):
+        self.db_id = kwargs.get('db_id')
+        self.dataset_id = kwargs.get('dataset_id')
+        self.command_name = kwargs.get('command_name')
+        self.cmd = kwargs.get('cmd', [])
+        self.status = kwargs.get('status', 'queued')
+        self.pid = kwargs.get('pid')
+        self.exit_code = kwargs.get('exit_code')
+        self.log_path = kwargs.get('log_path')
+        self.created = kwargs.get('created')
+        self.started = kwargs.get('started')
+        self.finished = kwargs.get('finished')
+        self.host = kwargs.get('host')
+
+    def __str__(self):
+        return f"job {self.db_id} {self.command_name} (dataset {self.dataset_id}, {self.status})"
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(
+            db_id=record[0],
+            dataset_id=record[1],
+            command_name=record[2],
+            cmd=json.loads(record[3]),
+            status=record[4],
+            pid=record[5],
+            exit_code=record[6],
+            log_path=record[7],
+            created=record[8],
+            started=record[9],
+            finished=record[10],
+            host=record[11]
+        )
+
+    @classmethod
+    def create(cls, dataset_id, command_name, cmd):
+        created = datetime.now().strftime(DATETIME_FORMAT)
+        con = connect()
+        cur = con.cursor()
+        cur.execute(
+            "INSERT INTO job(dataset_id, command_name, cmd, status, created) VALUES(?, ?, ?, 'queued', ?)",
+            (dataset_id, command_name, json.dumps(cmd), created)
+        )
+        job_id = cur.lastrowid
+        con.commit()
+        con.close()
+        return cls(db_id=job_id, dataset_id=dataset_id, command_name=command_name, cmd=cmd, created=created)
+
+    @classmethod
+    def get_latest(cls, dataset_id, command_name):
+        con = connect()
+        cur = con.cursor()
+        record = cur.execute(
+            f"SELECT * FROM job WHERE dataset_id={dataset_id} AND command_name='{command_name}' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        con.close()
+        if not record:
+            return
+        return cls.from_record(record)
+
+    @classmethod
+    def get_by_status(cls, status, command_name=None):
+        query = f"SELECT * FROM job WHERE status='{status}'"
+        if command_name:
+            query += f" AND command_name='{command_name}'"
+        con = connect()
+        cur = con.cursor()
+        records = cur.execute(query + ' ORDER BY id').fetchall()
+        con.close()
+        return [cls.from_record(record) for record in records]
+
+    @property
+    def is_active(self):
+        return self.status in ('queued', 'running')
+
+    def claim(self):
+        """
+        Mark the queued job as running on this host, unless another worker got to it first.
+        """
+        started = datetime.now().strftime(DATETIME_FORMAT)
+        con = connect()
+        cur = con.cursor()
+        cur.execute(
+            "UPDATE job SET status = 'running', host = ?, started = ? WHERE id = ? AND status = 'queued'",
+            (HOST, started, self.db_id)
+        )
+        claimed = cur.rowcount == 1
+        con.commit()
+        con.close()
+        if claimed:
+            self.status = 'running'
+            self.host = HOST
+            self.started = started
+        return claimed
+
+    def start(self):
+        if not self.claim():
+            log.info(f"{self} was started by another worker")
+            return False
+        if not os.path.exists(JOB_LOG_FOLDER):
+            os.makedirs(JOB_LOG_FOLDER)
+        started = datetime.now().strftime(DATETIME_FORMAT)
+        log_path = os.path.join(
+            JOB_LOG_FOLDER, f"{str(self.dataset_id).zfill(5)}_{self.command_name}_{started}.log"
+        )
+        log.info(f"Starting {self}: {self.cmd}")
+        log.info(f"Output goes to {log_path}")
+        with open(log_path, 'ab') as log_file:
+            # new session: the command must survive restarts of the status checker
+            process = subprocess.Popen(
+                self.cmd, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, start_new_session=True
+            )
+        _processes[self.db_id] = process
+        con = connect()
+        cur = con.cursor()
+        cur.execute(
+            "UPDATE job SET pid = ?, log_path = ?, started = ? WHERE id = ?",
+            (process.pid, log_path, started, self.db_id)
+        )
+        con.commit()
+        con.close()
+        self.status = 'running'
+        self.pid = process.pid
+        self.log_path = log_path
+        self.started = started
+        return True
+
+    def mark_finished(self, exit_code):
+        if exit_code is None:
+            status = 'lost'
+        else:
+            status = 'finished' if exit_code == 0 else 'failed'
+        finished = datetime.now().strftime(DATETIME_FORMAT)
+        con = connect()
+        cur = con.cursor()
+        cur.execute(
+            'UPDATE job SET status = ?, exit_code = ?, finished = ? WHERE id = ?',
+            (status, exit_code, finished, self.db_id)
+        )
+        con.commit()
+        con.close()
+        self.status = status
+        self.exit_code = exit_code
+        self.finished = finished
+
+    def poll(self):
+        """
+        Check whether the running job has exited. Jobs started by a previous run of the status checker
+        (or by another worker on this host) can only be checked by pid, their exit code is unknown.
+        :return: True if the job is done
+        """
+        if self.status != 'running':
+            return not self.is_active
+        if self.host and self.host != HOST:
+            # only the host that started the job can see its pid
+            if live_workers(self.host):
+                return False
+            log.error(f"No worker left on {self.host} to check {self}")
+            self.mark_finished(None)
+            return True
+        if self.pid is None:
+            # claimed, the worker that claimed it hasn't started the command and stored its pid yet
+            started = datetime.strptime(self.started, DATETIME_FORMAT) if self.started else None
+            if started and (datetime.now() - started).total_seconds() < JOB_START_GRACE:
+                return False
+            log.error(f"{self} was claimed at {self.started} but never got a pid")
+            self.mark_finished(None)
+            return True
+        process = _processes.get(self.db_id)
+        if process is not None:
+            exit_code = process.poll()
+            if exit_code is None:
+                return False
+            del _processes[self.db_id]
+            self.mark_finished(exit_code)
+            return True
+        if pid_is_alive(self.pid):
+            return False
+        self.mark_finished(None)
+        return True
+
+
+def pid_is_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # exists, owned by someone else
+        return True
+    return True
+
+
+def start_queued_jobs(command_name):
+    if not holds(JOBS_LEASE) and not acquire(JOBS_LEASE):
+        return  # another worker starts queued jobs
+    limit = JOB_CONCURRENCY.get(command_name, 1)
+    running = len(Job.get_by_status('running', command_name))
+    for job in Job.get_by_status('queued', command_name):
+        if running >= limit:
+            break
+        try:
+            if not job.start():
+                continue
+        except OSError as e:
+            log.error(f"Could not start {job}: {e}")
+            job.mark_finished(None)
+            continue
+        running += 1
+
+
+def launch(dataset, command_name, cmd, start=True):
+    """
+    Queue a command for the dataset and start it right away if the concurrency limit allows.
+    Doesn't queue the same command twice while the previous one is still queued or running.
+    :param start: False to only queue it, for commands in SCHEDULED_COMMANDS
+    :return: Job
+    """
+    with _lock:
+        job = Job.get_latest(dataset.db_id, command_name)
+        if job and job.is_active:
+            log.info(f"Not launching {command_name} for {dataset}, already have {job}")
+            return job
+        job = Job.create(dataset.db_id, command_name, cmd)
+        log.info(f"Queued {job}")
+        if start:
+            start_queued_jobs(command_name)
+        return Job.get_latest(dataset.db_id, command_name)
+
+
+def poll_jobs():
+    """
+    Called once per scan cycle: record exit status of finished jobs, start queued ones.
+    :return: list of jobs that finished since the last call
+    """
+    done = []
+    with _lock:
+        for job in Job.get_by_status('running'):
+            if job.poll():
+                done.append(job)
+                if job.status == 'finished':
+                    log.info(f"{job} finished")
+                else:
+                    log.error(f"{job} exited with code {job.exit_code}, see {job.log_path}")
+        command_names = set(job.command_name for job in Job.get_by_status('queued')) - set(SCHEDULED_COMMANDS)
+        for command_name in command_names:
+            start_queued_jobs(command_name)
+    return done
@@ -0,0 +1,157 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from .db import connect
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+HOST = os.uname().nodename
+WORKER_ID = f"{HOST}:{os.getpid()}"
+WORKER_LEASE = f"worker:{WORKER_ID}"
+
+# names of the leases this worker holds
+_held = set()
+_lock = threading.Lock()
+_keeper = None
+
+
+def acquire(name, ttl=None):
+    """
+    Take the lease if it's free, expired or already ours, and extend it.
+    The check and the update are one statement, so two workers can't both get it.
+    :return: True if this worker holds the lease
+    """
+    now = time.time()
+    con = connect()
+    cur = con.cursor()
+    cur.execute(
+        "INSERT INTO lease(name, owner, acquired, expires) VALUES(?, ?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET "
+        "acquired = CASE WHEN lease.owner = excluded.owner THEN lease.acquired ELSE excluded.acquired END, "
+        "owner = excluded.owner, expires = excluded.expires "
+        "WHERE lease.owner = excluded.owner OR lease.expires < ?",
+        (name, WORKER_ID, now, now + (ttl or LEASE_TTL), now)
+    )
+    acquired = cur.rowcount == 1
+    con.commit()
+    con.close()
+    with _lock:
+        if acquired:
+            if name not in _held:
+                log.info(f"{WORKER_ID} took lease {name}")
+            _held.add(name)
+        else:
+            _held.discard(name)
+    return acquired
+
+
+def release(name):
+    con = connect()
+    cur = con.cursor()
+    cur.execute('DELETE FROM lease WHERE name = ? AND owner = ?', (name, WORKER_ID))
+    con.commit()
+    con.close()
+    with _lock:
+        _held.discard(name)
+
+
+def renew():
+    """
+    Heartbeat: extend every lease this worker holds. Leases another worker took over
+    (because this one didn't renew in time) are forgotten.
+    """
+    now = time.time()
+    con = connect()
+    cur = con.cursor()
+    cur.execute('UPDATE lease SET expires = ? WHERE owner = ? AND expires >= ?', (now + LEASE_TTL, WORKER_ID, now))
+    owned = set(name for (name,) in cur.execute('SELECT name FROM lease WHERE owner = ?', (WORKER_ID,)).fetchall())
+    con.commit()
+    con.close()
+    with _lock:
+        lost = _held - owned
+        _held.intersection_update(owned)
+    for name in lost:
+        log.error(f"{WORKER_ID} lost lease {name}")
+
+
+def holds(name):
+    with _lock:
+        return name in _held
+
+
+def live_workers(host=None):
+    """
+    :return: ids of the workers whose heartbeat hasn't expired, on the given host or everywhere
+    """
+    prefix = f"worker:{host}:" if host else "worker:"
+    con = connect()
+    cur = con.cursor()
+    records = cur.execute(
+        'SELECT name FROM lease WHERE name LIKE ? AND expires >= ?', (prefix + '%', time.time())
+    ).fetchall()
+    con.close()
+    return [name[len('worker:'):] for (name,) in records]
+
+
+def shard(names, prefix):
+    """
+    Split work between the running workers: claim up to a fair share of the names, give back
+    the ones over the share or no longer listed. Names held by a dead worker become free when its leases expire.
+    :param prefix: kind of work, e.g. 'dataset' or 'stage'
+    :return: the names this worker should handle now
+    """
+    names = list(names)
+    workers = max(len(live_workers()), 1)
+    share = math.ceil(len(names) / workers)
+    wanted = set(f"{prefix}:{name}" for name in names)
+    with _lock:
+        mine = set(lease for lease in _held if lease.startswith(f"{prefix}:"))
+    for lease in sorted(mine - wanted):
+        release(lease)
+    mine &= wanted
+    for lease in sorted(mine)[share:]:  # over the share, e.g. after another worker joined
+        release(lease)
+        mine.discard(lease)
+    for name in names:
+        if len(mine) >= share:
+            break
+        lease = f"{prefix}:{name}"
+        if lease not in mine and acquire(lease):
+            mine.add(lease)
+    return [name for name in names if f"{prefix}:{name}" in mine]
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Keeps the worker lease and all other leases of this worker alive.
+    """
+    def __init__(self):
+        super().__init__(name="lease-keeper", daemon=True)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        log.info(f"Worker {WORKER_ID} started")
+        while not self._stop_event.is_set():
+            try:
+                acquire(WORKER_LEASE)
+                renew()
+            except sqlite3.Error as e:
+                log.error(f"Lease heartbeat failed: {e}")
+            self._stop_event.wait(LEASE_TTL / 3)
+
+
+def start_heartbeat():
+    global _keeper
+    if _keeper is None or not _keeper.is_alive():
+        acquire(WORKER_LEASE)
+        _keeper = LeaseKeeper()
+        _keeper.start()
+    return _keeper
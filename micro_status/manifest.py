@@ -0,0 +1,196 @@
+"""
+Manifests of directory trees (relative path -> size, mtime, optional hash) and their comparison,
+used to verify that a dataset arrived on Hive complete before it counts as moved.
+
+Doesn't depend on the status checker settings, works between any two local directories.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 16
+HASH_CHUNK_SIZE = 8 * 2 ** 20
+MTIME_TOLERANCE = 2  # seconds, some copy tools round timestamps
+EXAMPLES = 5  # paths kept per kind of difference in the summary
+
+
+def scan_dir(root, relative_dir, exclude):
+    """
+    :return: (subdirectories, {file: (size, mtime)}, other entries: symlinks, fifos, sockets, devices)
+    """
+    subdirs = []
+    files = {}
+    others = []
+    with os.scandir(os.path.join(root, relative_dir)) as it:
+        for entry in it:
+            relative_path = os.path.join(relative_dir, entry.name)
+            if entry.name in exclude:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(relative_path)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                files[relative_path] = (stat.st_size, stat.st_mtime)
+            else:
+                others.append(relative_path)
+    return subdirs, files, others
+
+
+def list_tree(root, workers=DEFAULT_WORKERS, exclude=(), others=None):
+    """
+    Walk the tree listing many directories at the same time, on network storage a listing mostly waits.
+    :param others: list the relative paths of symlinks and special files are added to, they're skipped otherwise
+    :return: (relative directory paths, {relative file path: (size, mtime)})
+    """
+    dirs = []
+    files = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='walk') as pool:
+        pending = {pool.submit(scan_dir, root, '', exclude)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, dir_files, dir_others = future.result()
+                dirs.extend(subdirs)
+                files.update(dir_files)
+                if others is not None:
+                    others.extend(dir_others)
+                pending |= set(pool.submit(scan_dir, root, subdir, exclude) for subdir in subdirs)
+    return dirs, files
+
+
+def file_hash(path, on_read=None):
+    """
+    :param on_read: called with the number of bytes after every read, e.g. to keep to an I/O budget
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            if on_read:
+                on_read(len(chunk))
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(root, hash_files=False, workers=DEFAULT_WORKERS, exclude=(), known=None):
+    """
+    :param known: manifest with hashes computed earlier (e.g. during acquisition), reused for files
+        with the same size and mtime, with or without hash_files
+    :return: {relative file path: (size, mtime, hash or None)}
+    """
+    _, files = list_tree(root, workers, exclude)
+    known = known or {}
+    hashes = {}
+    for path, (size, mtime) in files.items():
+        previous = known.get(path)
+        if previous and previous[2] and previous[0] == size and previous[1] == mtime:
+            hashes[path] = previous[2]
+    if hash_files:
+        to_hash = [path for path in files if path not in hashes]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash') as pool:
+            hashes.update(zip(to_hash, pool.map(lambda path: file_hash(os.path.join(root, path)), to_hash)))
+    return {path: (size, mtime, hashes.get(path)) for path, (size, mtime) in files.items()}
+
+
+def save_manifest(manifest, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for relative_path, (size, mtime, digest) in manifest.items():
+            f.write(json.dumps({'path': relative_path, 'size': size, 'mtime': mtime, 'hash': digest}) + '\n')
+    os.replace(tmp_path, path)
+
+
+def load_manifest(path):
+    manifest = {}
+    with open(path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            manifest[record['path']] = (record['size'], record['mtime'], record.get('hash'))
+    return manifest
+
+
+class ManifestDiff:
+    """
+    Differences between the source and the destination manifests, by kind: relative paths
+    missing in the destination, extra in the destination, with different size, mtime or hash.
+    Extra files don't make the copy incomplete (e.g. an Imaris file built on Hive), they're only reported.
+    """
+    KINDS = ('missing', 'extra', 'size', 'mtime', 'hash')
+    MISMATCH_KINDS = ('missing', 'size', 'mtime', 'hash')
+
+    def __init__(self):
+        for kind in self.KINDS:
+            setattr(self, kind, [])
+        self.files = 0
+        self.bytes = 0
+
+    @property
+    def clean(self):
+        return not any(getattr(self, kind) for kind in self.MISMATCH_KINDS)
+
+    def summary(self):
+        summary = {'clean': self.clean, 'files': self.files, 'bytes': self.bytes}
+        for kind in self.KINDS:
+            paths = getattr(self, kind)
+            if paths:
+                summary[kind] = {'count': len(paths), 'examples': sorted(paths)[:EXAMPLES]}
+        return summary
+
+    def __str__(self):
+        if self.clean:
+            return f"{self.files} files match" + (f", {len(self.extra)} extra" if self.extra else "")
+        return ", ".join(f"{len(getattr(self, kind))} {kind}" for kind in self.KINDS if getattr(self, kind))
+
+
+def diff_manifests(source, destination, check_mtime=True):
+    """
+    One pass over both manifests. Hashes are compared when both sides have them.
+    """
+    diff = ManifestDiff()
+    for path, (size, mtime, digest) in source.items():
+        diff.files += 1
+        diff.bytes += size
+        other = destination.get(path)
+        if other is None:
+            diff.missing.append(path)
+        elif other[0] != size:
+            diff.size.append(path)
+        elif digest and other[2] and digest != other[2]:
+            diff.hash.append(path)
+        elif check_mtime and abs(other[1] - mtime) > MTIME_TOLERANCE:
+            diff.mtime.append(path)
+    diff.extra = [path for path in destination if path not in source]
+    return diff
+
+
+def verify_tree(source, destination, source_manifest=None, hash_files=False, check_mtime=True,
+                workers=DEFAULT_WORKERS, exclude=()):
+    """
+    Build the manifests of both trees at the same time and compare them.
+    :param source: source directory, not read if source_manifest is given (e.g. saved before the source was deleted)
+    :return: (ManifestDiff, stats dict with seconds and throughput)
+    """
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        destination_future = pool.submit(build_manifest, destination, hash_files, workers, exclude)
+        if source_manifest is None:
+            source_manifest = pool.submit(build_manifest, source, hash_files, workers, exclude).result()
+        destination_manifest = destination_future.result()
+
+    diff = diff_manifests(source_manifest, destination_manifest, check_mtime)
+    seconds = time.time() - started
+    stats = {
+        'seconds': round(seconds, 1),
+        'files_per_second': round(diff.files / max(seconds, 1e-6)),
+        'mb_per_second': round(diff.bytes / max(seconds, 1e-6) / 2 ** 20) if hash_files else None,
+    }
+    rate = f", {stats['mb_per_second']} MB/s hashed" if hash_files else ""
+    print(f"Verified {destination}: {diff} in {stats['seconds']} s ({stats['files_per_second']} files/s{rate})")
+    return diff, stats
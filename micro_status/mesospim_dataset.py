@@ -3,14 +3,16 @@ import logging
 import os
 import pickle
 import re
-import subprocess
-import sqlite3
 import sys
 from datetime import datetime
 from glob import glob
 
 from .dataset import Dataset
+from .db import connect
+from .ims_probe import OK, probe
+from .job_launcher import launch
 from .settings import *
+from .volume import learned_ratio
 
 log = logging.getLogger(__name__)
 
@@ -45,7 +47,7 @@ class MesoSPIMDataset(Dataset):
     def _specific_setup(self, **kwargs):
         if self.settings_bin_file:
             # update database record
-            con = sqlite3.connect(DB_LOCATION)
+            con = connect()
             cur = con.cursor()
             res = cur.execute(
                 f'UPDATE dataset SET channels = "{self.channels}", modality = "mesospim" WHERE id={self.db_id}'
@@ -65,9 +67,9 @@ class MesoSPIMDataset(Dataset):
                 if len(set(tile_sizes)) == 1:  # imaging finished
                     self.mark_imaging_finished()
                     self.send_message('imaging_finished')
-                    self.start_processing()
-                    self.update_processing_status('in_progress')
-                    self.send_message('processing_started')
+                    if self.start_processing():
+                        self.update_processing_status('in_progress')
+                        self.send_message('processing_started')
             else:
                 print("Imaging still in progress")
                 tiles_imaged_prev = self.tiles_finished
@@ -85,7 +87,7 @@ class MesoSPIMDataset(Dataset):
                         imaging_summary['smallest_file_size'] = smallest_file_size
                         imaging_summary_str = json.dumps(imaging_summary)
                         # self.update_db_field('imaging_summary', imaging_summary_str)
-                        con = sqlite3.connect(DB_LOCATION)
+                        con = connect()
                         cur = con.cursor()
                         res = cur.execute(f"UPDATE dataset SET imaging_summary = '{imaging_summary_str}' WHERE id={self.db_id}")
                         con.commit()
@@ -122,10 +124,34 @@ class MesoSPIMDataset(Dataset):
             total_colors = len(set(lasers))
             return total_colors
 
+    def project_volume(self):
+        """
+        Raw size from the tile list in the .bin file and the biggest tile imaged so far, tile Imaris files relative to it
+        """
+        if not self.tiles_total:
+            return None
+        tile_sizes = [os.path.getsize(x) for x in glob(os.path.join(self.path, "*.btf"))]
+        if not tile_sizes:
+            return None
+        raw = self.tiles_total * max(tile_sizes)
+        return {'raw': raw, 'tile_ims': int(raw * learned_ratio('tile_ims'))}
+
+    def volume_written(self, projection):
+        tiles = glob(os.path.join(self.path, "*.btf"))
+        ims_files = glob(os.path.join(self.path, 'ims_files', '*.ims'))
+        return {
+            'raw': sum(os.path.getsize(x) for x in tiles),
+            'tile_ims': sum(os.path.getsize(x) for x in ims_files),
+        }
+
     def start_processing(self):
         """
         /CBI_FastStore/cbiPythonTools/mesospim_utils/mesospim_utils/rl.py convert-ims-dir-mesospim-tiles <path_on_fast_store> --res 5 1 1
+        Held back (retried on the next imaging check) while the Imaris files wouldn't fit
+        :return: Job, None if held back
         """
+        if not self.admit_processing():
+            return None
         cmd = [
             '/CBI_FastStore/cbiPythonTools/mesospim_utils/mesospim_utils/rl.py',
             'convert-ims-dir-mesospim-tiles',
@@ -136,18 +162,15 @@ class MesoSPIMDataset(Dataset):
             str(self.resolution_xy)
         ]
         print("COMMAND TO CONVERT TO IMS", cmd)
-        subprocess.run(cmd)
+        return launch(self, 'mesospim_convert', cmd)
 
     def check_tile_ims_files(self):
-        from imaris_ims_file_reader import ims
         all_good = True
         ims_files = sorted(glob(os.path.join(self.path_on_fast_store, 'ims_files', '*.ims')))
         for ims_file in ims_files:
-            try:
-                # try to open imaris file
-                ims_file_obj = ims(ims_file)
-            except Exception as e:
-                log.error(f"ERROR opening imaris file: {e}")
+            verdict = probe(ims_file)
+            if verdict != OK:
+                log.error(f"ERROR checking imaris file {ims_file}: {verdict}")
                 self.send_message("broken_ims_file")
                 all_good = False
         return all_good
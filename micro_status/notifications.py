@@ -0,0 +1,97 @@
+import logging
+import threading
+
+from micro_status.outbox import enqueue, has_thread
+from micro_status.settings import *
+
+log = logging.getLogger(__name__)
+
+# these also show up in the channel when posted into a dataset's thread
+WARNING_MSG_TYPES = {
+    'imaging_paused', 'broken_ims_file', 'stitching_error', 'stitching_stuck', 'denoising_stuck', 'ims_build_stuck',
+    'broken_tiff_file', 'ims_build_failed', 'mesospim_convert_failed', 'move_failed',
+}
+SLACK_SECTION_MAX_CHARS = 2900  # Slack allows 3000 characters in a section block
+
+_events = []
+_lock = threading.Lock()
+
+
+def add_event(dataset_id, msg_type, text):
+    """
+    Collect a dataset message during a scan cycle, it's posted by flush() at the end of the cycle.
+    """
+    with _lock:
+        _events.append((dataset_id, msg_type, text))
+
+
+def make_payload(lines):
+    blocks = []
+    text = ""
+    for line in lines:
+        if text and len(text) + len(line) + 1 > SLACK_SECTION_MAX_CHARS:
+            blocks.append(text)
+            text = ""
+        text = f"{text}\n{line}" if text else line
+    if text:
+        blocks.append(text)
+    return {
+        "channel": SLACK_CHANNEL_ID,
+        "text": lines[0] if lines else "",  # notification fallback
+        "blocks": [{"type": "section", "text": {"type": "mrkdwn", "text": block}} for block in blocks]
+    }
+
+
+def coalesce(events):
+    """
+    :param events: list of (msg_type, text) of one dataset
+    :return: lines of text, repeated messages (e.g. one per broken tile) reported once with a count
+    """
+    counts = {}
+    for msg_type, text in events:
+        counts[text] = counts.get(text, 0) + 1
+    return [text if count == 1 else f"{text} (x{count})" for text, count in counts.items()]
+
+
+def flush():
+    """
+    Post the messages collected during the cycle:
+      - datasets that already have a thread get one reply per cycle in that thread,
+        broadcast to the channel if it contains a warning;
+      - a single other dataset gets a regular channel message, which becomes its thread;
+      - several other datasets are summarized in one digest message, which becomes the thread of each of them.
+    """
+    global _events
+    with _lock:
+        events, _events = _events, []
+    if not events:
+        return
+
+    by_dataset = {}
+    for dataset_id, msg_type, text in events:
+        by_dataset.setdefault(dataset_id, []).append((msg_type, text))
+
+    new_datasets = []
+    for dataset_id, dataset_events in by_dataset.items():
+        lines = coalesce(dataset_events)
+        msg_types = ",".join(sorted(set(msg_type for msg_type, _ in dataset_events)))
+        if dataset_id is not None and has_thread(dataset_id):
+            payload = make_payload(lines)
+            if any(msg_type in WARNING_MSG_TYPES for msg_type, _ in dataset_events):
+                payload['reply_broadcast'] = True
+            enqueue(payload, dataset_id=dataset_id, msg_type=msg_types, in_thread=True)
+        else:
+            new_datasets.append((dataset_id, lines, msg_types))
+
+    if len(new_datasets) == 1:
+        dataset_id, lines, msg_types = new_datasets[0]
+        enqueue(make_payload(lines), dataset_id=dataset_id, msg_type=msg_types)
+    elif new_datasets:
+        log.info(f"Posting digest for {len(new_datasets)} datasets")
+        lines = [f"*Updates for {len(new_datasets)} datasets:*"]
+        for dataset_id, dataset_lines, msg_types in new_datasets:
+            lines.extend(f"• {line}" for line in dataset_lines)
+        enqueue(
+            make_payload(lines), msg_type='digest',
+            dataset_ids=[dataset_id for dataset_id, _, _ in new_datasets if dataset_id is not None]
+        )
@@ -0,0 +1,240 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from micro_status.db import connect
+from micro_status.leases import acquire, holds
+from micro_status.settings import *
+
+log = logging.getLogger(__name__)
+
+# only the worker holding this lease posts to Slack
+SENDER_LEASE = 'outbox_sender'
+
+# Slack errors that won't go away by retrying
+PERMANENT_ERRORS = {
+    'invalid_auth', 'not_authed', 'account_inactive', 'token_revoked', 'channel_not_found', 'not_in_channel',
+    'is_archived', 'invalid_blocks', 'invalid_blocks_format', 'msg_too_long', 'no_text', 'missing_scope',
+}
+
+_sender = None
+
+
+def enqueue(payload, dataset_id=None, warning_id=None, msg_type=None, in_thread=False, dataset_ids=None):
+    """
+    Store a Slack message to be delivered by the sender thread.
+    :param in_thread: post as a reply in the dataset's thread (its first channel message)
+    :param dataset_ids: datasets a digest message is about, it becomes the thread of those without one
+    :return: outbox record id
+    """
+    con = connect()
+    cur = con.cursor()
+    cur.execute(
+        '''INSERT INTO outbox(created, payload, status, next_attempt, dataset_id, warning_id, msg_type, in_thread)
+        VALUES(?, ?, 'pending', ?, ?, ?, ?, ?)''',
+        (
+            datetime.now().strftime(DATETIME_FORMAT), json.dumps(payload), time.time(), dataset_id, warning_id,
+            msg_type, int(in_thread)
+        )
+    )
+    message_id = cur.lastrowid
+    cur.executemany(
+        'INSERT INTO outbox_dataset(outbox_id, dataset_id) VALUES(?, ?)',
+        [(message_id, covered_id) for covered_id in dataset_ids or []]
+    )
+    con.commit()
+    con.close()
+    if _sender is not None:
+        _sender.wake_up()
+    return message_id
+
+
+def has_pending(warning_id=None, dataset_id=None, msg_type=None):
+    query = "SELECT COUNT(*) FROM outbox WHERE status='pending'"
+    if warning_id is not None:
+        query += f' AND warning_id={warning_id}'
+    if dataset_id is not None:
+        query += f' AND dataset_id={dataset_id}'
+    if msg_type is not None:
+        query += f" AND msg_type='{msg_type}'"
+    con = connect()
+    cur = con.cursor()
+    count = cur.execute(query).fetchone()[0]
+    con.close()
+    return count > 0
+
+
+def get_thread_root(dataset_id):
+    """
+    First channel message about the dataset, its own or a digest covering it, that was delivered
+    or is still being delivered.
+    :return: (status, ts, next_attempt) or None
+    """
+    con = connect()
+    cur = con.cursor()
+    root = cur.execute(
+        "SELECT status, ts, next_attempt FROM outbox "
+        "WHERE (dataset_id = ? OR id IN (SELECT outbox_id FROM outbox_dataset WHERE dataset_id = ?)) AND in_thread = 0 "
+        "AND (status = 'pending' OR (status = 'sent' AND ts IS NOT NULL)) ORDER BY id LIMIT 1",
+        (dataset_id, dataset_id)
+    ).fetchone()
+    con.close()
+    return root
+
+
+def has_thread(dataset_id):
+    return get_thread_root(dataset_id) is not None
+
+
+class OutboxSender(threading.Thread):
+    """
+    Delivers pending outbox messages to Slack one at a time, no faster than SLACK_MIN_INTERVAL,
+    retrying failed posts with exponential backoff.
+    """
+    def __init__(self, url=None):
+        super().__init__(name="slack-outbox", daemon=True)
+        self.url = url or SLACK_URL
+        self.session = requests.Session()
+        self.session.headers.update(SLACK_HEADERS)
+        self.last_post = 0
+        self._wake_up_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def wake_up(self):
+        self._wake_up_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_up_event.set()
+
+    def run(self):
+        log.info("Slack outbox sender started")
+        while not self._stop_event.is_set():
+            if not holds(SENDER_LEASE) and not acquire(SENDER_LEASE):
+                # another worker delivers the messages
+                self._stop_event.wait(SLACK_OUTBOX_POLL_INTERVAL)
+                continue
+            try:
+                sent_any = self.send_due()
+            except Exception as e:
+                log.error(f"Slack outbox sender error: {e}")
+                sent_any = False
+            if not sent_any:
+                self._wake_up_event.wait(SLACK_OUTBOX_POLL_INTERVAL)
+                self._wake_up_event.clear()
+
+    def due_messages(self, limit=20):
+        con = connect()
+        cur = con.cursor()
+        records = cur.execute(
+            "SELECT id, payload, attempts, warning_id, dataset_id, in_thread FROM outbox "
+            "WHERE status='pending' AND next_attempt <= ? "
+            'ORDER BY id LIMIT ?',
+            (time.time(), limit)
+        ).fetchall()
+        con.close()
+        return records
+
+    def send_due(self):
+        """
+        :return: True if anything was attempted
+        """
+        records = self.due_messages()
+        for message_id, payload, attempts, warning_id, dataset_id, in_thread in records:
+            if self._stop_event.is_set():
+                break
+            payload = json.loads(payload)
+            if in_thread:
+                root = get_thread_root(dataset_id)
+                if root and root[0] == 'pending':  # thread root not delivered yet, reply after it
+                    self.postpone(message_id, max(root[2], time.time()) + SLACK_MIN_INTERVAL)
+                    continue
+                if root:
+                    payload['thread_ts'] = root[1]
+                else:  # nothing to reply to
+                    payload.pop('reply_broadcast', None)
+            wait = self.last_post + SLACK_MIN_INTERVAL - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            retry_after = self.deliver(message_id, payload, attempts, warning_id)
+            if retry_after:  # rate limited, nothing else goes out before that
+                self._stop_event.wait(retry_after)
+                break
+        return len(records) > 0
+
+    def postpone(self, message_id, next_attempt):
+        con = connect()
+        cur = con.cursor()
+        cur.execute('UPDATE outbox SET next_attempt = ? WHERE id = ?', (next_attempt, message_id))
+        con.commit()
+        con.close()
+
+    def deliver(self, message_id, payload, attempts, warning_id):
+        """
+        Post one message and record the outcome.
+        :return: seconds to wait if Slack rate limited us, otherwise None
+        """
+        self.last_post = time.time()
+        attempts += 1
+        try:
+            response = self.session.post(self.url, data=json.dumps(payload), timeout=SLACK_TIMEOUT)
+        except requests.RequestException as e:
+            self.mark_failed_attempt(message_id, attempts, str(e))
+            return
+        if response.status_code == 429:
+            retry_after = int(response.headers.get('Retry-After', 30))
+            log.info(f"Slack rate limit, retrying message {message_id} in {retry_after} s")
+            # being rate limited doesn't count as a failed attempt
+            self.mark_failed_attempt(message_id, attempts - 1, 'ratelimited', retry_after=retry_after)
+            return retry_after
+        try:
+            data = response.json()
+        except ValueError:
+            data = {'ok': False, 'error': f'HTTP {response.status_code}'}
+        if data.get('ok'):
+            self.mark_sent(message_id, attempts, data.get('ts'), warning_id, payload.get('thread_ts'))
+        else:
+            error = data.get('error', 'unknown_error')
+            self.mark_failed_attempt(message_id, attempts, error, permanent=error in PERMANENT_ERRORS)
+
+    def mark_sent(self, message_id, attempts, ts, warning_id, thread_ts=None):
+        con = connect()
+        cur = con.cursor()
+        cur.execute(
+            "UPDATE outbox SET status = 'sent', attempts = ?, ts = ?, thread_ts = ?, sent = ?, error = NULL WHERE id = ?",
+            (attempts, ts, thread_ts, datetime.now().strftime(DATETIME_FORMAT), message_id)
+        )
+        if warning_id is not None:
+            cur.execute(f'UPDATE warning SET message_sent = 1 WHERE id={warning_id}')
+        con.commit()
+        con.close()
+
+    def mark_failed_attempt(self, message_id, attempts, error, permanent=False, retry_after=None):
+        if permanent or attempts >= SLACK_MAX_ATTEMPTS:
+            status = 'failed'
+            log.error(f"Giving up on Slack message {message_id} after {attempts} attempts: {error}")
+        else:
+            status = 'pending'
+            log.info(f"Slack message {message_id} attempt {attempts} failed: {error}")
+        if retry_after is None:
+            retry_after = min(SLACK_RETRY_BASE_DELAY * 2 ** (attempts - 1), SLACK_RETRY_MAX_DELAY)
+        con = connect()
+        cur = con.cursor()
+        cur.execute(
+            'UPDATE outbox SET status = ?, attempts = ?, error = ?, next_attempt = ? WHERE id = ?',
+            (status, attempts, error, time.time() + retry_after, message_id)
+        )
+        con.commit()
+        con.close()
+
+
+def start_sender():
+    global _sender
+    if _sender is None or not _sender.is_alive():
+        _sender = OutboxSender()
+        _sender.start()
+    return _sender
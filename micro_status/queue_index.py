@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+
+from .settings import *
+from .utils import current_cycle
+
+log = logging.getLogger(__name__)
+
+# clusterStitch queue directories, a file found in several of them is in the first one
+QUEUE_STATES = ['complete', 'error', 'processing', 'queueStitch', 'tempQueue']
+
+_index = None
+_lock = threading.Lock()
+# queue file name -> (state, time the file was first seen in that state)
+_state_since = {}
+_state_lock = threading.Lock()
+
+
+class QueueIndex:
+    """
+    Contents of the clusterStitch queue directories, listed once per scan cycle.
+    entries: queue file name -> (state, mtime)
+    changed: queue files that moved to another queue directory since the previous scan
+    The stages share the index and run concurrently: record_move() changes entries while other stages
+    read them, so they're changed and iterated under a lock.
+    """
+    def __init__(self, entries=None, root=None, cycle=None):
+        self.entries = entries or {}
+        self.root = root or RSCM_FOLDER_STITCHING
+        self.cycle = cycle
+        self.changed = set()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"QueueIndex({self.root}, {len(self.entries)} files)"
+
+    @classmethod
+    def scan(cls, root=None):
+        root = root or RSCM_FOLDER_STITCHING
+        entries = {}
+        for state in reversed(QUEUE_STATES):  # later states overwrite earlier ones
+            try:
+                with os.scandir(os.path.join(root, state)) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                entries[entry.name] = (state, entry.stat().st_mtime)
+                        except FileNotFoundError:  # moved while listing
+                            continue
+            except FileNotFoundError:
+                log.error(f"Queue directory {os.path.join(root, state)} doesn't exist")
+        index = cls(entries=entries, root=root, cycle=current_cycle())
+        index._track_states()
+        return index
+
+    def _track_states(self):
+        now = time.time()
+        with _state_lock:
+            for name, (state, mtime) in self.entries.items():
+                previous = _state_since.get(name)
+                if previous is None:
+                    # first time we see the file, moving it between queues keeps its mtime
+                    _state_since[name] = (state, min(mtime, now))
+                elif previous[0] != state:
+                    _state_since[name] = (state, now)
+                    self.changed.add(name)
+            for name in list(_state_since):
+                if name not in self.entries:
+                    del _state_since[name]
+
+    def items(self):
+        """
+        :return: list of (queue file name, (state, mtime)), a copy that can be iterated while the index changes
+        """
+        with self._lock:
+            return list(self.entries.items())
+
+    def state_of(self, name):
+        entry = self.entries.get(name)
+        return entry[0] if entry else None
+
+    def is_in(self, name, state):
+        return self.state_of(name) == state
+
+    def files_in(self, state, suffix=""):
+        return sorted(name for name, (file_state, _) in self.items() if file_state == state and name.endswith(suffix))
+
+    def path(self, name, state=None):
+        return os.path.join(self.root, state or self.state_of(name), name)
+
+    def time_in_state(self, name):
+        """
+        :return: seconds the file has been in its current queue directory, None if it's not in any
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        with _state_lock:
+            state, since = _state_since.get(name, (None, entry[1]))
+        return time.time() - since
+
+    def record_move(self, name, state):
+        """Keep the index up to date when the scanner itself moves a queue file"""
+        with self._lock:
+            mtime = self.entries[name][1] if name in self.entries else time.time()
+            self.entries[name] = (state, mtime)
+        with _state_lock:
+            _state_since[name] = (state, time.time())
+
+    def summary(self):
+        """
+        Queue wait metrics: state -> {'files': count, 'longest_wait': seconds}
+        """
+        summary = {state: {'files': 0, 'longest_wait': 0} for state in QUEUE_STATES}
+        for name, (state, _) in self.items():
+            summary[state]['files'] += 1
+            summary[state]['longest_wait'] = max(summary[state]['longest_wait'], round(self.time_in_state(name)))
+        return summary
+
+
+def get_queue_index():
+    """
+    Queue index for the current scan cycle, listed on first use.
+    """
+    global _index
+    with _lock:
+        if _index is None or _index.cycle != current_cycle():
+            _index = QueueIndex.scan()
+        return _index
@@ -1,16 +1,28 @@
+import json
 import logging
 import os
 import re
-import shutil
-import sqlite3
 import time
+from datetime import datetime
 from glob import glob
 from pathlib import Path
 
 from bs4 import BeautifulSoup
 
+from .cbpy_monitor import get_cbpy_snapshot
+from .channel_deletion import start_deletion
+from .checksums import hash_new_ribbons
+from .composite_manifest import get_manifest
 from .dataset import Dataset
+from .db import connect
+from .ims_progress import describe_progress, predict_ims_size, update_build_progress
+from .job_launcher import launch
+from .queue_index import get_queue_index
+from .rscm_paths import get_mtime, paths_are_valid, resolve_rscm_paths
+from .scheduler import wake_stage
 from .settings import *
+from .trash import move_to_trash
+from .volume import learned_ratio, median_ribbon_size
 
 log = logging.getLogger(__name__)
 
@@ -18,6 +30,7 @@ log = logging.getLogger(__name__)
 class RSCMDataset(Dataset):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._paths = None
 
     def _specific_setup(self, **kwargs):
         print("In specific setup")
@@ -47,7 +60,7 @@ class RSCMDataset(Dataset):
         ribbons_total = z_layers * channels * ribbons_in_z_layer
 
         # update database record
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(
             f'UPDATE dataset SET z_layers_total = "{z_layers}", ribbons_total = "{ribbons_total}", z_layers_current = "{z_layers - 1}", ribbons_finished = 0, modality = "rscm" WHERE id={self.db_id}'
@@ -91,12 +104,12 @@ class RSCMDataset(Dataset):
 
         finished = ribbons_finished == self.ribbons_total
 
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET ribbons_finished = {ribbons_finished} WHERE id={self.db_id}')
         con.commit()
         con.close()
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET z_layers_current = {z_layers_current} WHERE id={self.db_id}')
         con.commit()
@@ -125,22 +138,66 @@ class RSCMDataset(Dataset):
 
         return finished, has_progress, error_flag
 
+    def hash_new_ribbons(self, finished=False):
+        """Add the ribbons imaged since the last check to the checksum manifest (in the background)"""
+        try:
+            summary = hash_new_ribbons(
+                self.db_id, self.path_on_fast_store, self.ribbons_in_z_layer, finished,
+                on_complete=lambda summary: self.update_processing_summary({'checksums': summary})
+            )
+        except OSError as e:  # the manifest is only an optimization for verifying the move later
+            log.error(f"Could not update the checksum manifest of {self}: {e}")
+            return
+        self.update_processing_summary({'checksums': summary})
+
+    def project_volume(self):
+        """
+        Raw size from the number of ribbons in vs_series.dat and the size of the ones imaged so far,
+        composites, denoised composites and the Imaris file relative to it
+        """
+        ribbon_size = median_ribbon_size(self.path_on_fast_store)
+        if not ribbon_size or not self.ribbons_total:
+            return None
+        raw = int(self.ribbons_total) * ribbon_size
+        projection = {'raw': raw}
+        for stage in ('composites', 'denoised', 'ims'):
+            projection[stage] = int(raw * learned_ratio(stage))
+        return projection
+
+    def volume_written(self, projection):
+        written = {'raw': projection['raw'] * int(self.ribbons_finished or 0) // int(self.ribbons_total)}
+        if self.processing_status == 'not_started':
+            return written
+        written['composites'] = sum(self.raw_composites_manifest.files.values())
+        if self.job_dir:
+            written['denoised'] = sum(self.denoised_composites_manifest.files.values())
+        for ims_path in (self.full_path_to_imaris_file, self.full_path_to_ims_part_file):
+            if ims_path and os.path.exists(ims_path):
+                written['ims'] = os.path.getsize(ims_path)
+                break
+        return written
+
     def start_processing(self):
         """create txt file in the RSCM queue stitch directory
         file name: {dataset_id}_{pi_name}_{cl_number}_{dataset_name}.txt
         this way the earlier datasets go in first
+        Held back (retried by check_RSCM_processing) while the stitching output wouldn't fit on FastStore
+        :return: True if queued
         """
+        if not self.admit_processing():
+            return False
         file_path = Path(self.path_on_fast_store)
         txt_file_path = os.path.join(RSCM_FOLDER_STITCHING, 'queueStitch', self.rscm_txt_file_name)
         # txt_file_path = os.path.join(RSCM_FOLDER_STITCHING, 'tempQueue', self.rscm_txt_file_name)
         contents = f'rootDir="{str(file_path)}"\nkeepComposites=True\nmoveToHive=False'
         with open(txt_file_path, "w") as f:
             f.write(contents)
+        get_queue_index().record_move(self.rscm_txt_file_name, 'queueStitch')
         log.info("-----------------------Queue processing. Text file : ---------------------")
         log.info(contents)
+        return True
 
     def build_imaris_file(self):
-        import subprocess
         print("Starting imaris build command")
         cmd = [
             '/h20/home/lab/miniconda3/envs/make_ims/bin/python',
@@ -149,7 +206,7 @@ class RSCMDataset(Dataset):
             'true'
         ]
         print(cmd)
-        subprocess.run(cmd)
+        return launch(self, 'build_ims', cmd)
 
     @property
     def ribbons_in_z_layer(self):
@@ -170,17 +227,8 @@ class RSCMDataset(Dataset):
             return
         raw_composites = sorted(glob(os.path.join(self.composites_dir, 'composite_*.tif')))
         log.info(f"raw_composites: {len(raw_composites)}")
-        if self.full_path_to_imaris_file.startswith('/CBI_FastStore'):
-            trash_location = FASTSTORE_TRASH_LOCATION
-        else:
-            trash_location = HIVE_TRASH_LOCATION
-        trash_folder_raw = os.path.join(trash_location, self.pi, self.cl_number, self.name, "raw_composites")
-        if not os.path.exists(trash_folder_raw):
-            os.makedirs(trash_folder_raw)
-        for f in raw_composites:
-            log.info(f"move to trash: {f}")
-            trash_path = os.path.join(trash_folder_raw, os.path.basename(f))
-            shutil.move(f, trash_path)
+        trash_path = move_to_trash(self, "raw_composites", raw_composites)
+        log.info(f"moved to trash: {trash_path}")
 
     def clean_up_denoised_composites(self):
         log.info("---------------------Cleaning up denoised composites--------------------")
@@ -189,20 +237,11 @@ class RSCMDataset(Dataset):
             return
         denoised_composites = sorted(glob(os.path.join(self.job_dir, 'composite_*.tif')))
         log.info(f"denoised_composites: {len(denoised_composites)}")
-        if self.full_path_to_imaris_file.startswith('/CBI_FastStore'):
-            trash_location = FASTSTORE_TRASH_LOCATION
-        else:
-            trash_location = HIVE_TRASH_LOCATION
-        trash_folder_denoised = os.path.join(trash_location, self.pi, self.cl_number, self.name, "denoised_composites")
-        if not os.path.exists(trash_folder_denoised):
-            os.makedirs(trash_folder_denoised)
-        for f in denoised_composites:
-            log.info(f"move to trash: {f}")
-            trash_path = os.path.join(trash_folder_denoised, os.path.basename(f))
-            shutil.move(f, trash_path)
+        trash_path = move_to_trash(self, "denoised_composites", denoised_composites)
+        log.info(f"moved to trash: {trash_path}")
 
     def update_job_number(self, job_number):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE dataset SET job_number = "{job_number}" WHERE id={self.db_id}')
         con.commit()
@@ -214,28 +253,23 @@ class RSCMDataset(Dataset):
         Check if current dataset's txt file is in 'processing' dir for stitching
         :return: bool
         """
-        txt_file_path = os.path.join(RSCM_FOLDER_STITCHING, 'processing', self.rscm_txt_file_name)
-        return os.path.exists(txt_file_path)
+        return get_queue_index().is_in(self.rscm_txt_file_name, 'processing')
 
     def check_stitching_progress(self):
-        response = requests.get(f'{DASK_DASHBOARD}info/main/workers.html')
-        soup = BeautifulSoup(response.content)
-        trs = soup.select('tr')
-        workers = {}
-        for tr in trs[1:]:
-            a = tr.find('td').find('a')
-            worker_url = a.attrs['href'].replace('../', f'{DASK_DASHBOARD}info/')
-            resp = requests.get(worker_url)
-            soup = BeautifulSoup(resp.content)
-            tables = soup.select('table')
-            rows = tables[2].select("tr")
-            workers[a.text] = len(rows) - 1
-        processing_summary = self.get_processing_summary()
-        workers_previous = processing_summary.get('stitching', {})
-        has_progress = workers != workers_previous
+        """
+        Progress is this dataset's own output, the composites dir changing. Tasks on the Dask cluster can't be
+        told apart by dataset (the stitching listener submits them with Dask's default keys), so with several
+        datasets being stitched cluster activity would make a stuck one look as busy as the others.
+        A dataset still aligning has no composites yet, if it's paused for that recover() resumes it once
+        the composites dir changes.
+        :return: bool
+        """
+        composites_mtime = get_mtime(self.composites_dir)
+        stitching_summary = self.get_processing_summary().get('stitching', {})
+        has_progress = composites_mtime is not None and composites_mtime != stitching_summary.get('composites_mtime')
         print("---------------------------stitching has progress", has_progress)
         if has_progress:
-            self.update_processing_summary({"stitching": workers})
+            self.update_processing_summary({"stitching": {'composites_mtime': composites_mtime}})
         return has_progress
 
     def check_stitching_complete(self):
@@ -243,16 +277,14 @@ class RSCMDataset(Dataset):
         Check if current dataset's txt file is in 'complete' dir
         :return: bool
         """
-        txt_file_path = os.path.join(RSCM_FOLDER_STITCHING, 'complete', self.rscm_txt_file_name)
-        return os.path.exists(txt_file_path)
+        return get_queue_index().is_in(self.rscm_txt_file_name, 'complete')
 
     def check_stitching_errored(self):
         """
         Check if current dataset's txt file is in 'error' dir
         :return: bool
         """
-        txt_file_path = os.path.join(RSCM_FOLDER_STITCHING, 'error', self.rscm_txt_file_name)
-        return os.path.exists(txt_file_path)
+        return get_queue_index().is_in(self.rscm_txt_file_name, 'error')
 
     def check_tiffs(self, z_start, z_stop):
         """
@@ -267,7 +299,7 @@ class RSCMDataset(Dataset):
             print("checking layer", z)
             layer_dir = os.path.join(
                 str(Path(self.path_on_fast_store).parent),
-                f'{self.name.split("_stack")[0]}_layer{str(z).zfill(3) if z < 1000 else str(z)}'
+                self.layer_dir_name(z)
             )
             colors = glob(os.path.join(layer_dir, '[0-9]' * 3))
 
@@ -282,135 +314,102 @@ class RSCMDataset(Dataset):
                     except Exception:
                         return z
             self.z_layers_checked = z
-            con = sqlite3.connect(DB_LOCATION)
+            con = connect()
             cur = con.cursor()
             res = cur.execute(
                 f'UPDATE dataset SET z_layers_checked = {z} WHERE id={self.db_id}')
             con.commit()
             con.close()
 
+    @property
+    def paths(self):
+        """
+        Composites dir, job dir and imaris file paths, resolved together once per instance.
+        Reading them never writes to the db, refresh_paths() stores them.
+        """
+        if self._paths is None:
+            cached = self.get_processing_summary().get('paths')
+            if paths_are_valid(cached, self.pi, self.cl_number, self.name, self.job_number):
+                self._paths = cached
+            else:
+                self._paths = resolve_rscm_paths(self.pi, self.cl_number, self.name, self.job_number)
+        return self._paths
+
+    def refresh_paths(self):
+        """
+        Resolve the paths again if anything they depend on changed, store them and the job number in the db
+        """
+        cached = self.get_processing_summary().get('paths')
+        self._paths = None
+        if self.paths == cached:
+            return self._paths
+        log.info(f"Paths of {self.name} resolved: {self._paths}")
+        self.update_processing_summary({'paths': self._paths})
+        job_number = self._paths['job_number']
+        if job_number is not None and str(job_number) != str(self.job_number):
+            self.update_job_number(job_number)
+        return self._paths
+
     @property
     def composites_dir(self):
         """
         At the time of building composites
         """
-        data_location = DATA_LOCATION[WHERE_PROCESSING_HAPPENS['build_composites']]
-        raw_data_dir = os.path.join(data_location, self.pi, self.cl_number, self.name)
-        composites_dir = os.path.join(raw_data_dir, 'composites_RSCM_v0.1')
-        if os.path.exists(composites_dir):
-            return composites_dir
-        if data_location == RSCM_FASTSTORE_ACQUISITION_FOLDER:
-            data_location = HIVE_ACQUISITION_FOLDER
-        else:
-            data_location = RSCM_FASTSTORE_ACQUISITION_FOLDER
-        raw_data_dir = os.path.join(data_location, self.pi, self.cl_number, self.name)
-        return os.path.join(raw_data_dir, 'composites_RSCM_v0.1')
+        return self.paths['composites_dir']
 
     @property
     def job_dir(self):
         """
         At the time of denoising
         """
-        data_location = DATA_LOCATION[WHERE_PROCESSING_HAPPENS['denoise']]
-        raw_data_dir = os.path.join(data_location, self.pi, self.cl_number, self.name)
-        composites_dir = os.path.join(raw_data_dir, 'composites_RSCM_v0.1')
-        job_dirs = [f for f in sorted(glob(os.path.join(composites_dir, 'job_*'))) if os.path.isdir(f)]
-        if len(job_dirs):
-            final_job_dir = job_dirs[-1]
-        else: # TODO: rewrite this terrible piece
-            if data_location == RSCM_FASTSTORE_ACQUISITION_FOLDER:
-                data_location = HIVE_ACQUISITION_FOLDER
-            else:
-                data_location = RSCM_FASTSTORE_ACQUISITION_FOLDER
-            raw_data_dir = os.path.join(data_location, self.pi, self.cl_number, self.name)
-            composites_dir = os.path.join(raw_data_dir, 'composites_RSCM_v0.1')
-            job_dirs = [f for f in sorted(glob(os.path.join(composites_dir, 'job_*'))) if os.path.isdir(f)]
-            final_job_dir = job_dirs[-1] if len(job_dirs) else None
-        if final_job_dir:
-            job_number = re.findall(r"\d+", os.path.basename(final_job_dir))[-1]
-            self.update_job_number(job_number)
-        return final_job_dir
+        return self.paths['job_dir']
 
     @property
     def imaris_file_name(self):
-        return f"composites_RSCM_v0.1_job_{self.job_number}.ims"
+        return f"composites_RSCM_v0.1_job_{self.paths['job_number']}.ims"
 
     @property
     def full_path_to_imaris_file(self):
         """
         At the time of building ims
         """
-        data_location = DATA_LOCATION[WHERE_PROCESSING_HAPPENS['build_ims']]
-        composites_dir = os.path.join(data_location, self.pi, self.cl_number, self.name, 'composites_RSCM_v0.1')
-        job_folder = os.path.join(composites_dir, f"job_{self.job_number}")
-        if not os.path.exists(job_folder):
-            # if folder doesn't exist, try to find other job folders
-            job_dirs = [f for f in sorted(glob(os.path.join(composites_dir, 'job_*'))) if os.path.isdir(f)]
-            job_folder = job_dirs[-1] if len(job_dirs) else composites_dir
-        ims_path = os.path.join(job_folder, self.imaris_file_name)
-        if os.path.exists(ims_path):
-            return ims_path
-        if data_location == RSCM_FASTSTORE_ACQUISITION_FOLDER:  # TODO: rewrite this terrible piece
-            data_location = HIVE_ACQUISITION_FOLDER
-        else:
-            data_location = RSCM_FASTSTORE_ACQUISITION_FOLDER
-        composites_dir = os.path.join(data_location, self.pi, self.cl_number, self.name, 'composites_RSCM_v0.1')
-        job_folder = os.path.join(composites_dir, f"job_{self.job_number}")
-        if not os.path.exists(job_folder):
-            # if folder doesn't exist, try to find other job folders
-            job_dirs = [f for f in sorted(glob(os.path.join(composites_dir, 'job_*'))) if os.path.isdir(f)]
-            job_folder = job_dirs[-1] if len(job_dirs) else composites_dir
-        return os.path.join(job_folder, self.imaris_file_name)
+        return self.paths['imaris_file']
 
     @property
     def full_path_to_ims_part_file(self):
-        data_location = DATA_LOCATION[WHERE_PROCESSING_HAPPENS['build_ims']]
-        composites_dir = os.path.join(data_location, self.pi, self.cl_number, self.name, 'composites_RSCM_v0.1')
-        job_folder = os.path.join(composites_dir, f"job_{self.job_number}")
-        if not os.path.exists(job_folder):
-            # if folder doesn't exist, try to find other job folders
-            job_dirs = [f for f in sorted(glob(os.path.join(composites_dir, 'job_*'))) if os.path.isdir(f)]
-            job_folder = job_dirs[-1] if len(job_dirs) else composites_dir
-        ims_part_path = os.path.join(job_folder, f"{self.imaris_file_name}.part")
-        if os.path.exists(ims_part_path):
-            return ims_part_path
-        if data_location == RSCM_FASTSTORE_ACQUISITION_FOLDER:  # TODO: rewrite this terrible piece
-            data_location = HIVE_ACQUISITION_FOLDER
-        else:
-            data_location = RSCM_FASTSTORE_ACQUISITION_FOLDER
-        composites_dir = os.path.join(data_location, self.pi, self.cl_number, self.name, 'composites_RSCM_v0.1')
-        job_folder = os.path.join(composites_dir, f"job_{self.job_number}")
-        if not os.path.exists(job_folder):
-            # if folder doesn't exist, try to find other job folders
-            job_dirs = [f for f in sorted(glob(os.path.join(composites_dir, 'job_*'))) if os.path.isdir(f)]
-            job_folder = job_dirs[-1] if len(job_dirs) else composites_dir
-        return os.path.join(job_folder, f"{self.imaris_file_name}.part")
+        return self.paths['ims_part_file']
+
+    @property
+    def raw_composites_manifest(self):
+        return get_manifest(self.composites_dir)
+
+    @property
+    def denoised_composites_manifest(self):
+        return get_manifest(self.job_dir)
+
+    @property
+    def expected_composites(self):
+        return self.z_layers_total * self.channels
 
     def check_all_raw_composites_present(self):
-        expected_composites = self.z_layers_total * self.channels
-        print('expected raw composites', expected_composites)
-        actual_composites = len(glob(os.path.join(self.composites_dir, 'composite*.tif')))
+        print('expected raw composites', self.expected_composites)
+        actual_composites = self.raw_composites_manifest.count
         print('actual raw composites', actual_composites)
-        return expected_composites == actual_composites
+        return self.expected_composites == actual_composites
 
     def check_all_raw_composites_same_size(self):
-        files = sorted(glob(os.path.join(self.composites_dir, 'composite*.tif')))
-        composite_sizes = [os.path.getsize(x) for x in files]
-        return len(set(composite_sizes)) == 1
+        return self.raw_composites_manifest.is_uniform
 
     def check_all_denoised_composites_present(self):
         if not self.job_dir:
             return False
-        expected_composites = self.z_layers_total * self.channels
-        print('expected denoised composites', expected_composites)
-        actual_composites = len(glob(os.path.join(self.job_dir, 'composite*.tif')))
+        print('expected denoised composites', self.expected_composites)
+        actual_composites = self.denoised_composites_manifest.count
         print('actual denoised composites', actual_composites)
-        return expected_composites == actual_composites
+        return self.expected_composites == actual_composites
 
     def check_all_denoised_composites_same_size(self):
-        files = sorted(glob(os.path.join(self.job_dir, 'composite*.tif')))
-        composite_sizes = [os.path.getsize(x) for x in files]
-        return len(set(composite_sizes)) == 1
+        return self.denoised_composites_manifest.is_uniform
 
     def check_denoising_finished(self):
         all_denoised_composites_present = self.check_all_denoised_composites_present()
@@ -421,99 +420,105 @@ class RSCMDataset(Dataset):
         processing_summary = self.get_processing_summary()
         denoising_summary = processing_summary.get('denoising', {})
         previous_denoised_composites = denoising_summary.get('denoised_composites', 0)
-        denoised_composites = len(glob(os.path.join(self.job_dir, 'composite*.tif')))
+        denoised_composites = self.denoised_composites_manifest.count
         denoising_has_progress = denoised_composites > previous_denoised_composites
         if denoising_has_progress:
             self.update_processing_summary({"denoising": {"denoised_composites": denoised_composites}})
         return denoising_has_progress
 
+    def layer_dir_name(self, z):
+        return f'{self.name.split("_stack")[0]}_layer{str(z).zfill(3) if z < 1000 else str(z)}'
+
     def delete_channel_405(self):
-        color = '405'
+        """
+        Start deleting the 405 channel in the background, processing waits for check_channel_deletion
+        """
+        self.update_processing_summary({'channel_deletion': {'channel': '405', 'state': 'running'}})
+        self.check_channel_deletion()
+
+    def check_channel_deletion(self):
+        """
+        (Re)start the channel deletion if no worker is running it, e.g. after a restart
+        :return: True if there's nothing left to delete
+        """
+        deletion = self.get_processing_summary().get('channel_deletion')
+        if deletion is None or deletion['state'] == 'done':
+            return True
         rootDir = os.path.join(RSCM_FASTSTORE_ACQUISITION_FOLDER, self.pi, self.cl_number, self.name)  # build path like this for safety reasons
         assert len(rootDir) > (len(RSCM_FASTSTORE_ACQUISITION_FOLDER) + 1)  # for safety reasons
-        log.info(f"Removing color 405 in folder {rootDir}")
-        a = sorted(glob(os.path.join(rootDir, '**', color + '*')))
-        log.info("Will remove folders:")
-        log.info("\n".join(list(a)))
-        z = [shutil.rmtree(x) for x in a]
-
-        # update channels number, total and finished ribbons number
-        self.channels -= 1
-        con = sqlite3.connect(DB_LOCATION)
-        cur = con.cursor()
-        res = cur.execute(
-            f'UPDATE dataset SET channels = {self.channels} WHERE id={self.db_id}')
-        con.commit()
-        con.close()
-
-        self.ribbons_total = self.z_layers_total * self.channels * self.ribbons_in_z_layer
-        con = sqlite3.connect(DB_LOCATION)
-        cur = con.cursor()
-        res = cur.execute(
-            f'UPDATE dataset SET ribbons_total = {self.ribbons_total} WHERE id={self.db_id}')
-        con.commit()
-        con.close()
+        layer_names = [self.layer_dir_name(z) for z in range(int(self.z_layers_total))]
+        start_deletion(
+            self.db_id, rootDir, deletion['channel'], layer_names,
+            on_progress=lambda summary: self.update_processing_summary({'channel_deletion': summary}),
+            on_complete=self.finish_channel_deletion
+        )
+        return False
 
-        self.ribbons_finished = self.z_layers_total * self.channels * self.ribbons_in_z_layer
-        con = sqlite3.connect(DB_LOCATION)
+    def finish_channel_deletion(self, summary):
+        """
+        Update channels number, total and finished ribbons number and mark the deletion done in one statement
+        """
+        ribbons_in_z_layer = self.ribbons_in_z_layer
+        con = connect()
         cur = con.cursor()
         res = cur.execute(
-            f'UPDATE dataset SET ribbons_finished = {self.ribbons_finished} WHERE id={self.db_id}')
+            "UPDATE dataset SET channels = channels - 1, "
+            "ribbons_total = z_layers_total * (channels - 1) * ?, ribbons_finished = z_layers_total * (channels - 1) * ?, "
+            "processing_summary = json_set(COALESCE(processing_summary, '{}'), '$.channel_deletion', json(?)) "
+            "WHERE id = ?",
+            (ribbons_in_z_layer, ribbons_in_z_layer, json.dumps(summary), self.db_id)
+        )
         con.commit()
         con.close()
+        self.channels -= 1
+        self.ribbons_total = int(self.z_layers_total) * self.channels * ribbons_in_z_layer
+        self.ribbons_finished = self.ribbons_total
+        wake_stage('check_RSCM_processing')
 
     def check_ims_building_progress(self):
+        """
+        Sample the .ims.part size and estimate when the build finishes.
+        :return: False if the file is missing or stopped growing for much longer than it usually does
+        """
         print("in check_ims_building_progress")
-        processing_summary = self.get_processing_summary()
-        previous_ims_size = processing_summary.get('building_ims', {}).get('ims_size', 0)
+        building_ims = self.get_processing_summary().get('building_ims', {})
         partial_ims_file = self.full_path_to_ims_part_file
         print("partial_ims_file", partial_ims_file)
-        if not os.path.exists(partial_ims_file):
+        try:
+            current_ims_size = os.path.getsize(partial_ims_file)
+        except FileNotFoundError:
             print("Partial ims file doesn't exist")
-            has_progress = False
-            current_ims_size = 0
+            return False
+        if not building_ims.get('predicted_size'):
+            manifest = self.denoised_composites_manifest if self.denoised_composites_manifest.count else self.raw_composites_manifest
+            building_ims['predicted_size'] = predict_ims_size(manifest)
+        building_ims = update_build_progress(building_ims, current_ims_size)
+        print("Imaris file build:", describe_progress(building_ims))
+        if building_ims.get('eta') is not None and not building_ims.get('eta_reported'):
+            building_ims['eta_reported'] = True
+            self.update_processing_summary({'building_ims': building_ims})
+            self.send_message('building_ims')
         else:
-            print("Partial ims file exists")
-            current_ims_size = os.path.getsize(partial_ims_file)
-            has_progress = current_ims_size != previous_ims_size  # the file building could start over
-            print("current_ims_size != previous_ims_size", has_progress)
+            self.update_processing_summary({'building_ims': building_ims})
+        return not building_ims['stalled']
+
+    def check_cbpy_works(self):
+        snapshot = get_cbpy_snapshot()
+        if not len(snapshot.active):
+            return False
+        current_denoised_composites = snapshot.active[0]['denoised']
+        processing_summary = self.get_processing_summary()
+        previous_denoised_composites = processing_summary.get('denoising', {}).get('other_dataset_denoised', 0)
+        has_progress = current_denoised_composites != previous_denoised_composites  # Not just > because other file could have started building
         if has_progress:
-            value_from_db = processing_summary.get('building_ims')
+            value_from_db = processing_summary.get('denoising')
             if value_from_db:
-                value_from_db.update({'ims_size': current_ims_size})
-                self.update_processing_summary({'building_ims': value_from_db})
+                value_from_db.update({'other_dataset_denoised': current_denoised_composites})
+                self.update_processing_summary({'denoising': value_from_db})
             else:
-                self.update_processing_summary({'building_ims': {'ims_size': current_ims_size}})
-        # else:
-        #     has_progress = self.in_imaris_queue and self.check_ims_converter_works()
-        #     print("has_progress", has_progress)
+                self.update_processing_summary({'denoising': {'other_dataset_denoised': current_denoised_composites}})
         return has_progress
 
-    def check_cbpy_works(self):
-        currently_denoising = glob(os.path.join(CBPY_FOLDER, 'active', '*.xml*'))
-        if len(currently_denoising):
-            currently_building = currently_denoising[0]
-        else:
-            return False
-        with open(currently_building, 'r') as f:
-            content = f.read()
-            if len(content):
-                soup = BeautifulSoup(content, "xml")
-                root_dir = soup.find('outFilePathUnix').text
-                processing_summary = self.get_processing_summary()
-                previous_denoised_composites = processing_summary.get('denoising', {}).get('other_dataset_denoised', 0)
-                current_denoised_composites = len(glob(os.path.join(root_dir, "composite*.tif")))
-                has_progress = current_denoised_composites != previous_denoised_composites  # Not just > because other file could have started building
-                if has_progress:
-                    value_from_db = processing_summary.get('denoising')
-                    if value_from_db:
-                        value_from_db.update({'other_dataset_denoised': current_denoised_composites})
-                        self.update_processing_summary({'denoising': value_from_db})
-                    else:
-                        self.update_processing_summary({'denoising': {'other_dataset_denoised': current_denoised_composites}})
-                return has_progress
-        return False
-
     def guess_processing_status(self):
         status = "started"
         if self.check_all_raw_composites_present() and self.check_all_raw_composites_same_size():
@@ -528,7 +533,71 @@ class RSCMDataset(Dataset):
             status = "finished"
         return status
 
-
+    def recovery_markers(self):
+        """
+        Cheap signs of processing activity: queue state of the txt file, mtimes of the composites and job dirs,
+        size and mtime of the imaris files. Only stats, nothing is listed or opened.
+        """
+        def stat_marker(path):
+            try:
+                stat = os.stat(path)
+            except (FileNotFoundError, TypeError):
+                return None
+            return [stat.st_size, stat.st_mtime]
+
+        return {
+            'queue_state': get_queue_index().state_of(self.rscm_txt_file_name),
+            'composites_dir': get_mtime(self.composites_dir),
+            'job_dir': get_mtime(self.job_dir),
+            'ims': stat_marker(self.full_path_to_imaris_file),
+            'ims_part': stat_marker(self.full_path_to_ims_part_file),
+        }
+
+    def recover(self):
+        """
+        Find where processing of a paused dataset is, without guessing from scratch every cycle.
+        processing_summary['recovery'] keeps the last confirmed stage, the evidence for it and the markers
+        seen last time. Later stages are checked again only when a marker changes.
+        :return: (confirmed stage, has_progress)
+        """
+        recovery = self.get_processing_summary().get('recovery') or {'stage': 'started', 'evidence': {}, 'markers': {}}
+        markers = self.recovery_markers()
+        previous_markers = recovery['markers']
+        if markers == previous_markers:
+            print("No changes since", recovery.get('checked'))
+            return recovery['stage'], False
+
+        stage = recovery['stage']
+        confirm_methods = [
+            ('stitched', lambda: self.check_all_raw_composites_present() and self.check_all_raw_composites_same_size(),
+             lambda: {'composites': self.raw_composites_manifest.count}),
+            ('denoised', lambda: self.check_all_denoised_composites_present() and self.check_all_denoised_composites_same_size(),
+             lambda: {'job_dir': self.job_dir, 'composites': self.denoised_composites_manifest.count}),
+            ('finished', self.check_imaris_file_built,
+             lambda: {'ims': self.full_path_to_imaris_file}),
+        ]
+        stages = [name for name, _, _ in confirm_methods]
+        for name, confirm, evidence in confirm_methods[stages.index(stage) + 1 if stage in stages else 0:]:
+            if not confirm():
+                break
+            print("Confirmed stage", name)
+            stage = name
+            recovery['evidence'][name] = dict(evidence(), confirmed=datetime.now().strftime(DATETIME_FORMAT))
+
+        # what changes while the stage after the confirmed one is running
+        activity_markers = {
+            'started': ['queue_state', 'composites_dir'],
+            'stitched': ['job_dir'],
+            'denoised': ['ims_part'],
+            'finished': [],
+        }
+        has_progress = stage != recovery['stage'] or (
+            len(previous_markers) > 0 and
+            any(markers[key] != previous_markers.get(key) for key in activity_markers[stage])
+        )
+        recovery.update({'stage': stage, 'markers': markers, 'checked': datetime.now().strftime(DATETIME_FORMAT)})
+        self.update_processing_summary({'recovery': recovery})
+        return stage, has_progress
 
 
 class Found(BaseException):
@@ -0,0 +1,99 @@
+import logging
+import os
+import re
+
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+COMPOSITES_DIR_NAME = 'composites_RSCM_v0.1'
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except (FileNotFoundError, NotADirectoryError, TypeError):
+        return None
+
+
+def list_job_dirs(composites_dir):
+    try:
+        with os.scandir(composites_dir) as it:
+            return sorted(entry.path for entry in it if entry.name.startswith('job_') and entry.is_dir())
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def other_location(data_location):
+    if data_location == RSCM_FASTSTORE_ACQUISITION_FOLDER:
+        return HIVE_ACQUISITION_FOLDER
+    return RSCM_FASTSTORE_ACQUISITION_FOLDER
+
+
+def resolve_rscm_paths(pi, cl_number, name, job_number):
+    """
+    Find where the stitching outputs of a dataset are. Every location is listed once:
+    composites dir - where composites were built, or the other storage if they're not there;
+    job dir - the last job_* dir in the denoising location, or in the other storage;
+    imaris file (and .ims.part) - in the job dir of the build location if it exists there,
+        otherwise in the other storage.
+    :return: dict of paths, with 'validators': {path: mtime} of every directory the result depends on
+    """
+    validators = {}
+    job_dirs = {}
+
+    def composites_in(data_location):
+        composites_dir = os.path.join(data_location, pi, cl_number, name, COMPOSITES_DIR_NAME)
+        if composites_dir not in job_dirs:
+            validators[composites_dir] = get_mtime(composites_dir)
+            job_dirs[composites_dir] = list_job_dirs(composites_dir) if validators[composites_dir] else []
+        return composites_dir
+
+    location = DATA_LOCATION[WHERE_PROCESSING_HAPPENS['build_composites']]
+    composites_dir = composites_in(location)
+    if validators[composites_dir] is None:
+        composites_dir = composites_in(other_location(location))
+
+    location = DATA_LOCATION[WHERE_PROCESSING_HAPPENS['denoise']]
+    jobs = job_dirs[composites_in(location)] or job_dirs[composites_in(other_location(location))]
+    job_dir = jobs[-1] if len(jobs) else None
+    if job_dir:
+        job_number = re.findall(r"\d+", os.path.basename(job_dir))[-1]
+    imaris_file_name = f"{COMPOSITES_DIR_NAME}_job_{job_number}.ims"
+
+    def job_folder_in(data_location):
+        composites = composites_in(data_location)
+        job_folder = os.path.join(composites, f"job_{job_number}")
+        if job_folder not in job_dirs[composites]:
+            # if folder doesn't exist, try to find other job folders
+            job_folder = job_dirs[composites][-1] if len(job_dirs[composites]) else composites
+        validators[job_folder] = get_mtime(job_folder)
+        return job_folder
+
+    location = DATA_LOCATION[WHERE_PROCESSING_HAPPENS['build_ims']]
+    found = {}
+    for suffix in ('', '.part'):
+        path = os.path.join(job_folder_in(location), imaris_file_name + suffix)
+        if not os.path.exists(path):
+            path = os.path.join(job_folder_in(other_location(location)), imaris_file_name + suffix)
+        found[suffix] = path
+
+    return {
+        'key': [pi, cl_number, name, job_number],
+        'composites_dir': composites_dir,
+        'job_dir': job_dir,
+        'job_number': job_number,
+        'imaris_file': found[''],
+        'ims_part_file': found['.part'],
+        'validators': validators,
+    }
+
+
+def paths_are_valid(paths, pi, cl_number, name, job_number):
+    """
+    Cached paths stay valid while none of the directories they were found in appeared, disappeared
+    or changed (new job dir, moved dataset, .ims.part renamed to .ims ...).
+    """
+    if not paths or paths.get('key') != [pi, cl_number, name, job_number]:
+        return False
+    return all(get_mtime(path) == mtime for path, mtime in paths.get('validators', {}).items())
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_wake_up_event = threading.Event()
+# stage name -> time it should run next
+_stage_next_run = {}
+# dataset key -> (time it should be checked next, current interval)
+_dataset_schedule = {}
+
+
+def due_stages(stages, now=None):
+    """
+    :return: the stages whose time has come, they are rescheduled after their interval
+    """
+    now = now or time.time()
+    due = []
+    with _lock:
+        for stage in stages:
+            if _stage_next_run.get(stage.name, 0) <= now:
+                due.append(stage)
+                _stage_next_run[stage.name] = now + stage.interval
+    return due
+
+
+def wake_stage(name):
+    """Run the stage in the next cycle, e.g. after an event it should react to"""
+    with _lock:
+        _stage_next_run[name] = 0
+    _wake_up_event.set()
+
+
+def wait_for_next_run(stages):
+    """
+    Sleep until the next stage is due or something is woken up.
+    """
+    with _lock:
+        next_run = min((_stage_next_run.get(stage.name, 0) for stage in stages), default=0)
+    delay = min(max(next_run - time.time(), SCHEDULER_MIN_SLEEP), SCHEDULER_MAX_SLEEP)
+    print(f"========================== Waiting {round(delay)} seconds ========================")
+    _wake_up_event.wait(delay)
+    _wake_up_event.clear()
+
+
+def is_due(key, now=None):
+    """
+    :param key: dataset id or path, unique within a stage
+    """
+    now = now or time.time()
+    with _lock:
+        next_run, _ = _dataset_schedule.get(key, (0, None))
+    return next_run <= now
+
+
+def reschedule(key, kind, active, now=None):
+    """
+    Set when the dataset is checked next: soon if it's active,
+    otherwise the interval doubles after every check up to the longest one for its kind.
+    :param kind: key of DATASET_CHECK_INTERVALS, e.g. 'imaging' or 'processing_paused'
+    """
+    now = now or time.time()
+    shortest, longest = DATASET_CHECK_INTERVALS[kind]
+    with _lock:
+        _, interval = _dataset_schedule.get(key, (0, None))
+        if active or interval is None:
+            interval = shortest
+        else:
+            interval = min(interval * 2, longest)
+        _dataset_schedule[key] = (now + interval, interval)
+    return interval
+
+
+def wake_dataset(dataset_id):
+    """
+    Check the dataset in the next run of its stages, starting again from the shortest interval,
+    e.g. after its job ended. Resets the (kind, dataset id) keys of the dataset.
+    """
+    with _lock:
+        for key in [key for key in _dataset_schedule if isinstance(key, tuple) and key[-1] == dataset_id]:
+            del _dataset_schedule[key]
+
+
+def wake_all_datasets():
+    """Check every dataset in the next run of its stage, e.g. to measure a full cycle"""
+    with _lock:
+        _dataset_schedule.clear()
@@ -18,15 +18,52 @@ SLACK_URL = "https://slack.com/api/chat.postMessage"
 load_dotenv()
 SLACK_CHANNEL_ID = os.getenv("SLACK_CHANNEL")
 SLACK_HEADERS = {'content-type': 'application/json', 'Accept-Charset': 'UTF-8', 'Authorization': f'Bearer {os.getenv("SLACK_TOKEN")}'}
+SLACK_TIMEOUT = 10  # seconds
+SLACK_MIN_INTERVAL = 1.1  # seconds between posts, Slack allows about one message per second per channel
+SLACK_MAX_ATTEMPTS = 8
+SLACK_RETRY_BASE_DELAY = 5  # seconds, doubled after every failed attempt
+SLACK_RETRY_MAX_DELAY = 1800
+SLACK_OUTBOX_POLL_INTERVAL = 5
 PROGRESS_TIMEOUT = 600  # seconds
+MANIFEST_SETTLE_TIME = 120  # seconds, composite listings with newer files are not cached
+IMS_PROGRESS_SAMPLES = 30  # .ims.part size samples kept for the build rate
+IMS_PYRAMID_MIN_SIDE = 256  # pixels, Imaris adds resolution levels until the image is this small
+IMS_SIZE_RATIO = 1.0  # final .ims size / uncompressed size of all resolution levels
+IMS_STALL_MIN_TIME = 300  # seconds without .ims.part growth before the build counts as stalled
+IMS_STALL_FACTOR = 5  # ... or this many times the usual interval between growths, whichever is longer
 RSCM_FOLDER_STITCHING = "/CBI_FastStore/clusterStitchTEST"
 RSCM_FOLDER_BUILDING_IMS = "/CBI_FastStore/clusterStitch"
 CBPY_FOLDER = "/CBI_FastStore/clusterPy"
+CBPY_HISTORY_LENGTH = 30  # denoising progress samples kept per active job for the throughput estimate
 # DASK_DASHBOARD = os.getenv("DASK_DASHBOARD")
 CHROME_DRIVER_PATH = '/h20/CBI/Iana/projects/internal/micro_status/chromedriver'
 MAX_ALLOWED_STORAGE_PERCENT = 94
 STORAGE_THRESHOLD_0 = 85
 STORAGE_THRESHOLD_1 = 90
+STORAGE_MOUNTS = {'hive': '/h20', 'faststore': '/CBI_FastStore'}  # storage unit -> mount point checked with statvfs
+STORAGE_STATVFS_TIMEOUT = 10  # seconds, a hung mount doesn't block the check
+STORAGE_SAMPLE_RETENTION = 30 * 24 * 3600  # seconds storage usage samples are kept
+STORAGE_FORECAST_WINDOW = 6 * 3600  # seconds of recent samples the fill rate is computed from
+STORAGE_FORECAST_MIN_SAMPLES = 5
+STORAGE_FORECAST_HORIZON = 12 * 3600  # warn when a threshold is predicted to be reached within this many seconds
+USAGE_ROOTS = {'faststore': FASTSTORE_ACQUISITION_FOLDER}  # storage unit -> directory whose usage is accounted per pi
+USAGE_WORKERS = 16  # directories listed at the same time by the usage accountant
+USAGE_SETTLE_TIME = 600  # seconds, directories modified shortly before they were listed are listed again
+USAGE_TOP_CONSUMERS = 5  # pis named in storage warnings
+TRASH_LOCATIONS = {'faststore': FASTSTORE_TRASH_LOCATION, 'hive': HIVE_TRASH_LOCATION}
+TRASH_WORKERS = 8  # files moved to / deleted from the trash at the same time
+TRASH_RETENTION = 14 * 24 * 3600  # seconds things stay in the trash
+TRASH_MIN_AGE = 24 * 3600  # seconds things stay in the trash even when the storage is filling up
+TRASH_PURGE_PERCENT = STORAGE_THRESHOLD_0  # younger trash is purged while the storage is fuller than this
+CHANNEL_DELETE_WORKERS = 8  # layers whose channel directory is deleted at the same time
+CHANNEL_DELETE_PROGRESS_INTERVAL = 30  # seconds between progress updates of a channel deletion
+VOLUME_RATIOS = {  # size of each stage output / raw size, until enough finished datasets are there to learn it
+    'composites': 1.0,
+    'denoised': 1.0,
+    'ims': 1.4,
+    'tile_ims': 1.4,
+}
+VOLUME_CALIBRATION_MIN = 3  # finished datasets needed before the ratios are learned from them
 CHECKING_TIFFS_ENABLED = True
 MESSAGES_ENABLED = True
 # MESSAGES_ENABLED = False
@@ -44,7 +81,73 @@ DATETIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
 PEACE_JSON_FOLDER = "/h20/CBI/Iana/json"
 BRAIN_DATA_PRODUCERS = ["klimstra", "cebra", "dutta", "dermody"]
 
-dask_json = json.load(open("/CBI_FastStore/cbiPythonTools/RSCM/RSCM/dask_scheduler_info.json", "r"))
-DASK_DASHBOARD = dask_json['address'].replace("tcp", "http")[:-4] + '8787/'
+DASK_SCHEDULER_INFO = "/CBI_FastStore/cbiPythonTools/RSCM/RSCM/dask_scheduler_info.json"
+try:
+    dask_json = json.load(open(DASK_SCHEDULER_INFO, "r"))
+    DASK_DASHBOARD = dask_json['address'].replace("tcp", "http")[:-4] + '8787/'
+except FileNotFoundError:  # not on the cluster (e.g. benchmarks), the dashboard shows up as not available
+    DASK_DASHBOARD = 'http://127.0.0.1:8787/'
+DASK_HTTP_TIMEOUT = 10  # seconds
+DASK_HTTP_WORKERS = 16  # worker pages fetched concurrently
 RESTRICT_MOVING_TIME = True
 MOVE_TIMES = {'start': 19, 'stop': 4}
+TRANSFER_BANDWIDTH = 400  # MB/s FastStore -> Hive, used to decide how many datasets fit in a moving window
+TRANSFER_STITCHING_SHARE = 0.5  # part of the bandwidth left for moving while stitching is running
+TRANSFER_CRITICAL_WINDOW = 2 * 3600  # seconds of moving released during the day when FastStore is critically full
+TRANSFER_AGE_WEIGHT = 1  # priority per day since the dataset was created
+TRANSFER_SIZE_WEIGHT = 1  # priority per TB, towards smaller datasets or, when FastStore fills up, bigger ones
+MOVE_METHOD = 'listener'  # 'listener': move.txt file for the RSCM listener, 'native': micro_status.copy_engine job
+COPY_WORKERS = 8  # files copied at the same time by a native move
+MANIFEST_FOLDER = "/CBI_FastStore/Iana/manifests"  # file lists of datasets saved before moving, to verify the copy on Hive
+MANIFEST_WORKERS = 16  # directories listed / files hashed at the same time when verifying a move
+MOVE_VERIFY_HASH = False  # compare file contents too, not only sizes and mtimes (reads the whole dataset twice)
+HASH_DURING_ACQUISITION = True  # hash RSCM ribbons while imaging with MOVE_VERIFY_HASH, the manifest is reused when moving
+HASH_WORKERS = 2  # files hashed at the same time
+HASH_IO_BUDGET = 200  # MB/s read by the hashing during acquisition, all datasets together
+HASH_SETTLE_TIME = 60  # seconds since a ribbon was last modified before it's hashed
+HASH_QUEUE_LIMIT = 1000  # ribbons waiting to be hashed, the rest are picked up in later checks
+MOVE_VERIFY_MTIME = {  # per MOVE_METHOD, modification times have to match too
+    'native': True,  # the copy engine keeps them (copystat)
+    'listener': False,  # not known whether the RSCM listener keeps them, sizes (and hashes) only
+}
+MOVE_VERIFY_RETRY = 3600  # seconds before verifying a move that didn't match again
+JOB_LOG_FOLDER = "/CBI_FastStore/Iana/job_logs"
+JOB_CONCURRENCY = {  # how many commands of each kind can run at the same time
+    'build_ims': 1,
+    'mesospim_convert': 2,
+    'move_dataset': 2
+}
+JOB_START_GRACE = 60  # seconds a claimed job can go without a pid (being started by another worker) before it's lost
+JOB_RETRIES = {  # how many times a command that ended without its output is launched again before giving up
+    'build_ims': 2,
+    'mesospim_convert': 2,
+    'move_dataset': 2,
+}
+STAGE_WORKERS = 8  # scan stages running at the same time
+STAGE_TIMEOUT = 1800  # seconds a scan cycle waits for a stage
+STAGE_TIMEOUTS = {
+    'check_storage': 120,
+    'move_files': 300,
+    'account_usage': 4 * 3600,  # the first walk of FastStore lists everything
+    'purge_trash': 3600,
+}
+DATASET_WORKERS = 8  # datasets checked at the same time within a stage
+STAGE_INTERVAL = 60  # seconds between runs of a stage
+STAGE_INTERVALS = {
+    'check_storage': 300,
+    'account_usage': 3600,
+    'update_reservations': 900,
+    'purge_trash': 1800,
+    'check_mesoSPIM_processing': 120,
+    'check_moving': 120,
+}
+DATASET_CHECK_INTERVALS = {  # seconds (shortest, longest), doubled after every check without progress
+    'imaging': (60, 180),  # has to notice a pause within PROGRESS_TIMEOUT
+    'imaging_paused': (60, 900),
+    'processing_paused': (60, 1800),
+    'finished': (300, 3600),
+}
+SCHEDULER_MIN_SLEEP = 5  # seconds between scan cycles
+SCHEDULER_MAX_SLEEP = 60
+LEASE_TTL = 180  # seconds, work of a worker that stopped renewing its leases goes to the others after this
+DB_TIMEOUT = 60  # seconds to wait for a locked database, stages, datasets, the outbox and leases write concurrently
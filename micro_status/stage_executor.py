@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+# stage name -> future, kept across cycles so a stage that timed out isn't started twice
+_running = {}
+
+
+class Stage:
+    """
+    One step of a scan cycle.
+    after: names of the stages that have to finish (or fail, or time out) before this one starts
+    interval: seconds between runs
+    sharded: every worker runs the stage for its own share of datasets, otherwise one worker runs it
+    """
+    def __init__(self, func, after=None, timeout=None, interval=None, sharded=False, name=None):
+        self.func = func
+        self.sharded = sharded
+        self.name = name or func.__name__
+        self.after = after or []
+        self.timeout = timeout or STAGE_TIMEOUTS.get(self.name, STAGE_TIMEOUT)
+        self.interval = interval or STAGE_INTERVALS.get(self.name, STAGE_INTERVAL)
+
+    def __str__(self):
+        return f"Stage({self.name})"
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix='stage')
+        return _executor
+
+
+def format_exception(e):
+    return "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+
+def run_stages(stages):
+    """
+    Run the stages on a thread pool, each one as soon as the stages it comes after are done.
+    An exception or a timeout is logged and only affects its own stage. A stage that timed out keeps running
+    in the background (threads can't be killed) and is skipped until it returns.
+    :return: stage name -> 'ok', 'failed', 'timeout' or 'still_running'
+    """
+    executor = get_executor()
+    names = set(stage.name for stage in stages)
+    pending = list(stages)
+    results = {}
+    futures = {}
+    deadlines = {}
+    started = {}
+    while pending or futures:
+        for stage in list(pending):
+            if not all(name in results for name in stage.after if name in names):
+                continue
+            pending.remove(stage)
+            previous = _running.get(stage.name)
+            if previous is not None and not previous.done():
+                log.error(f"{stage} from an earlier cycle is still running, skipping it")
+                results[stage.name] = 'still_running'
+                continue
+            started[stage.name] = time.time()
+            deadlines[stage.name] = started[stage.name] + stage.timeout
+            futures[stage.name] = _running[stage.name] = executor.submit(stage.func)
+        if not futures:
+            if pending:
+                raise ValueError(f"Stages can't be ordered: {[stage.name for stage in pending]}")
+            break
+
+        wait(futures.values(), timeout=max(min(deadlines[name] for name in futures) - time.time(), 0),
+             return_when=FIRST_COMPLETED)
+        for name, future in list(futures.items()):
+            if future.done():
+                e = future.exception()
+                if e is not None:
+                    log.error(f"\nEXCEPTION in {name}: {e}\n")
+                    print(format_exception(e))
+                    results[name] = 'failed'
+                else:
+                    results[name] = 'ok'
+            elif time.time() >= deadlines[name]:
+                log.error(f"{name} didn't finish in {round(time.time() - started[name])} seconds")
+                results[name] = 'timeout'
+            else:
+                continue
+            del futures[name]
+            print(f"Stage {name}: {results[name]} in {time.time() - started[name]:.1f} s")
+    return results
+
+
+def for_each(items, func, workers=None):
+    """
+    Call func(item) for every item on a thread pool. An exception only skips its own item.
+    :return: number of items that failed
+    """
+    items = list(items)
+    if not items:
+        return 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=min(workers or DATASET_WORKERS, len(items)), thread_name_prefix='dataset') as pool:
+        futures = {pool.submit(func, item): item for item in items}
+        for future, item in futures.items():
+            e = future.exception()
+            if e is not None:
+                failed += 1
+                log.error(f"\nEXCEPTION processing {item}: {e}\n")
+                print(format_exception(e))
+    return failed
@@ -0,0 +1,164 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .db import connect
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# mount -> thread of the last statvfs call
+_pending = {}
+
+
+def record_usage(unit, used_percent, size_bytes=None, used_bytes=None, available_bytes=None):
+    """
+    Store a storage usage sample of "hive" or "faststore".
+    """
+    con = connect()
+    cur = con.cursor()
+    cur.execute(
+        'INSERT INTO storage_sample(unit, taken, used_percent, size_bytes, used_bytes, available_bytes) '
+        'VALUES(?, ?, ?, ?, ?, ?)',
+        (unit, time.time(), used_percent, size_bytes, used_bytes, available_bytes)
+    )
+    con.commit()
+    con.close()
+
+
+def latest_usage(unit):
+    """
+    :return: the last sample of the storage unit as a dict, None if there's none
+    """
+    con = connect()
+    con.row_factory = sqlite3.Row
+    cur = con.cursor()
+    record = cur.execute(
+        'SELECT * FROM storage_sample WHERE unit = ? ORDER BY taken DESC LIMIT 1', (unit,)
+    ).fetchone()
+    con.close()
+    return dict(record) if record else None
+
+
+def statvfs_usage(path):
+    """
+    Byte-exact usage of the filesystem, computed the way df does (reserved blocks don't count as available)
+    """
+    stat = os.statvfs(path)
+    size_bytes = stat.f_blocks * stat.f_frsize
+    used_bytes = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+    available_bytes = stat.f_bavail * stat.f_frsize
+    used_percent = 100 * used_bytes / (used_bytes + available_bytes) if used_bytes + available_bytes else 0
+    return {
+        'used_percent': used_percent,
+        'size_bytes': size_bytes,
+        'used_bytes': used_bytes,
+        'available_bytes': available_bytes,
+    }
+
+
+def usage_with_timeout(path, timeout):
+    """
+    statvfs on a hung network filesystem blocks forever, so it runs in a thread that's given up on after timeout.
+    While a call for the mount is still hanging no new one is started.
+    :return: usage dict, None if it didn't return in time or failed
+    """
+    with _lock:
+        thread = _pending.get(path)
+        if thread is not None and thread.is_alive():
+            log.error(f"statvfs of {path} from an earlier check still hasn't returned")
+            return None
+        result = {}
+
+        def run():
+            try:
+                result['usage'] = statvfs_usage(path)
+            except OSError as e:
+                log.error(f"statvfs of {path} failed: {e}")
+
+        thread = threading.Thread(target=run, name=f"statvfs {path}", daemon=True)
+        _pending[path] = thread
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        log.error(f"statvfs of {path} didn't return in {timeout} seconds")
+        return None
+    return result.get('usage')
+
+
+def sample_mounts():
+    """
+    Record a usage sample of every storage unit in STORAGE_MOUNTS.
+    :return: unit -> usage dict, units that couldn't be checked are left out
+    """
+    samples = {}
+    for unit, mount in STORAGE_MOUNTS.items():
+        usage = usage_with_timeout(mount, STORAGE_STATVFS_TIMEOUT)
+        if usage is None:
+            continue
+        record_usage(unit, **usage)
+        samples[unit] = usage
+    prune_samples()
+    return samples
+
+
+def prune_samples():
+    con = connect()
+    cur = con.cursor()
+    cur.execute('DELETE FROM storage_sample WHERE taken < ?', (time.time() - STORAGE_SAMPLE_RETENTION,))
+    con.commit()
+    con.close()
+
+
+def recent_samples(unit, window):
+    con = connect()
+    con.row_factory = sqlite3.Row
+    cur = con.cursor()
+    records = cur.execute(
+        'SELECT * FROM storage_sample WHERE unit = ? AND taken >= ? ORDER BY taken', (unit, time.time() - window)
+    ).fetchall()
+    con.close()
+    return [dict(record) for record in records]
+
+
+def fill_rate(samples):
+    """
+    Least squares slope of used bytes over time, so one noisy sample doesn't swing the forecast.
+    :return: bytes per second (negative while the storage is being freed), None without enough samples
+    """
+    samples = [sample for sample in samples if sample.get('used_bytes') is not None]
+    if len(samples) < STORAGE_FORECAST_MIN_SAMPLES or samples[-1]['taken'] - samples[0]['taken'] <= 0:
+        return None
+    n = len(samples)
+    mean_t = sum(sample['taken'] for sample in samples) / n
+    mean_used = sum(sample['used_bytes'] for sample in samples) / n
+    covariance = sum((sample['taken'] - mean_t) * (sample['used_bytes'] - mean_used) for sample in samples)
+    variance = sum((sample['taken'] - mean_t) ** 2 for sample in samples)
+    return covariance / variance
+
+
+def time_to_threshold(usage, rate, percent):
+    """
+    :return: seconds until used_percent reaches percent at the fill rate, 0 if it already has,
+        None if it isn't filling up
+    """
+    if usage['used_percent'] >= percent:
+        return 0
+    if not rate or rate <= 0:
+        return None
+    capacity = usage['used_bytes'] + usage['available_bytes']
+    return (capacity * percent / 100 - usage['used_bytes']) / rate
+
+
+def forecast(unit, usage):
+    """
+    :return: {'rate': bytes per second, threshold percent: seconds until it's reached or None}
+    """
+    rate = fill_rate(recent_samples(unit, STORAGE_FORECAST_WINDOW))
+    result = {'rate': rate}
+    for percent in (STORAGE_THRESHOLD_1, MAX_ALLOWED_STORAGE_PERCENT):
+        result[percent] = time_to_threshold(usage, rate, percent)
+    return result
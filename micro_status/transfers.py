@@ -0,0 +1,222 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .dataset import Dataset
+from .db import connect
+from .job_launcher import Job
+from .settings import *
+from .storage import latest_usage
+from .usage_accountant import dataset_usage
+from .utils import move_window_remaining
+
+log = logging.getLogger(__name__)
+
+MOVE_SUFFIX = 'move.txt'
+JOB_PREFIX = 'job:'  # MoveJob names of native moves, the rest are move file names
+
+# datasets the usage accountant hasn't seen yet are measured here, outside the move_files stage
+_size_walker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='transfer-size')
+_measuring = set()
+_measuring_lock = threading.Lock()
+
+
+def tree_size(path):
+    """Bytes in all files under path"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        continue
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+    return total
+
+
+def measure_in_background(dataset):
+    """Walk the dataset in a background thread and store its size in processing_summary['transfer']"""
+    with _measuring_lock:
+        if dataset.db_id in _measuring:
+            return
+        _measuring.add(dataset.db_id)
+
+    def measure():
+        try:
+            size = tree_size(dataset.path_on_fast_store)
+            transfer = dataset.get_processing_summary().get('transfer', {})
+            dataset.update_processing_summary({'transfer': dict(transfer, size=size)})
+            log.info(f"{dataset} is {size / 2 ** 30:.0f} GB")
+        except Exception as e:
+            log.error(f"Measuring {dataset} failed: {e}")
+        finally:
+            with _measuring_lock:
+                _measuring.discard(dataset.db_id)
+
+    _size_walker.submit(measure)
+
+
+class MoveJob:
+    """
+    A dataset waiting in the moving queue (tempQueue / queueStitch) or being moved (processing).
+    """
+    def __init__(self, file_name, state, dataset=None, size=0, age_days=0, size_known=True):
+        self.file_name = file_name
+        self.state = state
+        self.dataset = dataset
+        self.size = size
+        self.size_known = size_known
+        self.age_days = age_days
+        self.priority = 0
+
+    def __str__(self):
+        size = f"{self.size / 2 ** 30:.0f} GB" if self.size_known else "size unknown"
+        return f"MoveJob({self.file_name}, {self.state}, {size}, priority {self.priority:.2f})"
+
+    @classmethod
+    def from_queue_file(cls, file_name, state):
+        """file name: {dataset_id}_{pi_name}_{cl_number}_{dataset_name}_move.txt"""
+        try:
+            dataset_id = int(file_name.split('_')[0])
+        except ValueError:
+            log.error(f"Can't tell the dataset of {file_name}")
+            return cls(file_name, state)
+        return cls.for_dataset(file_name, state, dataset_id)
+
+    @classmethod
+    def from_launcher_job(cls, launcher_job):
+        """Native move (move_dataset job), queued jobs wait like files in tempQueue"""
+        state = 'processing' if launcher_job.status == 'running' else 'tempQueue'
+        return cls.for_dataset(f"{JOB_PREFIX}{launcher_job.db_id}", state, launcher_job.dataset_id)
+
+    @classmethod
+    def for_dataset(cls, file_name, state, dataset_id):
+        job = cls(file_name, state)
+        con = connect()
+        cur = con.cursor()
+        record = cur.execute(f'SELECT * FROM dataset WHERE id={dataset_id}').fetchone()
+        con.close()
+        if not record:
+            return job
+        job.dataset = Dataset.initialize_from_db(record)
+        size = job.dataset_size()
+        job.size = size or 0
+        job.size_known = size is not None
+        job.age_days = (datetime.now() - job.dataset.created).total_seconds() / 86400
+        return job
+
+    def dataset_size(self):
+        """
+        From the usage accountant, or measured once in the background if it hasn't seen the dataset yet
+        (datasets don't grow after they're queued for moving). Never walked here: move_files has a short timeout.
+        :return: bytes, None until known
+        """
+        size = self.dataset.get_processing_summary().get('transfer', {}).get('size')
+        if size is None:
+            size = dataset_usage('faststore', self.dataset.path_on_fast_store)
+        if size is None:
+            measure_in_background(self.dataset)
+        return size
+
+
+def pressure(usage):
+    """0 below STORAGE_THRESHOLD_0, growing to 1 when the storage is full"""
+    if not usage or usage.get('used_percent') is None:
+        return 0
+    return min(max(usage['used_percent'] - STORAGE_THRESHOLD_0, 0) / (100 - STORAGE_THRESHOLD_0), 1)
+
+
+def prioritize(jobs, faststore_usage):
+    """
+    Older datasets go first. While FastStore has room smaller datasets are preferred (quick, less contention),
+    as it fills up bigger ones are (they free the most space).
+    """
+    faststore_pressure = pressure(faststore_usage)
+    for job in jobs:
+        size_tb = job.size / 2 ** 40
+        job.priority = (
+            TRANSFER_AGE_WEIGHT * job.age_days
+            + TRANSFER_SIZE_WEIGHT * size_tb * (2 * faststore_pressure - 1)
+        )
+    return sorted(jobs, key=lambda job: job.priority, reverse=True)
+
+
+def plan_transfers(jobs, window_seconds, faststore_usage=None, hive_usage=None, stitching_active=False):
+    """
+    Pick the queued move jobs to release, by priority, while they fit in the bandwidth budget of the window
+    and in the free space on Hive. Jobs being moved already use up their part of both.
+    :param jobs: MoveJob list
+    :param window_seconds: time left to move data
+    :return: file names of the jobs that should be in queueStitch, the rest waits in tempQueue
+    """
+    if window_seconds <= 0:
+        return []
+    if hive_usage and hive_usage.get('used_percent', 0) >= MAX_ALLOWED_STORAGE_PERCENT:
+        log.error("Hive is full, not moving anything")
+        return []
+    bandwidth = TRANSFER_BANDWIDTH * 2 ** 20 * (TRANSFER_STITCHING_SHARE if stitching_active else 1)
+    budget = bandwidth * window_seconds
+    hive_room = None
+    if hive_usage and hive_usage.get('available_bytes') is not None:
+        # keep Hive below the critical level
+        hive_room = hive_usage['available_bytes'] - hive_usage['size_bytes'] * (100 - MAX_ALLOWED_STORAGE_PERCENT) / 100
+
+    in_flight = [job for job in jobs if job.state == 'processing']
+    for job in in_flight:
+        budget -= job.size
+        if hive_room is not None:
+            hive_room -= job.size
+
+    release = []
+    for job in prioritize([job for job in jobs if job.state != 'processing'], faststore_usage):
+        if not job.size_known:
+            print(f"Holding {job} until its size is known")
+            continue
+        fits_budget = job.size <= budget or (not in_flight and not release)  # a big dataset still has to go some time
+        fits_hive = hive_room is None or job.size <= hive_room
+        if not (fits_budget and fits_hive):
+            print(f"Holding {job}: budget {budget / 2 ** 30:.0f} GB, fits on Hive: {fits_hive}")
+            continue
+        release.append(job.file_name)
+        budget -= job.size
+        if hive_room is not None:
+            hive_room -= job.size
+    return release
+
+
+def schedule_moves(queue_index, stitching_active=False):
+    """
+    :return: names of the move files that should be in queueStitch now
+        and JOB_PREFIX + id of the move_dataset jobs that should be running
+    """
+    jobs = [
+        MoveJob.from_queue_file(file_name, state)
+        for state in ('processing', 'queueStitch', 'tempQueue')
+        for file_name in queue_index.files_in(state, MOVE_SUFFIX)
+    ]
+    jobs += [
+        MoveJob.from_launcher_job(launcher_job)
+        for status in ('running', 'queued')
+        for launcher_job in Job.get_by_status(status, 'move_dataset')
+    ]
+    if not jobs:
+        return []
+    faststore_usage = latest_usage('faststore')
+    hive_usage = latest_usage('hive')
+    window_seconds = move_window_remaining()
+    if not window_seconds and faststore_usage and faststore_usage['used_percent'] >= MAX_ALLOWED_STORAGE_PERCENT:
+        log.info("FastStore is critically full, moving during the day")
+        window_seconds = TRANSFER_CRITICAL_WINDOW
+    release = plan_transfers(jobs, window_seconds, faststore_usage, hive_usage, stitching_active)
+    for job in jobs:
+        print(job, "released" if job.file_name in release else "")
+    return release
@@ -0,0 +1,273 @@
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .copy_engine import copy_file_data
+from .db import connect
+from .manifest import list_tree
+from .settings import *
+from .storage import usage_with_timeout
+
+log = logging.getLogger(__name__)
+
+# directories renamed into the trash are listed here afterwards, renaming doesn't need their size
+_size_walker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trash-size')
+
+
+def trash_location(path):
+    """
+    The trash on the same filesystem as path if there's one (moving there is a rename),
+    otherwise the one of the storage unit path is on by its mount point
+    :return: (storage unit, trash directory)
+    """
+    device = os.stat(path).st_dev
+    for unit, location in TRASH_LOCATIONS.items():
+        try:
+            if os.stat(location).st_dev == device:
+                return unit, location
+        except FileNotFoundError:
+            continue
+    for unit, mount in STORAGE_MOUNTS.items():
+        if path.startswith(mount) and unit in TRASH_LOCATIONS:
+            return unit, TRASH_LOCATIONS[unit]
+    return 'faststore', TRASH_LOCATIONS['faststore']
+
+
+def tree_size(path):
+    """
+    :return: (bytes, files) of a file or everything under a directory
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path), 1
+    _, files = list_tree(path, TRASH_WORKERS)
+    return sum(size for size, _ in files.values()), len(files)
+
+
+def move_file(src, dst):
+    """
+    Copy and delete, for a file going to another filesystem
+    :return: bytes moved
+    """
+    size = os.path.getsize(src)
+    copy_file_data(src, dst, size)
+    shutil.copystat(src, dst)
+    os.remove(src)
+    return size
+
+
+def move_tree(src, dst):
+    """
+    Move a directory to another filesystem with TRASH_WORKERS files at the same time, symlinks are recreated
+    :return: (bytes, files) moved, from the listing made for moving
+    """
+    others = []
+    dirs, files = list_tree(src, TRASH_WORKERS, others=others)
+    special = [path for path in others if not os.path.islink(os.path.join(src, path))]
+    if special:
+        raise OSError(f"Can't move special files to another filesystem: {', '.join(sorted(special)[:5])}")
+    os.makedirs(dst, exist_ok=True)
+    for relative_dir in sorted(dirs):
+        os.makedirs(os.path.join(dst, relative_dir), exist_ok=True)
+    for relative_path in others:  # symlinks
+        os.symlink(os.readlink(os.path.join(src, relative_path)), os.path.join(dst, relative_path))
+    with ThreadPoolExecutor(max_workers=TRASH_WORKERS, thread_name_prefix='trash') as pool:
+        list(pool.map(lambda path: move_file(os.path.join(src, path), os.path.join(dst, path)), files))
+    shutil.rmtree(src)
+    return sum(size for size, _ in files.values()), len(files)
+
+
+def move_to_trash(dataset, kind, paths):
+    """
+    Move files or whole directories of a dataset to {trash}/{pi}/{cl_number}/{name}/{kind}_{time}
+    and record the entry. On the same filesystem everything is renamed (a directory at once, its size is recorded
+    when it's been listed in the background), otherwise moved with TRASH_WORKERS files at the same time.
+    :param paths: files or directories, all on one storage unit
+    :return: trash entry path, None if there was nothing to move
+    """
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return None
+    unit, location = trash_location(paths[0])
+    trash_path = os.path.join(location, dataset.pi, dataset.cl_number, dataset.name,
+                              f"{kind}_{datetime.now().strftime(DATETIME_FORMAT)}")
+    os.makedirs(trash_path, exist_ok=True)
+    same_filesystem = os.stat(paths[0]).st_dev == os.stat(trash_path).st_dev
+    started = time.time()
+
+    def move(path):
+        """:return: (bytes, files) moved, None for a renamed directory"""
+        destination = os.path.join(trash_path, os.path.basename(path.rstrip(os.sep)))
+        if os.path.isdir(path):
+            if same_filesystem:
+                os.rename(path, destination)
+                return None
+            return move_tree(path, destination)
+        if same_filesystem:
+            size = os.path.getsize(path)
+            os.rename(path, destination)
+            return size, 1
+        return move_file(path, destination), 1
+
+    with ThreadPoolExecutor(max_workers=TRASH_WORKERS, thread_name_prefix='trash') as pool:
+        sizes = list(pool.map(move, paths))
+
+    size = sum(size for size, _ in filter(None, sizes))
+    files = sum(files for _, files in filter(None, sizes))
+    entry_id = record_entry(dataset.db_id, kind, unit, trash_path, size, files, time.time())
+    log.info(f"Moved {len(paths)} paths of {dataset} to {trash_path} in {time.time() - started:.1f} s"
+             f"{'' if same_filesystem else ', across filesystems'}")
+    if None in sizes:
+        _size_walker.submit(measure_entry, entry_id, trash_path)
+    else:
+        log.info(f"{trash_path}: {files} files, {size / 2 ** 30:.1f} GB")
+    return trash_path
+
+
+def measure_entry(entry_id, path):
+    """
+    List a trash entry that was renamed into the trash and record its size
+    """
+    try:
+        size, files = tree_size(path)
+    except Exception as e:  # e.g. purged in the meantime, the entry keeps the size known when it was moved
+        log.error(f"Could not measure {path}: {e}")
+        return
+    con = connect()
+    cur = con.cursor()
+    cur.execute('UPDATE trash_entry SET bytes = ?, files = ? WHERE id = ?', (size, files, entry_id))
+    con.commit()
+    con.close()
+    log.info(f"{path}: {files} files, {size / 2 ** 30:.1f} GB")
+
+
+def record_entry(dataset_id, kind, unit, path, size, files, trashed):
+    con = connect()
+    cur = con.cursor()
+    cur.execute(
+        'INSERT INTO trash_entry(dataset_id, kind, unit, path, bytes, files, trashed) VALUES(?, ?, ?, ?, ?, ?, ?)',
+        (dataset_id, kind, unit, path, size, files, trashed)
+    )
+    entry_id = cur.lastrowid
+    con.commit()
+    con.close()
+    return entry_id
+
+
+def glob_depth(root, depth):
+    """
+    :return: directories depth levels under root
+    """
+    paths = [root]
+    for _ in range(depth):
+        children = []
+        for path in paths:
+            try:
+                with os.scandir(path) as it:
+                    children.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        paths = children
+    return paths
+
+
+def register_untracked(unit, location):
+    """
+    Record what was put in the trash before entries were recorded ({pi}/{cl_number}/{name}/{kind}),
+    as trashed when it was last modified
+    """
+    con = connect()
+    cur = con.cursor()
+    known = set(path for path, in cur.execute('SELECT path FROM trash_entry WHERE unit = ?', (unit,)).fetchall())
+    con.close()
+    # not modified for a while, so not an entry being moved right now
+    untracked = [
+        path for path in sorted(glob_depth(location, 4))
+        if path not in known and time.time() - os.stat(path).st_mtime > TRASH_MIN_AGE
+    ]
+    for path in untracked:
+        size, files = tree_size(path)
+        record_entry(None, os.path.basename(path), unit, path, size, files, os.stat(path).st_mtime)
+        log.info(f"Found untracked trash {path}: {size / 2 ** 30:.1f} GB")
+    return len(untracked)
+
+
+def delete_tree(path):
+    """
+    Delete the files with TRASH_WORKERS at the same time (a network filesystem mostly waits), then the directories
+    """
+    if not os.path.isdir(path):
+        os.remove(path)
+        return
+    others = []
+    dirs, files = list_tree(path, TRASH_WORKERS, others=others)
+    with ThreadPoolExecutor(max_workers=TRASH_WORKERS, thread_name_prefix='purge') as pool:
+        list(pool.map(lambda relative_path: os.remove(os.path.join(path, relative_path)), list(files) + others))
+    for relative_dir in sorted(dirs, key=lambda d: d.count(os.sep), reverse=True):
+        os.rmdir(os.path.join(path, relative_dir))
+    os.rmdir(path)
+
+
+def remove_empty_parents(path, root):
+    parent = os.path.dirname(path)
+    while parent.startswith(root.rstrip(os.sep) + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:  # not empty
+            return
+        parent = os.path.dirname(parent)
+
+
+def purge_entry(entry_id, path, location):
+    try:
+        delete_tree(path)
+    except FileNotFoundError:  # deleted by hand
+        pass
+    remove_empty_parents(path, location)
+    con = connect()
+    cur = con.cursor()
+    cur.execute('UPDATE trash_entry SET purged = ? WHERE id = ?', (time.time(), entry_id))
+    con.commit()
+    con.close()
+
+
+def purge(unit, location):
+    """
+    Delete the trash entries older than TRASH_RETENTION. While the storage unit is over TRASH_PURGE_PERCENT
+    also the younger ones, oldest first, as long as they're older than TRASH_MIN_AGE.
+    :return: bytes reclaimed
+    """
+    con = connect()
+    cur = con.cursor()
+    entries = cur.execute(
+        'SELECT id, path, bytes, trashed FROM trash_entry WHERE unit = ? AND purged IS NULL ORDER BY trashed',
+        (unit,)
+    ).fetchall()
+    con.close()
+    now = time.time()
+    to_free = 0
+    usage = usage_with_timeout(STORAGE_MOUNTS[unit], STORAGE_STATVFS_TIMEOUT) if unit in STORAGE_MOUNTS else None
+    if usage is not None:
+        total = usage['used_bytes'] + usage['available_bytes']
+        to_free = max(usage['used_bytes'] - total * TRASH_PURGE_PERCENT / 100, 0)
+
+    reclaimed = 0
+    for entry_id, path, size, trashed in entries:
+        age = now - trashed
+        if age > TRASH_RETENTION:
+            reason = 'retention'
+        elif reclaimed < to_free and age > TRASH_MIN_AGE:
+            reason = 'storage pressure'
+        else:
+            continue
+        started = time.time()
+        purge_entry(entry_id, path, location)
+        reclaimed += size
+        log.info(f"Purged {path} ({reason}, {age / 86400:.1f} days in trash): "
+                 f"{size / 2 ** 30:.1f} GB in {time.time() - started:.1f} s")
+    if reclaimed < to_free:
+        log.warning(f"{unit} trash could only free {reclaimed / 2 ** 40:.2f} TB "
+                    f"of the {to_free / 2 ** 40:.2f} TB over {TRASH_PURGE_PERCENT}%")
+    return reclaimed
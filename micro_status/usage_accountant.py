@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .db import connect
+from .settings import *
+
+log = logging.getLogger(__name__)
+
+
+class DirUsage:
+    """
+    Files directly in one directory (not in its subdirectories), cached until the directory mtime changes.
+    A directory mtime only changes when entries are added, removed or renamed, so directories modified
+    shortly before they were scanned (files may still be growing) are scanned again.
+    """
+    def __init__(self, mtime, file_bytes, file_count, subdirs, scanned):
+        self.mtime = mtime
+        self.file_bytes = file_bytes
+        self.file_count = file_count
+        self.subdirs = subdirs
+        self.scanned = scanned
+
+    def is_valid(self, mtime):
+        return self.mtime == mtime and self.scanned - self.mtime > USAGE_SETTLE_TIME
+
+    @classmethod
+    def scan(cls, path, mtime):
+        scanned = time.time()
+        file_bytes = 0
+        file_count = 0
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        file_bytes += entry.stat(follow_symlinks=False).st_size
+                        file_count += 1
+                except FileNotFoundError:  # deleted while listing
+                    continue
+        return cls(mtime, file_bytes, file_count, subdirs, scanned)
+
+
+def load_cache(root):
+    con = connect()
+    cur = con.cursor()
+    records = cur.execute(
+        'SELECT path, mtime, file_bytes, file_count, subdirs, scanned FROM dir_usage WHERE path = ? OR path LIKE ?',
+        (root, os.path.join(root, '%'))
+    ).fetchall()
+    con.close()
+    return {
+        path: DirUsage(mtime, file_bytes, file_count, json.loads(subdirs), scanned)
+        for path, mtime, file_bytes, file_count, subdirs, scanned in records
+    }
+
+
+def save_cache(changed, removed):
+    con = connect()
+    cur = con.cursor()
+    cur.executemany(
+        'INSERT OR REPLACE INTO dir_usage(path, mtime, file_bytes, file_count, subdirs, scanned) VALUES(?, ?, ?, ?, ?, ?)',
+        [
+            (path, usage.mtime, usage.file_bytes, usage.file_count, json.dumps(usage.subdirs), usage.scanned)
+            for path, usage in changed.items()
+        ]
+    )
+    cur.executemany('DELETE FROM dir_usage WHERE path = ?', [(path,) for path in removed])
+    con.commit()
+    con.close()
+
+
+def walk(root, cache, workers=None):
+    """
+    Visit every directory under root on a thread pool. Each one costs a stat,
+    only directories that changed since the cached scan are listed again.
+    :return: (path -> DirUsage of every directory, path -> DirUsage of the ones scanned now)
+    """
+    def visit(path):
+        try:
+            mtime = os.stat(path).st_mtime
+            cached = cache.get(path)
+            if cached is not None and cached.is_valid(mtime):
+                return path, cached, False
+            return path, DirUsage.scan(path, mtime), True
+        except (FileNotFoundError, NotADirectoryError):  # removed since its parent was listed
+            return path, None, False
+        except PermissionError as e:
+            log.error(f"Can't list {path}: {e}")
+            return path, None, False
+
+    seen = {}
+    changed = {}
+    with ThreadPoolExecutor(max_workers=workers or USAGE_WORKERS, thread_name_prefix='usage') as pool:
+        pending = {pool.submit(visit, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, usage, rescanned = future.result()
+                if usage is None:
+                    continue
+                seen[path] = usage
+                if rescanned:
+                    changed[path] = usage
+                pending |= set(pool.submit(visit, os.path.join(path, name)) for name in usage.subdirs)
+    return seen, changed
+
+
+def subtree_totals(seen):
+    """
+    :return: path -> [bytes, files] of everything under the directory
+    """
+    totals = {path: [usage.file_bytes, usage.file_count] for path, usage in seen.items()}
+    for path in sorted(seen, key=lambda path: path.count(os.sep), reverse=True):
+        parent = os.path.dirname(path)
+        if parent != path and parent in totals:
+            totals[parent][0] += totals[path][0]
+            totals[parent][1] += totals[path][1]
+    return totals
+
+
+def dataset_locations():
+    """
+    :return: (path, dataset id, pi name, cl number name) for every place a dataset's data can be
+    """
+    con = connect()
+    cur = con.cursor()
+    records = cur.execute(
+        'SELECT dataset.id, dataset.path_on_fast_store, dataset.path_on_hive, pi.name, clnumber.name FROM dataset '
+        'LEFT JOIN pi ON dataset.pi = pi.id LEFT JOIN clnumber ON dataset.cl_number = clnumber.id'
+    ).fetchall()
+    con.close()
+    locations = []
+    for dataset_id, path_on_fast_store, path_on_hive, pi, cl_number in records:
+        for path in (path_on_fast_store, path_on_hive):
+            if path:
+                locations.append((os.path.normpath(path), dataset_id, pi or 'unknown', cl_number or 'unknown'))
+    return locations
+
+
+def roll_up(totals, root):
+    """
+    :return: rows (level, name, bytes, files): a row per dataset, cl number and pi, the total under root
+        and what isn't in any known dataset
+    """
+    rows = {}
+
+    def add(level, name, size, files):
+        row = rows.setdefault((level, name), [0, 0])
+        row[0] += size
+        row[1] += files
+
+    attributed = [0, 0]
+    for path, dataset_id, pi, cl_number in dataset_locations():
+        if path not in totals:  # not under this root or not there anymore
+            continue
+        size, files = totals[path]
+        add('dataset', path, size, files)
+        add('clnumber', cl_number, size, files)
+        add('pi', pi, size, files)
+        attributed[0] += size
+        attributed[1] += files
+    root_size, root_files = totals.get(root, [0, 0])
+    add('total', root, root_size, root_files)
+    add('other', 'unattributed', max(root_size - attributed[0], 0), max(root_files - attributed[1], 0))
+    return [(level, name, size, files) for (level, name), (size, files) in rows.items()]
+
+
+def account(unit, root):
+    """
+    Recompute the usage under root from the directories that changed and store the totals.
+    :return: rows (level, name, bytes, files)
+    """
+    root = os.path.normpath(root)
+    started = time.time()
+    cache = load_cache(root)
+    seen, changed = walk(root, cache)
+    save_cache(changed, [path for path in cache if path not in seen])
+    rows = roll_up(subtree_totals(seen), root)
+
+    updated = time.time()
+    con = connect()
+    cur = con.cursor()
+    cur.execute('DELETE FROM usage_total WHERE unit = ?', (unit,))
+    cur.executemany(
+        'INSERT INTO usage_total(unit, level, name, bytes, files, updated) VALUES(?, ?, ?, ?, ?, ?)',
+        [(unit, level, name, size, files, updated) for level, name, size, files in rows]
+    )
+    con.commit()
+    con.close()
+    print(f"Usage of {root}: {len(seen)} directories, {len(changed)} scanned again, {updated - started:.1f} s")
+    return rows
+
+
+def top_consumers(unit, level='pi', limit=None):
+    """
+    :return: [(name, bytes)] of the biggest pis / cl numbers / datasets, from the last accounting
+    """
+    con = connect()
+    cur = con.cursor()
+    records = cur.execute(
+        'SELECT name, bytes FROM usage_total WHERE unit = ? AND level = ? ORDER BY bytes DESC LIMIT ?',
+        (unit, level, limit or USAGE_TOP_CONSUMERS)
+    ).fetchall()
+    con.close()
+    return records
+
+
+def dataset_usage(unit, path):
+    """
+    :return: bytes under the dataset's path at the last accounting, None if it wasn't accounted yet
+    """
+    con = connect()
+    cur = con.cursor()
+    record = cur.execute(
+        "SELECT bytes FROM usage_total WHERE unit = ? AND level = 'dataset' AND name = ?", (unit, os.path.normpath(path))
+    ).fetchone()
+    con.close()
+    return record[0] if record else None
+
+
+def describe_top_consumers(unit, level='pi'):
+    consumers = top_consumers(unit, level)
+    if not consumers:
+        return ""
+    return "top consumers: " + ", ".join(f"{name} {size / 2 ** 40:.1f} TB" for name, size in consumers)
@@ -1,6 +1,36 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
-from .settings import RESTRICT_MOVING_TIME, MOVE_TIMES
+from .settings import RESTRICT_MOVING_TIME, MOVE_TIMES, SLACK_HEADERS, SLACK_TIMEOUT
+
+_scan_cycle = 0
+
+
+def start_new_cycle():
+    """Called at the beginning of every scan, invalidates per-cycle snapshots (Dask cluster etc.)"""
+    global _scan_cycle
+    _scan_cycle += 1
+    return _scan_cycle
+
+
+def current_cycle():
+    return _scan_cycle
+
+
+def local_now():
+    import pytz
+    # Get the current time in UTC
+    current_time_utc = datetime.now(pytz.utc)
+    # Get the local timezone
+    local_timezone = pytz.timezone('America/New_York')
+    # Convert UTC time to local time
+    return current_time_utc.astimezone(local_timezone)
+
+
+def in_move_window(local_time):
+    # weekends: Saturday is 5, Sunday is 6
+    if local_time.weekday() in (5, 6):
+        return True
+    return local_time.hour >= MOVE_TIMES['start'] or local_time.hour <= MOVE_TIMES['stop']
 
 
 def can_be_moved():
@@ -13,22 +43,24 @@ def can_be_moved():
     # week_day = r_json['day_of_week']
     # print("local_time_str", local_time_str)
 
-    week_day = datetime.today().weekday()
-    print("week_day", week_day)
-    if week_day == 6 or week_day == 7:
-        return True
+    local_time = local_now()
+    print("week_day", local_time.weekday(), "local_time.hour", local_time.hour)
+    return in_move_window(local_time)
 
-    import pytz
-    # Get the current time in UTC
-    current_time_utc = datetime.now(pytz.utc)
-    # Get the local timezone
-    local_timezone = pytz.timezone('America/New_York')
-    # Convert UTC time to local time
-    local_time = current_time_utc.astimezone(local_timezone)
-    print("local_time.hour", local_time.hour)
-    if local_time.hour >= MOVE_TIMES['start'] or local_time.hour <= MOVE_TIMES['stop']:
-        return True
-    return False
+
+def move_window_remaining():
+    """
+    :return: seconds until the current moving window closes, 0 outside of it
+    """
+    if not RESTRICT_MOVING_TIME:
+        return 24 * 3600
+    local_time = local_now()
+    if not in_move_window(local_time):
+        return 0
+    window_end = local_time.replace(minute=0, second=0, microsecond=0)
+    while in_move_window(window_end) and window_end - local_time < timedelta(days=3):
+        window_end += timedelta(hours=1)
+    return (window_end - local_time).total_seconds()
 
 
 def is_night_time():
@@ -52,7 +84,7 @@ def post_message(channel, text):
         "channel": channel,
         "text": text,
     }
-    response = requests.post(url, json=payload, headers=HEADERS)
+    response = requests.post(url, json=payload, headers=SLACK_HEADERS, timeout=SLACK_TIMEOUT)
     data = response.json()
     if data.get("ok"):
         print("Message posted successfully!")
@@ -97,7 +129,7 @@ def fetch_thread_replies(channel, thread_ts):
         "channel": channel,
         "ts": thread_ts,
     }
-    response = requests.get(url, params=params, headers=HEADERS)
+    response = requests.get(url, params=params, headers=SLACK_HEADERS, timeout=SLACK_TIMEOUT)
     data = response.json()
     if data.get("ok"):
         return data["messages"]  # List of messages in the thread
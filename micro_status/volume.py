@@ -0,0 +1,166 @@
+import logging
+import os
+import statistics
+import time
+
+from .db import connect
+from .settings import *
+from .storage import latest_usage
+
+log = logging.getLogger(__name__)
+
+# stage of a pipeline -> step of WHERE_PROCESSING_HAPPENS that writes it, None: written where the dataset was acquired
+STAGE_STEPS = {
+    'raw': None,
+    'composites': 'stitch',
+    'denoised': 'denoise',
+    'ims': 'build_ims',
+    'tile_ims': None,
+}
+# stage -> processing statuses by which it's fully written
+STAGE_DONE = {
+    'composites': ('stitched', 'denoised', 'finished'),
+    'denoised': ('denoised', 'finished'),
+    'ims': ('finished',),
+    'tile_ims': ('finished',),
+}
+RIBBON_SAMPLE = 20  # ribbons looked at to guess the size of all of them
+
+
+def stage_unit(stage):
+    step = STAGE_STEPS[stage]
+    return 'faststore' if step is None else WHERE_PROCESSING_HAPPENS[step]
+
+
+def stage_complete(stage, imaging_status, processing_status):
+    if stage == 'raw':
+        return imaging_status == 'finished'
+    return processing_status in STAGE_DONE[stage]
+
+
+def median_ribbon_size(path):
+    """
+    Median size of the ribbons in the first image directory ({layer}/{color}/images) that has any
+    :return: bytes, None if nothing was imaged yet
+    """
+    try:
+        layers = sorted(entry.path for entry in os.scandir(path) if entry.is_dir() and 'layer' in entry.name)
+        for layer in layers:
+            for color in sorted(entry.path for entry in os.scandir(layer) if entry.is_dir()):
+                images_dir = os.path.join(color, 'images')
+                if not os.path.isdir(images_dir):
+                    continue
+                sizes = [entry.stat().st_size for entry in os.scandir(images_dir) if entry.is_file()][:RIBBON_SAMPLE]
+                sizes = [size for size in sizes if size]
+                if sizes:
+                    return int(statistics.median(sizes))
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def learned_ratio(stage):
+    """
+    Size of the stage output relative to the raw data, the median over datasets where both are complete.
+    VOLUME_RATIOS until there are VOLUME_CALIBRATION_MIN of them.
+    """
+    con = connect()
+    cur = con.cursor()
+    records = cur.execute(
+        "SELECT stage_row.written_bytes, raw.written_bytes FROM volume_reservation AS stage_row "
+        "JOIN volume_reservation AS raw ON raw.dataset_id = stage_row.dataset_id AND raw.stage = 'raw' "
+        "WHERE stage_row.stage = ? AND stage_row.complete = 1 AND raw.complete = 1 AND raw.written_bytes > 0",
+        (stage,)
+    ).fetchall()
+    con.close()
+    if len(records) < VOLUME_CALIBRATION_MIN:
+        return VOLUME_RATIOS[stage]
+    return statistics.median(written / raw for written, raw in records)
+
+
+def record_projection(dataset_id, stage, projected_bytes, admitted):
+    """
+    Reserve the projected bytes of the stage, or update the projection. Once admitted stays admitted.
+    """
+    con = connect()
+    cur = con.cursor()
+    cur.execute(
+        "INSERT INTO volume_reservation(dataset_id, stage, unit, projected_bytes, written_bytes, admitted, complete, updated) "
+        "VALUES(?, ?, ?, ?, 0, ?, 0, ?) "
+        "ON CONFLICT(dataset_id, stage) DO UPDATE SET unit = excluded.unit, projected_bytes = excluded.projected_bytes, "
+        "admitted = MAX(admitted, excluded.admitted), updated = excluded.updated",
+        (dataset_id, stage, stage_unit(stage), projected_bytes, int(admitted), time.time())
+    )
+    con.commit()
+    con.close()
+
+
+def record_written(dataset_id, stage, written_bytes, complete):
+    """
+    Once complete the largest size seen is kept, the output of a stage may be cleaned up or moved later
+    """
+    con = connect()
+    cur = con.cursor()
+    cur.execute(
+        'UPDATE volume_reservation SET written_bytes = CASE WHEN complete = 1 THEN MAX(written_bytes, ?) ELSE ? END, '
+        'complete = MAX(complete, ?), updated = ? WHERE dataset_id = ? AND stage = ?',
+        (written_bytes, written_bytes, int(complete), time.time(), dataset_id, stage)
+    )
+    con.commit()
+    con.close()
+
+
+def mark_admitted(dataset_id):
+    con = connect()
+    cur = con.cursor()
+    cur.execute('UPDATE volume_reservation SET admitted = 1 WHERE dataset_id = ?', (dataset_id,))
+    con.commit()
+    con.close()
+
+
+def outstanding(unit, exclude_dataset_id=None):
+    """
+    Bytes the admitted datasets are still going to write to the storage unit
+    """
+    con = connect()
+    cur = con.cursor()
+    total = cur.execute(
+        'SELECT SUM(MAX(projected_bytes - written_bytes, 0)) FROM volume_reservation '
+        'WHERE unit = ? AND admitted = 1 AND complete = 0 AND dataset_id != ?',
+        (unit, exclude_dataset_id if exclude_dataset_id is not None else -1)
+    ).fetchone()[0]
+    con.close()
+    return total or 0
+
+
+def room(unit):
+    """
+    Bytes that can be written to the storage unit before it's over MAX_ALLOWED_STORAGE_PERCENT,
+    None if its usage isn't known
+    """
+    usage = latest_usage(unit)
+    if not usage or usage.get('available_bytes') is None:
+        return None
+    return usage['available_bytes'] - usage['size_bytes'] * (100 - MAX_ALLOWED_STORAGE_PERCENT) / 100
+
+
+def admit(dataset_id, demand):
+    """
+    :param demand: storage unit -> bytes the dataset is going to write there
+    :return: (True, None) if it fits next to the reservations of the other admitted datasets,
+        (False, {unit, demand, reserved, room}) of the first storage unit that would overflow
+    """
+    for unit, needed in demand.items():
+        available = room(unit)
+        if available is None:
+            continue
+        reserved = outstanding(unit, exclude_dataset_id=dataset_id)
+        if reserved + needed > available:
+            return False, {'unit': unit, 'demand': needed, 'reserved': reserved, 'room': int(available)}
+    return True, None
+
+
+def describe_shortage(shortage):
+    tb = 2 ** 40
+    return (f"{shortage['unit']} has room for {shortage['room'] / tb:.1f} TB, "
+            f"{shortage['reserved'] / tb:.1f} TB reserved, this needs {shortage['demand'] / tb:.1f} TB")
@@ -1,9 +1,8 @@
-import json
 import logging
 import os
-import requests
-import sqlite3
 
+from micro_status.db import connect
+from micro_status.outbox import enqueue, has_pending
 from micro_status.settings import *
 
 log = logging.getLogger(__name__)
@@ -19,7 +18,7 @@ class Warning:
     @classmethod
     def create(cls, warning_type):
         warning = cls(type=warning_type)
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'INSERT OR IGNORE INTO warning(type) VALUES("{warning_type}")')
         warning.db_id = cur.lastrowid
@@ -29,7 +28,7 @@ class Warning:
 
     @classmethod
     def get_from_db(cls, warning_type):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'SELECT * FROM warning WHERE type = "{warning_type}"').fetchone()
         con.close()
@@ -43,7 +42,10 @@ class Warning:
         )
         return warning
 
-    def send_message(self):
+    def send_message(self, details=None):
+        """
+        :param details: appended to the message, e.g. when a threshold is predicted to be reached
+        """
         msg_map = {
             'low_space_hive': f":exclamation: *WARNING: Critically low space on Hive (more than {MAX_ALLOWED_STORAGE_PERCENT}% used)*",
             'low_space_h20': f":exclamation: *WARNING: Critically low space on h20 (more than {MAX_ALLOWED_STORAGE_PERCENT}% used)*",
@@ -54,8 +56,14 @@ class Warning:
             'space_hive_thr1': f":exclamation: *WARNING: Low space on Hive (more than {STORAGE_THRESHOLD_1}% used)*",
             'space_h20_thr1': f":exclamation: *WARNING: Low space on h20 (more than {STORAGE_THRESHOLD_1}% used)*",
             'space_faststore_thr1': f":exclamation: *WARNING: Low space on FastStore (more than {STORAGE_THRESHOLD_1}% used)*",
+            'forecast_low_space_hive': f":warning: *WARNING: Hive is predicted to be more than {MAX_ALLOWED_STORAGE_PERCENT}% used*",
+            'forecast_low_space_faststore': f":warning: *WARNING: FastStore is predicted to be more than {MAX_ALLOWED_STORAGE_PERCENT}% used*",
+            'forecast_space_hive_thr1': f":warning: *WARNING: Hive is predicted to be more than {STORAGE_THRESHOLD_1}% used*",
+            'forecast_space_faststore_thr1': f":warning: *WARNING: FastStore is predicted to be more than {STORAGE_THRESHOLD_1}% used*",
         }
         msg_text = msg_map[self.type]
+        if details:
+            msg_text += f" {details}"
         payload = {
             "channel": SLACK_CHANNEL_ID,
             "blocks": [
@@ -68,30 +76,26 @@ class Warning:
                 }
             ]
         }
-        response = requests.post(SLACK_URL, data=json.dumps(payload), headers=SLACK_HEADERS)
-        # update db
-        con = sqlite3.connect(DB_LOCATION)
-        cur = con.cursor()
-        res = cur.execute(f'UPDATE warning SET message_sent = 1 WHERE id={self.db_id}')
-        con.commit()
-        con.close()
-        return response
+        if has_pending(warning_id=self.db_id):  # previous one not delivered yet
+            return
+        # message_sent is set by the outbox sender once Slack accepted the message
+        return enqueue(payload, warning_id=self.db_id, msg_type=self.type)
 
     def mark_as_active(self):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE warning SET active = 1 WHERE id={self.db_id}')
         con.commit()
         con.close()
 
     def mark_as_inactive(self):
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE warning SET active = 0 WHERE id={self.db_id}')
         con.commit()
         con.close()
 
-        con = sqlite3.connect(DB_LOCATION)
+        con = connect()
         cur = con.cursor()
         res = cur.execute(f'UPDATE warning SET message_sent = 0 WHERE id={self.db_id}')
         con.commit()
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """
+    Empty database with the production schema in tmp_path, used by every module through micro_status.db
+    """
+    from benchmark.environment import create_database
+    from micro_status import db as db_module
+    db_file = str(tmp_path / 'datasets.db')
+    create_database(db_file)
+    monkeypatch.setattr(db_module, 'DB_LOCATION', db_file)
+    return db_file
+
+
+@pytest.fixture
+def dataset(db, tmp_path, monkeypatch):
+    """
+    RSCM dataset brain_stack of smith/CL1 with one ribbon on FastStore, folders and the stage wakeups patched
+    """
+    from micro_status import dataset as dataset_module
+    from micro_status.dataset import Dataset
+    from micro_status.db import connect
+    faststore = tmp_path / 'CBI_FastStore' / 'Acquire'
+    hive = tmp_path / 'h20' / 'Acquire'
+    source = faststore / 'RSCM' / 'smith' / 'CL1' / 'brain_stack'
+    os.makedirs(source / 'brain_layer000' / '488' / 'images')
+    (source / 'vs_series.dat').write_text('<vs_series/>')
+    (source / 'brain_layer000' / '488' / 'images' / 'brain_col000.tif').write_bytes(b'\0' * 100)
+    stitching = tmp_path / 'clusterStitch'
+    os.makedirs(stitching / 'tempQueue')
+    for name, value in {
+        'FASTSTORE_ACQUISITION_FOLDER': f"{faststore}/", 'HIVE_ACQUISITION_FOLDER': f"{hive}/",
+        'RSCM_FOLDER_STITCHING': str(stitching), 'MANIFEST_FOLDER': str(tmp_path / 'manifests'),
+        'MOVE_METHOD': 'listener',
+    }.items():
+        monkeypatch.setattr(dataset_module, name, value)
+    monkeypatch.setattr(dataset_module, 'wake_stage', lambda name: None)
+    con = connect()
+    con.execute("INSERT INTO pi(id, name) VALUES(1, 'smith')")
+    con.execute("INSERT INTO clnumber(id, name, pi) VALUES(1, 'CL1', 1)")
+    con.execute(
+        "INSERT INTO dataset(id, name, path_on_fast_store, cl_number, pi, created) "
+        "VALUES(1, 'brain_stack', ?, 1, 1, '2026-01-01_00-00-00')", (str(source),)
+    )
+    con.commit()
+    record = con.execute('SELECT * FROM dataset WHERE id = 1').fetchone()
+    con.close()
+    return Dataset.initialize_from_db(record)
@@ -0,0 +1,98 @@
+"""
+Local stand-in for the Dask scheduler dashboard: json/identity.json, info/main/workers.html,
+info/worker/<address>.html, json/counts.json, served from a thread on a free port.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+
+class FakeDashboard:
+    """
+    workers: worker address -> keys of the tasks it's processing
+    identity: False to answer json/identity.json with a 404, like the schedulers without it
+    delays: path -> seconds to wait before answering, to test timeouts
+    """
+    def __init__(self, workers=None, identity=True, counts=None, delays=None):
+        self.workers = workers or {}
+        self.identity = identity
+        self.counts = counts or {}
+        self.delays = delays or {}
+        self.requests = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+    def workers_html(self):
+        rows = "".join(
+            f'<tr><td><a href="../worker/{quote(address, safe="")}.html">{address}</a></td></tr>'
+            for address in sorted(self.workers)
+        )
+        return f"<html><body><table><tr><th>Worker</th></tr>{rows}</table></body></html>"
+
+    @staticmethod
+    def worker_html(keys):
+        rows = "".join(f"<tr><td>{key}</td><td>processing</td></tr>" for key in keys)
+        return (
+            "<html><body><table><tr><td>info</td></tr></table><table><tr><td>logs</td></tr></table>"
+            f"<table><tr><th>Key</th><th>State</th></tr>{rows}</table></body></html>"
+        )
+
+    def respond(self, path):
+        """
+        :return: (status, content type, body)
+        """
+        if path == '/json/identity.json':
+            if not self.identity:
+                return 404, 'text/plain', 'Not Found'
+            return 200, 'application/json', json.dumps({'type': 'Scheduler', 'workers': {a: {} for a in self.workers}})
+        if path == '/info/main/workers.html':
+            return 200, 'text/html', self.workers_html()
+        if path.startswith('/info/worker/') and path.endswith('.html'):
+            address = unquote(path[len('/info/worker/'):-len('.html')])
+            if address not in self.workers:
+                return 404, 'text/plain', 'Not Found'
+            return 200, 'text/html', self.worker_html(self.workers[address])
+        if path == '/json/counts.json':
+            return 200, 'application/json', json.dumps(self.counts)
+        return 404, 'text/plain', 'Not Found'
+
+    def _handler(self):
+        dashboard = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                dashboard.requests.append(self.path)
+                delay = dashboard.delays.get(self.path)
+                if delay:
+                    time.sleep(delay)
+                status, content_type, body = dashboard.respond(self.path)
+                body = body.encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):  # the client timed out
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
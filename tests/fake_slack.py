@@ -0,0 +1,68 @@
+"""
+Local stand-in for Slack's chat.postMessage, served from a thread on a free port.
+Answers with the queued responses first, then with ok and a new ts for every post.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeSlack:
+    def __init__(self):
+        self.posts = []  # payloads received, in order
+        self.responses = []  # (status, headers, body) to answer the next posts with
+        self._ts = 1700000000
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/chat.postMessage"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+    def fail(self, status=500, body='Internal Server Error', headers=None):
+        self.responses.append((status, headers or {}, body))
+
+    def error(self, error):
+        self.responses.append((200, {}, json.dumps({'ok': False, 'error': error})))
+
+    def rate_limit(self, retry_after):
+        self.responses.append((429, {'Retry-After': str(retry_after)}, json.dumps({'ok': False, 'error': 'ratelimited'})))
+
+    def respond(self, payload):
+        with self._lock:
+            self.posts.append(payload)
+            if self.responses:
+                return self.responses.pop(0)
+            self._ts += 1
+            return 200, {}, json.dumps({'ok': True, 'channel': payload.get('channel'), 'ts': f"{self._ts}.000100"})
+
+    def _handler(self):
+        slack = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, headers, response = slack.respond(json.loads(body))
+                response = response.encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+import pytest
+
+from micro_status import channel_deletion, leases
+from micro_status.channel_deletion import ChannelDeletion, channel_dirs, start_deletion
+from micro_status.db import connect
+
+LAYERS = [f"layer{i:03}" for i in range(4)]
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setattr(channel_deletion, '_running', {})
+    monkeypatch.setattr(leases, '_held', set())
+    root = tmp_path / 'brain'
+    for layer in LAYERS:
+        for channel in ('405nm_ex', '488nm_ex'):
+            images_dir = root / layer / channel / 'images'
+            os.makedirs(images_dir)
+            (images_dir / 'ribbon.tif').write_bytes(b'\0' * 100)
+    return root
+
+
+def test_channel_dirs_from_layer_names(root):
+    expected = [os.path.join(root, layer, '405nm_ex') for layer in LAYERS]
+    assert channel_dirs(str(root), LAYERS, '405') == expected
+    # names in the database that don't match the directories, root is listed
+    assert channel_dirs(str(root), ['layer_a', 'layer_b'], '405') == expected
+    assert channel_dirs(str(root), LAYERS, '561') == []
+
+
+def test_interrupted_deletion_finds_the_rest(root):
+    for layer in LAYERS[:2]:
+        os.rename(root / layer / '405nm_ex', root / layer / 'deleted')
+    paths = channel_dirs(str(root), LAYERS, '405')
+    assert [path for path in paths if os.path.isdir(path)] == [os.path.join(root, layer, '405nm_ex') for layer in LAYERS[2:]]
+
+
+def test_deletion_keeps_other_channels(db, root):
+    summaries = []
+    deletion = ChannelDeletion(1, str(root), '405', LAYERS, on_complete=summaries.append)
+    assert leases.acquire(deletion.lease)
+    deletion.run()
+    for layer in LAYERS:
+        assert not os.path.exists(root / layer / '405nm_ex')
+        assert os.path.exists(root / layer / '488nm_ex' / 'images' / 'ribbon.tif')
+    assert summaries[0]['state'] == 'done'
+    assert (summaries[0]['dirs'], summaries[0]['deleted'], summaries[0]['freed_bytes']) == (4, 4, 400)
+    assert not leases.holds(deletion.lease)
+
+
+def test_deletion_runs_on_one_worker(db, root):
+    con = connect()
+    con.execute("INSERT INTO lease(name, owner, acquired, expires) VALUES('channel_deletion:1', 'other:1', ?, ?)",
+                (time.time(), time.time() + 600))
+    con.commit()
+    con.close()
+    assert not start_deletion(1, str(root), '405', LAYERS)
+    assert os.path.exists(root / LAYERS[0] / '405nm_ex')
+
+    con = connect()
+    con.execute('DELETE FROM lease')
+    con.commit()
+    con.close()
+    completed = threading.Event()
+    assert start_deletion(1, str(root), '405', LAYERS, on_complete=lambda summary: completed.set())
+    assert completed.wait(10)
+    assert not any(os.path.exists(root / layer / '405nm_ex') for layer in LAYERS)
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+import pytest
+
+from micro_status import checksums
+from micro_status.checksums import DatasetChecksums, IOBudget, find_new_ribbons, hash_new_ribbons
+from micro_status.manifest import file_hash, load_manifest
+
+
+@pytest.fixture
+def manifests(tmp_path, monkeypatch):
+    folder = tmp_path / 'manifests'
+    monkeypatch.setattr(checksums, 'MANIFEST_FOLDER', str(folder))
+    monkeypatch.setattr(checksums, '_hasher', None)
+    return folder
+
+
+def write_ribbon(root, layer, name, data=b'ribbon', age=120):
+    images_dir = root / f"layer{layer:03}" / '488' / 'images'
+    os.makedirs(images_dir, exist_ok=True)
+    path = images_dir / name
+    path.write_bytes(data)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return os.path.join(f"layer{layer:03}", '488', 'images', name)
+
+
+def test_only_settled_ribbons_are_new(manifests, tmp_path):
+    root = tmp_path / 'brain'
+    settled = write_ribbon(root, 0, 'ribbon_0.tif')
+    write_ribbon(root, 0, 'ribbon_1.tif', age=0)
+    dataset_checksums = DatasetChecksums(1, str(root))
+    assert list(find_new_ribbons(dataset_checksums, 2, settle_time=60)) == [settled]
+    assert len(find_new_ribbons(dataset_checksums, 2, settle_time=0)) == 2
+
+
+def test_complete_layers_are_not_listed_again(manifests, tmp_path):
+    root = tmp_path / 'brain'
+    os.makedirs(manifests)
+    dataset_checksums = DatasetChecksums(1, str(root))
+    for name in ('ribbon_0.tif', 'ribbon_1.tif'):
+        relative_path = write_ribbon(root, 0, name)
+        stat = os.stat(root / relative_path)
+        dataset_checksums.record(relative_path, stat.st_size, stat.st_mtime, 'hash')
+    assert find_new_ribbons(dataset_checksums, 2, settle_time=60) == {}
+    assert dataset_checksums.complete_dirs == {os.path.join('layer000', '488', 'images')}
+
+    # a changed ribbon in an incomplete layer is hashed again
+    relative_path = write_ribbon(root, 1, 'ribbon_0.tif')
+    stat = os.stat(root / relative_path)
+    dataset_checksums.record(relative_path, stat.st_size, stat.st_mtime, 'hash')
+    write_ribbon(root, 1, 'ribbon_0.tif', data=b'rewritten', age=100)
+    assert list(find_new_ribbons(dataset_checksums, 2, settle_time=60)) == [relative_path]
+
+
+def test_manifest_is_completed_when_imaging_finishes(manifests, tmp_path):
+    root = tmp_path / 'brain'
+    paths = [write_ribbon(root, layer, 'ribbon_0.tif', data=bytes([layer]) * 1000) for layer in range(3)]
+    paths.append(write_ribbon(root, 3, 'ribbon_0.tif', age=0))  # not settled yet
+    completed = threading.Event()
+    summaries = []
+
+    def on_complete(summary):
+        summaries.append(summary)
+        completed.set()
+
+    summary = hash_new_ribbons(1, str(root), 1, on_complete=on_complete)
+    assert summary['files'] + summary['queued'] == 3 and not summary['complete']
+
+    summary = hash_new_ribbons(1, str(root), 1, finished=True, on_complete=on_complete)
+    if summary['complete']:  # everything was hashed already
+        summaries.append(summary)
+        completed.set()
+    assert completed.wait(10)
+    assert summaries[0]['files'] == 4 and summaries[0]['complete']
+
+    manifest = load_manifest(checksums.acquisition_manifest_path(1))
+    assert set(manifest) == set(paths)
+    for relative_path in paths:
+        assert manifest[relative_path][2] == file_hash(root / relative_path)
+    # a restart picks the manifest up from the file
+    assert set(DatasetChecksums(1, str(root)).hashed) == set(paths)
+
+
+def test_io_budget_spreads_reads():
+    budget = IOBudget(1000)
+    started = time.time()
+    for _ in range(3):
+        budget.consume(100)
+    assert time.time() - started >= 0.15
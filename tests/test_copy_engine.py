@@ -0,0 +1,101 @@
+import os
+
+from micro_status import copy_engine
+
+
+def make_tree(root, files):
+    for relative_path, size in files.items():
+        path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+
+
+def test_tree_with_symlinks_is_not_moved(tmp_path):
+    source = tmp_path / 'source'
+    make_tree(source, {'layer000/488/images/a.tif': 100})
+    os.symlink('layer000/488/images/a.tif', source / 'latest.tif')
+    assert copy_engine.main([str(source), str(tmp_path / 'destination'), '--delete-source']) == 1
+    assert os.path.islink(source / 'latest.tif')
+    assert not os.path.exists(tmp_path / 'destination')
+
+
+def read_tree(root):
+    contents = {}
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            with open(path, 'rb') as f:
+                contents[os.path.relpath(path, root)] = f.read()
+    return contents
+
+
+def test_parallel_copy(tmp_path):
+    source = tmp_path / 'source'
+    make_tree(source, {f"layer{z:03}/{color}/images/col{x:03}.tif": 1000 + x for z in range(4)
+                       for color in ('488', '561') for x in range(10)})
+    copy = copy_engine.TreeCopy(str(source), str(tmp_path / 'destination'), workers=4)
+    assert copy.run()
+    assert copy.copied_files == 80
+    assert read_tree(tmp_path / 'destination') == read_tree(source)  # journal removed too
+    assert os.stat(tmp_path / 'destination' / 'layer000' / '488' / 'images' / 'col000.tif').st_mtime == \
+        os.stat(source / 'layer000' / '488' / 'images' / 'col000.tif').st_mtime
+
+
+def test_interrupted_copy_resumes_from_the_journal(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    make_tree(source, {f"images/col{x:03}.tif": 100 for x in range(10)})
+    copy_file_data = copy_engine.copy_file_data
+
+    def fail_some(src, dst, size):
+        if src.endswith(('col003.tif', 'col007.tif')):
+            raise OSError("Stale file handle")
+        copy_file_data(src, dst, size)
+
+    monkeypatch.setattr(copy_engine, 'copy_file_data', fail_some)
+    assert not copy_engine.TreeCopy(str(source), str(tmp_path / 'destination'), workers=4).run()
+    assert os.path.exists(tmp_path / 'destination' / copy_engine.JOURNAL_NAME)
+
+    monkeypatch.setattr(copy_engine, 'copy_file_data', copy_file_data)
+    copy = copy_engine.TreeCopy(str(source), str(tmp_path / 'destination'), workers=4)
+    assert copy.run()
+    assert (copy.copied_files, copy.skipped_files) == (2, 8)
+    assert read_tree(tmp_path / 'destination') == read_tree(source)
+
+
+def test_verification_finds_a_corrupted_copy_and_keeps_the_source(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    make_tree(source, {f"images/col{x:03}.tif": 100 for x in range(3)})
+    copy_file_data = copy_engine.copy_file_data
+
+    def corrupt_one(src, dst, size):
+        copy_file_data(src, dst, size)
+        if src.endswith('col001.tif'):
+            with open(dst, 'r+b') as f:
+                f.write(b'\xff' * 10)  # same size, different contents
+
+    monkeypatch.setattr(copy_engine, 'copy_file_data', corrupt_one)
+    copy = copy_engine.TreeCopy(str(source), str(tmp_path / 'destination'), delete_source=True, hash_files=True)
+    assert not copy.run()
+    assert copy.verify(copy_engine.list_tree(str(source))[1]).hash == [os.path.join('images', 'col001.tif')]
+    assert len(read_tree(source)) == 3
+
+
+def test_source_is_deleted_only_after_a_clean_verify(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    make_tree(source, {f"images/col{x:03}.tif": 100 for x in range(3)})
+    expected = read_tree(source)
+    verify = copy_engine.TreeCopy.verify
+    verified = []
+
+    def record_verify(self, files):
+        diff = verify(self, files)
+        verified.append(diff.clean)
+        assert os.path.exists(source)
+        return diff
+
+    monkeypatch.setattr(copy_engine.TreeCopy, 'verify', record_verify)
+    assert copy_engine.main([str(source), str(tmp_path / 'destination'), '--delete-source', '--workers', '2']) == 0
+    assert verified == [True]
+    assert not os.path.exists(source)
+    assert read_tree(tmp_path / 'destination') == expected
@@ -0,0 +1,55 @@
+import pytest
+
+from fake_dask_dashboard import FakeDashboard
+from micro_status import dask_cluster
+from micro_status.dask_cluster import ClusterSnapshot
+
+WORKERS = {
+    'tcp://10.0.0.1:40001': ['stitch_tile-a1', 'stitch_tile-a2'],
+    'tcp://10.0.0.2:40002': [],
+}
+
+
+@pytest.fixture(autouse=True)
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(dask_cluster, 'DASK_HTTP_TIMEOUT', 0.5)
+
+
+def test_workers_from_identity():
+    with FakeDashboard(WORKERS, counts={'processing': 2}) as dashboard:
+        snapshot = ClusterSnapshot.take(dashboard.url)
+    assert snapshot.ok
+    assert snapshot.workers == WORKERS
+    assert snapshot.task_counts == {'tcp://10.0.0.1:40001': 2, 'tcp://10.0.0.2:40002': 0}
+    assert snapshot.counts == {'processing': 2}
+    assert '/info/main/workers.html' not in dashboard.requests
+
+
+def test_workers_html_fallback():
+    with FakeDashboard(WORKERS, identity=False) as dashboard:
+        snapshot = ClusterSnapshot.take(dashboard.url)
+    assert snapshot.ok
+    assert snapshot.workers == WORKERS
+    assert dashboard.requests.index('/json/identity.json') < dashboard.requests.index('/info/main/workers.html')
+
+
+def test_dashboard_timeout():
+    with FakeDashboard(WORKERS, delays={'/json/identity.json': 2}) as dashboard:
+        snapshot = ClusterSnapshot.take(dashboard.url)
+    assert not snapshot.ok
+    assert snapshot.workers == {}
+
+
+def test_worker_page_timeout():
+    slow_worker = '/info/worker/tcp%3A%2F%2F10.0.0.2%3A40002.html'
+    with FakeDashboard(WORKERS, delays={slow_worker: 2}) as dashboard:
+        snapshot = ClusterSnapshot.take(dashboard.url)
+    assert not snapshot.ok  # partial: the activity of the slow worker is unknown
+    assert snapshot.workers == {'tcp://10.0.0.1:40001': WORKERS['tcp://10.0.0.1:40001']}
+
+
+def test_dashboard_not_running():
+    with FakeDashboard(WORKERS) as dashboard:
+        url = dashboard.url
+    snapshot = ClusterSnapshot.take(url)
+    assert not snapshot.ok
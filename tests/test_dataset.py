@@ -0,0 +1,37 @@
+import threading
+
+from micro_status.db import connect
+
+
+def test_concurrent_summary_updates_keep_each_others_keys(dataset):
+    barrier = threading.Barrier(8)
+
+    def update(index):
+        barrier.wait()
+        for i in range(20):
+            dataset.update_processing_summary({f"key{index}": {'count': i}})
+
+    threads = [threading.Thread(target=update, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = dataset.get_processing_summary()
+    assert {key: value['count'] for key, value in summary.items()} == {f"key{index}": 19 for index in range(8)}
+
+
+def test_summary_update_leaves_other_keys_alone(dataset):
+    dataset.update_processing_summary({'channel_deletion': {'channel': '405', 'state': 'running'}})
+    stale = dataset.get_processing_summary()
+    con = connect()
+    con.execute(
+        "UPDATE dataset SET processing_summary = json_set(processing_summary, '$.channel_deletion.state', 'done')"
+    )
+    con.commit()
+    con.close()
+    stale['checksums'] = {'files': 3}
+    dataset.update_processing_summary({'checksums': stale['checksums'], "it's": [1, "two"]})
+    summary = dataset.get_processing_summary()
+    assert summary['channel_deletion']['state'] == 'done'
+    assert summary['checksums'] == {'files': 3}
+    assert summary["it's"] == [1, "two"]
@@ -0,0 +1,74 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from micro_status import ims_probe
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(ims_probe, '_verdicts', ims_probe.OrderedDict())
+
+
+def write_ims(path, imaris_data=True):
+    with h5py.File(path, 'w') as f:
+        group = f.create_group(ims_probe.IMARIS_DATA_GROUP if imaris_data else 'Other')
+        group.create_dataset('Data', data=np.arange(10000, dtype=np.uint16))
+
+
+def test_valid_imaris_file(tmp_path):
+    write_ims(tmp_path / 'a.ims')
+    assert ims_probe.probe(str(tmp_path / 'a.ims')) == ims_probe.OK
+    assert ims_probe.is_intact(str(tmp_path / 'a.ims'))
+
+
+def test_hdf5_without_imaris_data(tmp_path):
+    write_ims(tmp_path / 'a.ims', imaris_data=False)
+    assert ims_probe.probe(str(tmp_path / 'a.ims')) == ims_probe.NO_IMARIS_DATA
+
+
+def test_truncated_file(tmp_path):
+    write_ims(tmp_path / 'a.ims')
+    with open(tmp_path / 'a.ims', 'rb') as f:
+        head = f.read(os.path.getsize(tmp_path / 'a.ims') // 2)
+    (tmp_path / 'copying.ims').write_bytes(head)
+    assert ims_probe.probe(str(tmp_path / 'copying.ims')) == ims_probe.TRUNCATED
+
+
+def test_file_still_being_written(tmp_path):
+    path = str(tmp_path / 'a.ims')
+    with h5py.File(path, 'w', libver='latest') as f:
+        f.create_group(ims_probe.IMARIS_DATA_GROUP).create_dataset('Data', data=np.zeros(100))
+        f.flush()
+        assert ims_probe.probe(path) == ims_probe.OPEN_FOR_WRITE
+    assert ims_probe.probe(path) == ims_probe.OK  # closed: new mtime, checked again
+
+
+def test_not_hdf5_and_missing(tmp_path):
+    (tmp_path / 'a.ims').write_bytes(b'not an imaris file' * 100)
+    assert ims_probe.probe(str(tmp_path / 'a.ims')) == ims_probe.NOT_HDF5
+    assert ims_probe.probe(str(tmp_path / 'missing.ims')) == ims_probe.MISSING
+
+
+def test_verdicts_are_cached_by_size_and_mtime_and_bounded(tmp_path, monkeypatch):
+    checked = []
+    check_file = ims_probe.check_file
+    monkeypatch.setattr(ims_probe, 'check_file', lambda path: checked.append(path) or check_file(path))
+    monkeypatch.setattr(ims_probe, 'CACHE_SIZE', 2)
+    paths = [str(tmp_path / f"{i}.ims") for i in range(3)]
+    for path in paths:
+        write_ims(path)
+    ims_probe.probe(paths[0])
+    ims_probe.probe(paths[0])
+    assert checked == [paths[0]]
+
+    os.utime(paths[0], (1000, 1000))  # changed since
+    ims_probe.probe(paths[0])
+    assert checked == [paths[0]] * 2
+
+    ims_probe.probe(paths[1])
+    ims_probe.probe(paths[2])
+    assert len(ims_probe._verdicts) == 2
+    assert (paths[0], os.path.getsize(paths[0]), 1000) not in ims_probe._verdicts
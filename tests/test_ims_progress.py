@@ -0,0 +1,66 @@
+import numpy as np
+import tifffile
+
+from micro_status import ims_progress
+from micro_status.composite_manifest import get_manifest
+from micro_status.ims_progress import describe_build, describe_progress, pyramid_factor, predict_ims_size, update_build_progress
+
+MB = 2 ** 20
+
+
+def test_pyramid_factor(monkeypatch):
+    monkeypatch.setattr(ims_progress, 'IMS_PYRAMID_MIN_SIDE', 256)
+    assert pyramid_factor((100, 200)) == 1
+    assert pyramid_factor((3, 1024, 512)) == 1 + 1 / 4 + 1 / 16  # 1024 -> 512 -> 256
+
+
+def test_predicted_size_from_the_composites(tmp_path, monkeypatch):
+    monkeypatch.setattr(ims_progress, 'IMS_PYRAMID_MIN_SIDE', 256)
+    monkeypatch.setattr(ims_progress, 'IMS_SIZE_RATIO', 1.0)
+    for i in range(4):
+        tifffile.imwrite(tmp_path / f"composite_{i:04}.tif", np.zeros((2, 512, 300), dtype=np.uint16))
+    assert predict_ims_size(get_manifest(str(tmp_path))) == int(4 * 2 * 512 * 300 * 2 * (1 + 1 / 4))
+    assert predict_ims_size(get_manifest(str(tmp_path / 'empty'))) is None
+
+
+def test_rate_and_eta_from_the_samples(monkeypatch):
+    monkeypatch.setattr(ims_progress, 'IMS_STALL_MIN_TIME', 300)
+    building_ims = {'predicted_size': 1000 * MB}
+    for t, size in [(0, 0), (60, 60 * MB), (120, 120 * MB)]:
+        building_ims = update_build_progress(building_ims, size, now=1000 + t)
+    assert building_ims['mb_per_s'] == 1.0
+    assert building_ims['percent'] == 12.0
+    assert building_ims['eta'] == 880
+    assert not building_ims['stalled']
+    assert 'ETA 0h 14m' in describe_progress(building_ims)
+
+    # same size for longer than the stall time
+    building_ims = update_build_progress(building_ims, 120 * MB, now=1000 + 120 + 301)
+    assert len(building_ims['samples']) == 3 and building_ims['stalled']
+    assert describe_progress(building_ims).endswith(', stalled')
+
+
+def test_stall_waits_for_several_usual_intervals(monkeypatch):
+    monkeypatch.setattr(ims_progress, 'IMS_STALL_MIN_TIME', 300)
+    monkeypatch.setattr(ims_progress, 'IMS_STALL_FACTOR', 5)
+    building_ims = {}
+    for t in range(0, 3000, 600):  # grows in bursts every 10 minutes
+        building_ims = update_build_progress(building_ims, (t + 1) * MB, now=1000 + t)
+    assert not update_build_progress(building_ims, 2401 * MB, now=1000 + 2400 + 2000)['stalled']
+    assert update_build_progress(building_ims, 2401 * MB, now=1000 + 2400 + 3001)['stalled']
+
+
+def test_smaller_file_starts_the_build_over():
+    building_ims = {'eta_reported': True}
+    building_ims = update_build_progress(building_ims, 100 * MB, now=1000)
+    building_ims = update_build_progress(building_ims, 200 * MB, now=1100)
+    building_ims = update_build_progress(building_ims, 10 * MB, now=1200)
+    assert building_ims['samples'] == [[1200, 10 * MB]]
+    assert building_ims['started'] == 1200
+    assert 'eta_reported' not in building_ims
+
+
+def test_describe_build():
+    building_ims = {'started': 1000, 'samples': [[1000, 0], [4600, 3600 * MB]], 'predicted_size': 1800 * MB}
+    assert describe_build(building_ims) == "Built in 1h 00m at 1.0 MB/s, 2.00x the predicted size."
+    assert describe_build({}) == ""
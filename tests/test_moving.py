@@ -0,0 +1,93 @@
+import os
+import shutil
+import time
+
+from micro_status import checksums
+from micro_status import dataset as dataset_module
+from micro_status.checksums import acquisition_manifest_path
+from micro_status.db import connect
+from micro_status.job_launcher import Job
+from micro_status.manifest import load_manifest, save_manifest
+
+
+def wait_until_moving(dataset_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        con = connect()
+        moving = con.execute('SELECT moving FROM dataset WHERE id = ?', (dataset_id,)).fetchone()[0]
+        con.close()
+        if moving:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_move_is_queued_after_the_manifest_is_saved(dataset):
+    dataset.start_moving()
+    dataset.start_moving()  # already being started
+    assert wait_until_moving(dataset.db_id)
+    assert os.path.exists(dataset.source_manifest_path)
+    queued = os.listdir(os.path.join(dataset_module.RSCM_FOLDER_STITCHING, 'tempQueue'))
+    assert queued == [dataset.rscm_move_txt_file_name]
+    assert not dataset_module._manifests_running
+
+
+def test_listener_copy_with_new_mtimes_is_verified(dataset):
+    dataset.start_moving()
+    assert wait_until_moving(dataset.db_id)
+    # the listener copies without keeping modification times, then deletes the source
+    shutil.copytree(dataset.path_on_fast_store, dataset.hive_destination, copy_function=shutil.copyfile)
+    later = time.time() + 3600
+    for dir_path, _, file_names in os.walk(dataset.hive_destination):
+        for file_name in file_names:
+            os.utime(os.path.join(dir_path, file_name), (later, later))
+    shutil.rmtree(dataset.path_on_fast_store)
+    assert dataset.verify_move()
+
+
+def test_native_copy_with_new_mtimes_is_not_verified(dataset, monkeypatch):
+    dataset.save_source_manifest()
+    shutil.copytree(dataset.path_on_fast_store, dataset.hive_destination, copy_function=shutil.copyfile)
+    later = time.time() + 3600
+    for dir_path, _, file_names in os.walk(dataset.hive_destination):
+        for file_name in file_names:
+            os.utime(os.path.join(dir_path, file_name), (later, later))
+    monkeypatch.setattr(dataset_module, 'MOVE_METHOD', 'native')  # the copy engine keeps mtimes
+    assert not dataset.verify_move()
+    assert dataset.get_processing_summary()['move_verification']['mtime']['count'] == 2
+
+
+def test_source_manifest_hashes_what_acquisition_missed(dataset, monkeypatch):
+    images = os.path.join(dataset.path_on_fast_store, 'brain_layer000', '488', 'images')
+    with open(os.path.join(images, 'brain_col001.tif'), 'wb') as f:
+        f.write(b'\1' * 100)
+    # hashed during acquisition, the status checker was restarted before the second ribbon
+    relative_path = os.path.join('brain_layer000', '488', 'images', 'brain_col000.tif')
+    stat = os.stat(os.path.join(dataset.path_on_fast_store, relative_path))
+    monkeypatch.setattr(checksums, 'MANIFEST_FOLDER', dataset_module.MANIFEST_FOLDER)
+    os.makedirs(dataset_module.MANIFEST_FOLDER)
+    save_manifest({relative_path: (stat.st_size, stat.st_mtime, 'acquisition')}, acquisition_manifest_path(1))
+    monkeypatch.setattr(dataset_module, 'MOVE_VERIFY_HASH', True)
+    dataset.save_source_manifest()
+    manifest = load_manifest(dataset.source_manifest_path)
+    assert manifest[relative_path][2] == 'acquisition'
+    assert all(digest for _, _, digest in manifest.values())
+
+
+def test_failed_native_move_is_retried_then_paused(dataset, monkeypatch):
+    monkeypatch.setattr(dataset_module, 'MOVE_METHOD', 'native')
+    monkeypatch.setattr(dataset_module, 'JOB_RETRIES', {'move_dataset': 2})
+    events = []
+    monkeypatch.setattr(dataset_module, 'add_event', lambda *event: events.append(event))
+    dataset.queue_native_move()
+    for attempt in range(3):
+        job = Job.get_latest(dataset.db_id, 'move_dataset')
+        assert job.status == 'queued'
+        job.mark_finished(1)
+        dataset.check_if_moved()
+    assert Job.get_latest(dataset.db_id, 'move_dataset').db_id == job.db_id  # not queued again
+    summary = dataset.get_processing_summary()
+    assert summary['move_failed']['exit_code'] == 1 and summary['move_retries'] == 0
+    assert dataset.processing_status == 'paused'
+    assert [msg_type for _, msg_type, _ in events] == ['move_failed']
+    assert 'exit code 1' in events[0][2]
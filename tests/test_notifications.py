@@ -0,0 +1,45 @@
+import pytest
+
+from fake_slack import FakeSlack
+from micro_status import outbox
+from micro_status.notifications import add_event, flush
+from micro_status.outbox import OutboxSender, get_thread_root
+
+
+@pytest.fixture
+def slack(db, monkeypatch):
+    monkeypatch.setattr(outbox, 'SLACK_MIN_INTERVAL', 0)
+    with FakeSlack() as slack:
+        yield slack
+
+
+def test_single_dataset_message_starts_its_thread(slack):
+    sender = OutboxSender(url=slack.url)
+    add_event(1, 'imaging_started', "Imaging of smith CL1 brain *_started_*")
+    flush()
+    sender.send_due()
+    add_event(1, 'imaging_paused', "*WARNING: Imaging of smith CL1 brain paused at z-layer 10*")
+    flush()
+    sender.send_due()
+    assert 'thread_ts' not in slack.posts[0]
+    assert slack.posts[1]['thread_ts'] == get_thread_root(1)[1]
+    assert slack.posts[1]['reply_broadcast'] is True  # warnings show up in the channel too
+
+
+def test_digest_becomes_the_thread_of_its_datasets(slack):
+    sender = OutboxSender(url=slack.url)
+    add_event(1, 'imaging_started', "Imaging of smith CL1 brain *_started_*")
+    add_event(2, 'imaging_started', "Imaging of jones CL2 heart *_started_*")
+    add_event(None, 'low_space', "Low space on FastStore")
+    flush()
+    assert get_thread_root(1)[0] == 'pending'  # replies wait for the digest to be delivered
+    sender.send_due()
+    assert len(slack.posts) == 1
+    digest_ts = get_thread_root(1)[1]
+    assert get_thread_root(2)[1] == digest_ts
+
+    add_event(1, 'imaging_finished', "Imaging of smith CL1 brain *_finished_*")
+    add_event(2, 'imaging_finished', "Imaging of jones CL2 heart *_finished_*")
+    flush()
+    sender.send_due()
+    assert [post.get('thread_ts') for post in slack.posts[1:]] == [digest_ts, digest_ts]
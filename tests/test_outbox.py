@@ -0,0 +1,143 @@
+import time
+
+import pytest
+
+from fake_slack import FakeSlack
+from micro_status import outbox
+from micro_status.db import connect
+from micro_status.outbox import OutboxSender, enqueue
+
+
+@pytest.fixture
+def slack(db, monkeypatch):
+    monkeypatch.setattr(outbox, 'SLACK_MIN_INTERVAL', 0)
+    with FakeSlack() as slack:
+        yield slack
+
+
+def message(message_id):
+    con = connect()
+    record = con.execute(
+        'SELECT status, attempts, error, next_attempt, ts, thread_ts FROM outbox WHERE id = ?', (message_id,)
+    ).fetchone()
+    con.close()
+    return dict(zip(['status', 'attempts', 'error', 'next_attempt', 'ts', 'thread_ts'], record))
+
+
+def make_due(message_id):
+    con = connect()
+    con.execute('UPDATE outbox SET next_attempt = 0 WHERE id = ?', (message_id,))
+    con.commit()
+    con.close()
+
+
+def test_delivery_records_ts_and_threads_replies(slack):
+    sender = OutboxSender(url=slack.url)
+    root_id = enqueue({'channel': 'C1', 'text': 'Imaging started'}, dataset_id=7, msg_type='imaging_started')
+    reply_id = enqueue({'channel': 'C1', 'text': 'Imaging finished'}, dataset_id=7, msg_type='imaging_finished',
+                       in_thread=True)
+    assert sender.send_due()
+    root = message(root_id)
+    assert root['status'] == 'sent' and root['attempts'] == 1
+    assert root['ts'] == '1700000001.000100'
+    reply = message(reply_id)
+    assert reply['status'] == 'sent'
+    assert reply['thread_ts'] == root['ts']
+    assert slack.posts[1]['thread_ts'] == root['ts']
+    assert 'thread_ts' not in slack.posts[0]
+
+
+def test_reply_waits_for_its_thread_root(slack):
+    sender = OutboxSender(url=slack.url)
+    slack.fail()
+    root_id = enqueue({'channel': 'C1', 'text': 'Imaging started'}, dataset_id=7)
+    reply_id = enqueue({'channel': 'C1', 'text': 'Imaging finished'}, dataset_id=7, in_thread=True)
+    sender.send_due()
+    assert len(slack.posts) == 1  # the reply isn't posted outside the thread
+    assert message(reply_id)['next_attempt'] >= message(root_id)['next_attempt']
+    make_due(root_id)
+    make_due(reply_id)
+    sender.send_due()
+    assert message(reply_id)['thread_ts'] == message(root_id)['ts']
+
+
+def test_retry_with_backoff(slack, monkeypatch):
+    monkeypatch.setattr(outbox, 'SLACK_RETRY_BASE_DELAY', 5)
+    sender = OutboxSender(url=slack.url)
+    slack.fail(500)
+    slack.error('internal_error')
+    message_id = enqueue({'channel': 'C1', 'text': 'Low space on FastStore'})
+
+    started = time.time()
+    sender.send_due()
+    first = message(message_id)
+    assert first['status'] == 'pending' and first['attempts'] == 1 and first['error'] == 'HTTP 500'
+    assert 5 <= first['next_attempt'] - started <= 6
+    assert not sender.send_due()  # not due yet
+
+    make_due(message_id)
+    started = time.time()
+    sender.send_due()
+    second = message(message_id)
+    assert second['attempts'] == 2 and second['error'] == 'internal_error'
+    assert 10 <= second['next_attempt'] - started <= 11  # doubled
+
+    make_due(message_id)
+    sender.send_due()
+    assert message(message_id)['status'] == 'sent'
+    assert message(message_id)['attempts'] == 3
+    assert len(slack.posts) == 3
+
+
+def test_gives_up(slack, monkeypatch):
+    monkeypatch.setattr(outbox, 'SLACK_MAX_ATTEMPTS', 2)
+    sender = OutboxSender(url=slack.url)
+    slack.error('channel_not_found')
+    permanent_id = enqueue({'channel': 'C1', 'text': 'a'})
+    sender.send_due()
+    assert message(permanent_id)['status'] == 'failed' and message(permanent_id)['attempts'] == 1
+
+    slack.fail()
+    slack.fail()
+    message_id = enqueue({'channel': 'C1', 'text': 'b'})
+    sender.send_due()
+    make_due(message_id)
+    sender.send_due()
+    assert message(message_id)['status'] == 'failed' and message(message_id)['attempts'] == 2
+
+
+def test_rate_limit_honours_retry_after(slack):
+    sender = OutboxSender(url=slack.url)
+    slack.rate_limit(1)
+    first_id = enqueue({'channel': 'C1', 'text': 'first'})
+    second_id = enqueue({'channel': 'C1', 'text': 'second'})
+
+    started = time.time()
+    sender.send_due()
+    waited = time.time() - started
+    first = message(first_id)
+    assert first['status'] == 'pending' and first['error'] == 'ratelimited'
+    assert first['attempts'] == 0  # being rate limited isn't a failed attempt
+    assert 1 <= first['next_attempt'] - started <= 2
+    assert waited >= 1  # the sender waited Retry-After before anything else
+    assert len(slack.posts) == 1  # the second message wasn't posted during the rate limit
+    assert message(second_id)['status'] == 'pending'
+
+    sender.send_due()
+    assert message(first_id)['status'] == 'sent' and message(second_id)['status'] == 'sent'
+    assert [post['text'] for post in slack.posts] == ['first', 'first', 'second']
+
+
+def test_sender_thread_delivers(slack):
+    sender = OutboxSender(url=slack.url)
+    sender.start()
+    try:
+        message_id = enqueue({'channel': 'C1', 'text': 'Imaging started'})
+        sender.wake_up()
+        deadline = time.time() + 5
+        while message(message_id)['status'] != 'sent' and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        sender.stop()
+        sender.join(5)
+    assert message(message_id)['status'] == 'sent'
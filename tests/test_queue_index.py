@@ -0,0 +1,54 @@
+import os
+import threading
+
+from micro_status import queue_index
+from micro_status.queue_index import QUEUE_STATES, QueueIndex
+
+
+def test_index_lookups():
+    index = QueueIndex(entries={'00001_a.txt': ('processing', 100.0), '00002_b_move.txt': ('complete', 100.0)}, root='/q')
+    assert index.state_of('00001_a.txt') == 'processing'
+    assert index.state_of('missing.txt') is None
+    assert index.files_in('complete', '_move.txt') == ['00002_b_move.txt']
+    assert index.path('00001_a.txt') == '/q/processing/00001_a.txt'
+    index.record_move('00003_c_move.txt', 'queueStitch')
+    assert index.is_in('00003_c_move.txt', 'queueStitch')
+    assert index.summary()['queueStitch']['files'] == 1
+
+
+def test_record_move_while_reading():
+    """record_move (check_mesoSPIM_processing) runs while other stages read the same index"""
+    index = QueueIndex(entries={f"{i:05}_old.txt": ('complete', 100.0) for i in range(100)}, root='/q')
+    errors = []
+
+    def move():
+        for i in range(5000):
+            index.record_move(f"{i:05}_new_move.txt", 'queueStitch')
+
+    def read():
+        try:
+            for _ in range(50):
+                index.summary()
+                index.files_in('queueStitch')
+        except RuntimeError as e:  # dictionary changed size during iteration
+            errors.append(e)
+
+    threads = [threading.Thread(target=move), threading.Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_scan_reports_files_that_changed_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(queue_index, '_state_since', {})
+    for state in QUEUE_STATES:
+        os.makedirs(tmp_path / state)
+    (tmp_path / 'error' / '00001_a.txt').write_text('')
+    (tmp_path / 'processing' / '00002_b.txt').write_text('')
+    assert QueueIndex.scan(str(tmp_path)).changed == set()
+
+    os.rename(tmp_path / 'error' / '00001_a.txt', tmp_path / 'queueStitch' / '00001_a.txt')
+    (tmp_path / 'tempQueue' / '00003_c.txt').write_text('')
+    assert QueueIndex.scan(str(tmp_path)).changed == {'00001_a.txt'}
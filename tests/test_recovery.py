@@ -0,0 +1,67 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from micro_status import rscm_dataset as rscm_dataset_module
+from micro_status.db import connect
+from micro_status.ims_probe import IMARIS_DATA_GROUP
+from micro_status.queue_index import QueueIndex
+from micro_status.rscm_dataset import RSCMDataset
+
+
+@pytest.fixture
+def paused(dataset, tmp_path, monkeypatch):
+    """The dataset as a paused RSCM dataset of 2 layers x 1 channel, its outputs under tmp_path / 'outputs'"""
+    con = connect()
+    con.execute("UPDATE dataset SET processing_status = 'paused', z_layers_total = 2, channels = 1, job_number = '7'")
+    con.commit()
+    record = con.execute('SELECT * FROM dataset WHERE id = 1').fetchone()
+    con.close()
+    paused = RSCMDataset.initialize_from_db(record)
+    composites_dir = tmp_path / 'outputs' / 'composites_RSCM_v0.1'
+    job_dir = composites_dir / 'job_7'
+    paused._paths = {
+        'composites_dir': str(composites_dir), 'job_dir': str(job_dir), 'job_number': '7',
+        'imaris_file': str(job_dir / 'composites_RSCM_v0.1_job_7.ims'),
+        'ims_part_file': str(job_dir / 'composites_RSCM_v0.1_job_7.ims.part'),
+    }
+    queue_index = QueueIndex(entries={paused.rscm_txt_file_name: ('complete', 100.0)}, root=str(tmp_path))
+    monkeypatch.setattr(rscm_dataset_module, 'get_queue_index', lambda: queue_index)
+    return paused
+
+
+def write_composites(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(directory, f"composite_{i:04}.tif"), 'wb') as f:
+            f.write(b'\0' * 100)
+
+
+def test_recovery_confirms_stages_as_their_outputs_appear(paused, monkeypatch):
+    assert paused.recover() == ('started', False)
+
+    # nothing changed: the composites aren't listed again
+    with monkeypatch.context() as m:
+        m.setattr(RSCMDataset, 'check_all_raw_composites_present', lambda self: 1 / 0)
+        assert paused.recover() == ('started', False)
+
+    write_composites(paused.composites_dir, 2)
+    assert paused.recover() == ('stitched', True)
+
+    write_composites(paused.job_dir, 2)
+    with h5py.File(paused.full_path_to_imaris_file, 'w') as f:
+        f.create_group(IMARIS_DATA_GROUP).create_dataset('Data', data=np.zeros(10))
+    assert paused.recover() == ('finished', True)
+    recovery = paused.get_processing_summary()['recovery']
+    assert set(recovery['evidence']) == {'stitched', 'denoised', 'finished'}
+    assert recovery['evidence']['denoised']['composites'] == 2
+
+
+def test_activity_of_the_running_stage_is_progress(paused):
+    write_composites(paused.composites_dir, 2)
+    assert paused.recover() == ('stitched', True)
+    assert paused.recover() == ('stitched', False)
+    write_composites(paused.job_dir, 1)  # denoising, job dir changes
+    assert paused.recover() == ('stitched', True)
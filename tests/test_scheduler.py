@@ -0,0 +1,17 @@
+from micro_status import scheduler
+
+
+def test_wake_dataset_resets_its_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler, '_dataset_schedule', {})
+    monkeypatch.setattr(scheduler, 'DATASET_CHECK_INTERVALS', {'finished': (300, 3600), 'processing_paused': (60, 1800)})
+    for _ in range(4):
+        scheduler.reschedule(('finished', 7), 'finished', False, now=1000)
+    scheduler.reschedule(('paused', 7), 'processing_paused', False, now=1000)
+    scheduler.reschedule(('finished', 8), 'finished', False, now=1000)
+    assert not scheduler.is_due(('finished', 7), now=2000)
+
+    scheduler.wake_dataset(7)
+    assert scheduler.is_due(('finished', 7), now=1000)
+    assert scheduler.is_due(('paused', 7), now=1000)
+    assert not scheduler.is_due(('finished', 8), now=1000)
+    assert scheduler.reschedule(('finished', 7), 'finished', False, now=1000) == 300
@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from micro_status import stage_executor
+from micro_status.stage_executor import Stage, for_each, run_stages
+
+
+@pytest.fixture(autouse=True)
+def running(monkeypatch):
+    monkeypatch.setattr(stage_executor, '_running', {})
+
+
+def test_failed_stage_only_affects_itself():
+    order = []
+
+    def broken():
+        raise RuntimeError('boom')
+
+    stages = [
+        Stage(broken),
+        Stage(lambda: order.append('after_broken'), after=['broken'], name='after_broken'),
+        Stage(lambda: order.append('other'), name='other'),
+    ]
+    assert run_stages(stages) == {'broken': 'failed', 'after_broken': 'ok', 'other': 'ok'}
+    assert sorted(order) == ['after_broken', 'other']
+
+
+def test_stages_start_after_the_stages_they_come_after():
+    order = []
+    stages = [
+        Stage(lambda: order.append('third'), after=['second'], name='third'),
+        Stage(lambda: order.append('second'), after=['first'], name='second'),
+        Stage(lambda: order.append('first'), name='first'),
+        # a stage that isn't part of the cycle doesn't hold it up
+        Stage(lambda: order.append('alone'), after=['not_due'], name='alone'),
+    ]
+    assert set(run_stages(stages).values()) == {'ok'}
+    assert [name for name in order if name != 'alone'] == ['first', 'second', 'third']
+
+
+def test_cyclic_stages_are_rejected():
+    with pytest.raises(ValueError):
+        run_stages([Stage(lambda: None, after=['b'], name='a'), Stage(lambda: None, after=['a'], name='b')])
+
+
+def test_timed_out_stage_is_skipped_until_it_returns():
+    release = threading.Event()
+    try:
+        stages = [Stage(lambda: release.wait(10), timeout=0.2, name='stuck'),
+                  Stage(lambda: None, after=['stuck'], name='next')]
+        assert run_stages(stages) == {'stuck': 'timeout', 'next': 'ok'}
+        assert run_stages(stages) == {'stuck': 'still_running', 'next': 'ok'}
+    finally:
+        release.set()
+    stage_executor._running['stuck'].result(timeout=5)
+    assert run_stages(stages) == {'stuck': 'ok', 'next': 'ok'}
+
+
+def test_for_each_counts_failed_items():
+    done = []
+
+    def process(item):
+        if item % 2:
+            raise ValueError(item)
+        done.append(item)
+
+    assert for_each(range(6), process, workers=3) == 3
+    assert sorted(done) == [0, 2, 4]
+    assert for_each([], process) == 0
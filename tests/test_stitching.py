@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from micro_status.db import connect
+from micro_status.rscm_dataset import RSCMDataset
+
+
+@pytest.fixture
+def stitched(dataset, tmp_path):
+    """The dataset as an RSCM dataset being stitched"""
+    con = connect()
+    con.execute("UPDATE dataset SET processing_status = 'started'")
+    con.commit()
+    record = con.execute('SELECT * FROM dataset WHERE id = 1').fetchone()
+    con.close()
+    stitched = RSCMDataset.initialize_from_db(record)
+    stitched._paths = {'composites_dir': str(tmp_path / 'outputs' / 'composites_RSCM_v0.1')}
+    return stitched
+
+
+def add_composite(dataset, i):
+    os.makedirs(dataset.composites_dir, exist_ok=True)
+    with open(os.path.join(dataset.composites_dir, f"composite_{i:04}.tif"), 'wb') as f:
+        f.write(b'\0' * 100)
+    mtime = 1000 + i  # the dir mtime moves on with every composite
+    os.utime(dataset.composites_dir, (mtime, mtime))
+
+
+def test_progress_is_new_composites(stitched):
+    assert not stitched.check_stitching_progress()  # aligning, nothing written yet
+    add_composite(stitched, 0)
+    assert stitched.check_stitching_progress()
+    assert not stitched.check_stitching_progress()
+    add_composite(stitched, 1)
+    assert stitched.check_stitching_progress()
+    assert stitched.get_processing_summary()['stitching'] == {'composites_mtime': 1001}
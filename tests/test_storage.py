@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from micro_status import storage
+from micro_status.db import connect
+from micro_status.storage import fill_rate, forecast, record_usage, time_to_threshold, usage_with_timeout
+
+TB = 2 ** 40
+
+
+def samples(rates, start=0, step=600):
+    used = 0
+    result = []
+    for i, rate in enumerate(rates):
+        result.append({'taken': start + i * step, 'used_bytes': used})
+        used += rate * step
+    return result
+
+
+def test_fill_rate_is_the_slope_of_used_bytes():
+    assert fill_rate(samples([1000] * 6)) == pytest.approx(1000)
+    assert fill_rate(samples([-50] * 6)) == pytest.approx(-50)
+    noisy = samples([1000] * 9)
+    noisy[4]['used_bytes'] += 10 ** 6  # one outlier moves a least squares fit only a little
+    assert fill_rate(noisy) == pytest.approx(1000, rel=0.01)
+
+
+def test_fill_rate_needs_enough_samples():
+    assert fill_rate(samples([1000] * 4)) is None
+    assert fill_rate([{'taken': 0, 'used_bytes': i} for i in range(5)]) is None  # all at once
+    assert fill_rate(samples([1000] * 4) + [{'taken': 10 ** 6, 'used_bytes': None}]) is None
+
+
+def test_time_to_threshold():
+    usage = {'used_percent': 80, 'used_bytes': 80 * TB, 'available_bytes': 20 * TB}
+    assert time_to_threshold(usage, TB / 3600, 90) == pytest.approx(10 * 3600)
+    assert time_to_threshold(usage, TB / 3600, 80) == 0
+    assert time_to_threshold(usage, 0, 90) is None
+    assert time_to_threshold(usage, -TB, 90) is None
+    assert time_to_threshold(usage, None, 90) is None
+
+
+def test_forecast_from_recorded_samples(db):
+    now = time.time()
+    con = connect()
+    for i in range(6):
+        con.execute(
+            'INSERT INTO storage_sample(unit, taken, used_percent, used_bytes, available_bytes) VALUES(?, ?, ?, ?, ?)',
+            ('hive', now - 3000 + i * 600, 80, 80 * TB + i * 600 * 2 ** 20, 20 * TB)
+        )
+    # outside the forecast window
+    con.execute("INSERT INTO storage_sample(unit, taken, used_bytes) VALUES('hive', ?, 0)", (now - 10 ** 6,))
+    con.commit()
+    con.close()
+    result = forecast('hive', {'used_percent': 85, 'used_bytes': 85 * TB, 'available_bytes': 15 * TB})
+    assert result['rate'] == pytest.approx(2 ** 20)
+    assert result[90] == pytest.approx(5 * TB / 2 ** 20)
+    assert forecast('faststore', {'used_percent': 50, 'used_bytes': TB, 'available_bytes': TB})['rate'] is None
+
+
+def test_record_usage_keeps_latest(db):
+    record_usage('hive', 50, used_bytes=1)
+    record_usage('hive', 60, used_bytes=2)
+    assert storage.latest_usage('hive')['used_percent'] == 60
+    assert storage.latest_usage('faststore') is None
+
+
+def test_hung_statvfs_is_given_up_on(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, '_pending', {})
+    release = threading.Event()
+    monkeypatch.setattr(storage, 'statvfs_usage', lambda path: release.wait(10) and {'used_percent': 1})
+    path = str(tmp_path)
+    try:
+        assert usage_with_timeout(path, 0.1) is None
+        # not started again while the first call is hanging
+        started = time.time()
+        assert usage_with_timeout(path, 5) is None
+        assert time.time() - started < 1
+    finally:
+        release.set()
+    storage._pending[path].join(5)
+    assert usage_with_timeout(path, 5) == {'used_percent': 1}
@@ -0,0 +1,60 @@
+import os
+import time
+
+from micro_status import transfers
+from micro_status.db import connect
+from micro_status.transfers import MoveJob, plan_transfers
+
+GB = 2 ** 30
+
+
+def add_dataset(path, dataset_id=1):
+    con = connect()
+    con.execute(
+        "INSERT INTO dataset(id, name, path_on_fast_store, created) VALUES(?, 'brain', ?, '2026-01-01_00-00-00')",
+        (dataset_id, path)
+    )
+    con.commit()
+    con.close()
+
+
+def test_size_from_usage_accountant(db, tmp_path, monkeypatch):
+    path = str(tmp_path / 'brain')
+    add_dataset(path)
+    con = connect()
+    con.execute(
+        "INSERT INTO usage_total(unit, level, name, bytes, files, updated) VALUES('faststore', 'dataset', ?, ?, 1, ?)",
+        (path, 5 * GB, time.time())
+    )
+    con.commit()
+    con.close()
+    monkeypatch.setattr(transfers, 'tree_size', lambda path: 1 / 0)  # not walked in the stage
+    job = MoveJob.for_dataset('00001_smith_CL1_brain_move.txt', 'tempQueue', 1)
+    assert job.size_known and job.size == 5 * GB
+
+
+def test_unaccounted_dataset_is_measured_in_the_background(db, tmp_path):
+    path = tmp_path / 'brain'
+    os.makedirs(path / 'layer000')
+    (path / 'layer000' / 'ribbon.tif').write_bytes(b'\0' * 1000)
+    add_dataset(str(path))
+    job = MoveJob.for_dataset('00001_smith_CL1_brain_move.txt', 'tempQueue', 1)
+    assert not job.size_known
+    assert plan_transfers([job], 3600) == []  # held until its size is known
+
+    deadline = time.time() + 5
+    while transfers._measuring and time.time() < deadline:
+        time.sleep(0.05)
+    job = MoveJob.for_dataset('00001_smith_CL1_brain_move.txt', 'tempQueue', 1)
+    assert job.size_known and job.size == 1000
+    assert plan_transfers([job], 3600) == [job.file_name]
+
+
+def test_plan_transfers_within_budget(monkeypatch):
+    monkeypatch.setattr(transfers, 'TRANSFER_BANDWIDTH', 1)  # MB/s
+    jobs = [
+        MoveJob('running', 'processing', size=2 * 2 ** 20),
+        MoveJob('small', 'tempQueue', size=3 * 2 ** 20, age_days=1),
+        MoveJob('big', 'tempQueue', size=9 * 2 ** 20, age_days=2),
+    ]
+    assert plan_transfers(jobs, 10) == ['small']  # 10 MB budget, 2 MB in flight
@@ -0,0 +1,55 @@
+import os
+from types import SimpleNamespace
+
+from micro_status import trash
+from micro_status.db import connect
+
+
+def make_tree(root, files):
+    for relative_path, size in files.items():
+        path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+
+
+def test_renamed_directory_is_measured_in_the_background(db, tmp_path, monkeypatch):
+    location = tmp_path / 'trash'
+    os.makedirs(location)
+    monkeypatch.setattr(trash, 'TRASH_LOCATIONS', {'faststore': str(location)})
+    dataset_path = tmp_path / 'brain_stack'
+    make_tree(dataset_path / 'composites', {'a.tif': 100, 'sub/b.tif': 50})
+    make_tree(dataset_path, {'stitch.log': 10})
+    dataset = SimpleNamespace(db_id=1, pi='smith', cl_number='CL1', name='brain_stack')
+
+    walked = []
+    list_tree = trash.list_tree
+    monkeypatch.setattr(trash, 'list_tree', lambda *args: walked.append(args[0]) or list_tree(*args))
+    trash_path = trash.move_to_trash(
+        dataset, 'composites', [str(dataset_path / 'composites'), str(dataset_path / 'stitch.log')]
+    )
+    trash._size_walker.submit(lambda: None).result()  # the walk queued before is done
+
+    assert walked == [trash_path]  # only after renaming
+    assert os.path.exists(os.path.join(trash_path, 'composites', 'sub', 'b.tif'))
+    con = connect()
+    assert con.execute('SELECT bytes, files FROM trash_entry').fetchone() == (160, 3)
+    con.close()
+
+
+def test_move_tree_returns_the_size_it_moved(tmp_path):
+    make_tree(tmp_path / 'src', {'a.tif': 100, 'sub/b.tif': 50})
+    assert trash.move_tree(str(tmp_path / 'src'), str(tmp_path / 'dst')) == (150, 2)
+    assert not os.path.exists(tmp_path / 'src')
+    assert os.path.getsize(tmp_path / 'dst' / 'sub' / 'b.tif') == 50
+
+
+def test_move_tree_recreates_symlinks(tmp_path):
+    make_tree(tmp_path / 'src', {'a.tif': 100})
+    os.symlink('a.tif', tmp_path / 'src' / 'latest.tif')
+    os.symlink('missing.tif', tmp_path / 'src' / 'dangling.tif')
+    assert trash.move_tree(str(tmp_path / 'src'), str(tmp_path / 'dst')) == (100, 1)
+    assert os.readlink(tmp_path / 'dst' / 'latest.tif') == 'a.tif'
+    assert os.readlink(tmp_path / 'dst' / 'dangling.tif') == 'missing.tif'
+    trash.delete_tree(str(tmp_path / 'dst'))
+    assert not os.path.lexists(tmp_path / 'dst')
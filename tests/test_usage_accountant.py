@@ -0,0 +1,99 @@
+import os
+import time
+
+from micro_status import usage_accountant
+from micro_status.db import connect
+from micro_status.usage_accountant import DirUsage, account, dataset_usage, top_consumers
+
+
+def write_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+
+
+def settle(root):
+    """Date every directory back so its listing is cached"""
+    old = time.time() - 3600
+    for path, _, _ in os.walk(root):
+        os.utime(path, (old, old))
+
+
+def make_tree(root):
+    write_file(os.path.join(root, 'smith', 'CL1', 'brain', 'layer000', 'ribbon.tif'), 1000)
+    write_file(os.path.join(root, 'smith', 'CL1', 'brain', 'layer001', 'ribbon.tif'), 1000)
+    write_file(os.path.join(root, 'smith', 'CL2', 'lung', 'ribbon.tif'), 300)
+    write_file(os.path.join(root, 'jones', 'CL3', 'heart', 'ribbon.tif'), 50)
+    write_file(os.path.join(root, 'jones', 'leftover.tif'), 7)
+    con = connect()
+    con.execute("INSERT INTO pi(id, name) VALUES(1, 'smith'), (2, 'jones')")
+    con.execute("INSERT INTO clnumber(id, name, pi) VALUES(1, 'CL1', 1), (2, 'CL2', 1), (3, 'CL3', 2)")
+    for dataset_id, path, cl_number, pi in (
+            (1, 'smith/CL1/brain', 1, 1), (2, 'smith/CL2/lung', 2, 1), (3, 'jones/CL3/heart', 3, 2),
+            (4, 'jones/CL3/gone', 3, 2)):
+        con.execute(
+            "INSERT INTO dataset(id, name, path_on_fast_store, cl_number, pi, created) "
+            "VALUES(?, ?, ?, ?, ?, '2026-01-01_00-00-00')",
+            (dataset_id, os.path.basename(path), os.path.join(root, path) + os.sep, cl_number, pi)
+        )
+    con.commit()
+    con.close()
+
+
+def test_roll_up_per_dataset_cl_number_and_pi(db, tmp_path):
+    root = str(tmp_path / 'Acquire')
+    make_tree(root)
+    rows = {(level, name): (size, files) for level, name, size, files in account('faststore', root)}
+    assert rows[('dataset', os.path.join(root, 'smith', 'CL1', 'brain'))] == (2000, 2)
+    assert rows[('clnumber', 'CL1')] == (2000, 2)
+    assert rows[('clnumber', 'CL3')] == (50, 1)
+    assert rows[('pi', 'smith')] == (2300, 3)
+    assert rows[('pi', 'jones')] == (50, 1)
+    assert rows[('total', root)] == (2357, 5)
+    assert rows[('other', 'unattributed')] == (7, 1)
+    assert not any(name.endswith('gone') for _, name in rows)
+
+    assert dataset_usage('faststore', os.path.join(root, 'smith', 'CL2', 'lung') + os.sep) == 300
+    assert dataset_usage('faststore', os.path.join(root, 'jones', 'CL3', 'gone')) is None
+    assert top_consumers('faststore', 'pi', 1) == [('smith', 2300)]
+
+
+def test_only_changed_directories_are_listed_again(db, tmp_path, monkeypatch):
+    root = str(tmp_path / 'Acquire')
+    make_tree(root)
+    settle(root)
+    account('faststore', root)
+
+    scanned = []
+    scan = DirUsage.scan.__func__
+
+    def counting_scan(cls, path, mtime):
+        scanned.append(path)
+        return scan(cls, path, mtime)
+
+    monkeypatch.setattr(usage_accountant.DirUsage, 'scan', classmethod(counting_scan))
+    account('faststore', root)
+    assert scanned == []
+
+    layer = os.path.join(root, 'smith', 'CL1', 'brain', 'layer001')
+    write_file(os.path.join(layer, 'ribbon_2.tif'), 500)
+    rows = {(level, name): (size, files) for level, name, size, files in account('faststore', root)}
+    assert scanned == [layer]
+    assert rows[('pi', 'smith')] == (2800, 4)
+
+    # modified shortly before it was listed, listed again until it settles
+    scanned.clear()
+    account('faststore', root)
+    assert scanned == [layer]
+
+
+def test_removed_directories_leave_the_cache(db, tmp_path):
+    root = str(tmp_path / 'Acquire')
+    make_tree(root)
+    account('faststore', root)
+    lung = os.path.join(root, 'smith', 'CL2', 'lung')
+    os.remove(os.path.join(lung, 'ribbon.tif'))
+    os.rmdir(lung)
+    rows = {(level, name): (size, files) for level, name, size, files in account('faststore', root)}
+    assert rows[('pi', 'smith')] == (2000, 2)
+    assert lung not in usage_accountant.load_cache(root)
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from micro_status import volume
+from micro_status.storage import record_usage
+from micro_status.volume import (
+    admit, learned_ratio, median_ribbon_size, outstanding, record_projection, record_written, room
+)
+
+TB = 2 ** 40
+
+
+def test_outstanding_counts_what_admitted_datasets_still_write(db):
+    record_projection(1, 'raw', 10 * TB, admitted=True)
+    record_written(1, 'raw', 4 * TB, complete=False)
+    record_projection(2, 'raw', 3 * TB, admitted=True)
+    record_projection(3, 'raw', 5 * TB, admitted=False)  # waiting to be admitted
+    record_projection(4, 'raw', 2 * TB, admitted=True)
+    record_written(4, 'raw', 2 * TB, complete=True)
+    record_projection(5, 'raw', TB, admitted=True)
+    record_written(5, 'raw', 2 * TB, complete=False)  # bigger than projected
+    record_projection(6, 'ims', 7 * TB, admitted=True)  # written to hive
+    assert outstanding('faststore') == 9 * TB
+    assert outstanding('faststore', exclude_dataset_id=1) == 3 * TB
+    assert outstanding('hive') == 7 * TB
+
+    # a projection update doesn't take the admission back
+    record_projection(2, 'raw', 4 * TB, admitted=False)
+    assert outstanding('faststore') == 10 * TB
+
+
+def test_admit_against_room_and_reservations(db):
+    assert admit(1, {'faststore': 100 * TB}) == (True, None)  # usage unknown
+    record_usage('faststore', 50, size_bytes=100 * TB, used_bytes=50 * TB, available_bytes=50 * TB)
+    assert room('faststore') == pytest.approx(44 * TB)
+    record_projection(1, 'raw', 30 * TB, admitted=True)
+    assert admit(2, {'faststore': 10 * TB}) == (True, None)
+    admitted, shortage = admit(2, {'faststore': 20 * TB})
+    assert not admitted
+    assert shortage == {'unit': 'faststore', 'demand': 20 * TB, 'reserved': 30 * TB, 'room': int(44 * TB)}
+    # its own reservation isn't counted against it
+    assert admit(1, {'faststore': 40 * TB}) == (True, None)
+
+
+def test_ratio_is_learned_from_complete_datasets(db):
+    for dataset_id, raw, ims in ((1, 10, 12), (2, 10, 15), (3, 20, 26)):
+        record_projection(dataset_id, 'raw', raw * TB, admitted=True)
+        record_written(dataset_id, 'raw', raw * TB, complete=True)
+        record_projection(dataset_id, 'ims', raw * TB, admitted=True)
+        record_written(dataset_id, 'ims', ims * TB, complete=dataset_id != 3)
+    assert learned_ratio('ims') == volume.VOLUME_RATIOS['ims']
+    record_written(3, 'ims', 26 * TB, complete=True)
+    assert learned_ratio('ims') == pytest.approx(1.3)
+    # cleaned up later, the complete size is kept
+    record_written(3, 'ims', 0, complete=True)
+    assert learned_ratio('ims') == pytest.approx(1.3)
+
+
+def test_median_ribbon_size(tmp_path):
+    assert median_ribbon_size(str(tmp_path / 'missing')) is None
+    images_dir = tmp_path / 'layer000' / '488' / 'images'
+    os.makedirs(images_dir)
+    assert median_ribbon_size(str(tmp_path)) is None
+    for i, size in enumerate((100, 300, 200, 0)):  # empty ones are still being written
+        (images_dir / f"ribbon_{i}.tif").write_bytes(b'\0' * size)
+    assert median_ribbon_size(str(tmp_path)) == 200
@@ -0,0 +1,161 @@
+"""
+Leases, sharding and job claiming between several worker processes on one database (see worker_harness).
+"""
+import json
+import time
+
+from worker_harness import run_workers
+
+from micro_status.db import connect
+
+
+# ---- what the workers run, module level so the worker processes can import it
+
+def take_lease(index, barrier, name):
+    from micro_status.leases import WORKER_ID, acquire
+    barrier.wait()
+    return WORKER_ID, acquire(name)
+
+
+def take_lease_and_stop(index, barrier, name, ttl):
+    """Takes the lease and exits without releasing it, like a worker that crashed"""
+    from micro_status.leases import acquire
+    return acquire(name, ttl=ttl)
+
+
+def take_lease_until_expired(index, barrier, name):
+    from micro_status.leases import acquire
+    attempts = []
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        acquired = acquire(name)
+        attempts.append((time.time(), acquired))
+        if acquired:
+            break
+        time.sleep(0.1)
+    return attempts
+
+
+def shard_datasets(index, barrier, names, rounds, stop_after=None):
+    """
+    Join as a worker, then claim a share of the names every round like check_status does every cycle.
+    :param stop_after: round after which this worker stops renewing (crashes)
+    :return: names handled in the last round this worker ran
+    """
+    from micro_status.leases import WORKER_LEASE, acquire, renew, shard
+    acquire(WORKER_LEASE)
+    barrier.wait()  # everyone has joined before the first share is computed
+    mine = []
+    for round_number in range(rounds):
+        if stop_after is not None and index == 0 and round_number > stop_after:
+            break
+        acquire(WORKER_LEASE)
+        renew()
+        mine = shard(names, 'dataset')
+        time.sleep(0.3)
+    return mine
+
+
+def claim_queued_jobs(index, barrier):
+    from micro_status.job_launcher import Job
+    jobs = Job.get_by_status('queued')
+    barrier.wait()
+    return [job.db_id for job in jobs if job.claim()]
+
+
+def start_while_polled(index, barrier, job_id):
+    """
+    Worker 0 claims the job and takes a while to start it, worker 1 polls the running jobs meanwhile
+    """
+    from micro_status import job_launcher
+    from micro_status.job_launcher import Job
+    if index == 0:
+        popen = job_launcher.subprocess.Popen
+
+        def slow_popen(*args, **kwargs):
+            barrier.wait()  # claimed, no pid yet
+            barrier.wait()  # the other worker polled
+            return popen(*args, **kwargs)
+        job_launcher.subprocess.Popen = slow_popen
+        job = Job.get_by_status('queued')[0]
+        assert job.start()
+        job_launcher._processes[job.db_id].wait()
+        return None
+    barrier.wait()
+    done = job_launcher.poll_jobs()
+    barrier.wait()
+    return [job.db_id for job in done]
+
+
+# ---- the tests
+
+def query(sql, args=()):
+    con = connect()
+    records = con.execute(sql, args).fetchall()
+    con.close()
+    return records
+
+
+def test_only_one_worker_gets_a_lease(db):
+    results = run_workers(db, take_lease, 4, args=('stage:check_storage',))
+    winners = [worker for worker, acquired in results if acquired]
+    assert len(winners) == 1
+    assert query("SELECT owner FROM lease WHERE name = 'stage:check_storage'") == [(winners[0],)]
+
+
+def test_expired_lease_goes_to_another_worker(db):
+    assert run_workers(db, take_lease_and_stop, 1, args=('jobs', 2)) == [True]
+    taken_at = time.time()
+    attempts, = run_workers(db, take_lease_until_expired, 1, args=('jobs',))
+    assert attempts[0][1] is False  # still held by the stopped worker
+    acquired_at = attempts[-1][0]
+    assert attempts[-1][1] is True
+    assert acquired_at - taken_at >= 1  # only once it expired
+
+
+def test_shard_splits_work_between_workers(db):
+    names = list(range(30))
+    shares = run_workers(db, shard_datasets, 3, args=(names, 4))
+    assert sorted(name for share in shares for name in share) == names  # everything handled exactly once
+    assert all(len(share) == 10 for share in shares)
+
+
+def test_shard_of_stopped_worker_is_taken_over(db):
+    names = list(range(12))
+    shares = run_workers(
+        db, shard_datasets, 3, args=(names, 16, 1),
+        settings={'micro_status.leases': {'LEASE_TTL': 1.5}}
+    )
+    survivors = shares[1:]
+    assert sorted(name for share in survivors for name in share) == names
+    assert all(len(share) == 6 for share in survivors)
+
+
+def test_queued_job_is_claimed_once(db):
+    con = connect()
+    for dataset_id in range(20):
+        con.execute(
+            "INSERT INTO job(dataset_id, command_name, cmd, status) VALUES(?, 'build_ims', ?, 'queued')",
+            (dataset_id, json.dumps(['true']))
+        )
+    con.commit()
+    con.close()
+    claimed = run_workers(db, claim_queued_jobs, 4)
+    all_claimed = [job_id for worker_claimed in claimed for job_id in worker_claimed]
+    assert sorted(all_claimed) == list(range(1, 21))
+    assert query("SELECT COUNT(*) FROM job WHERE status = 'running'") == [(20,)]
+
+
+def test_job_being_started_is_not_lost(db, tmp_path):
+    con = connect()
+    con.execute(
+        "INSERT INTO job(dataset_id, command_name, cmd, status) VALUES(1, 'build_ims', ?, 'queued')",
+        (json.dumps(['sleep', '0.5']),)
+    )
+    con.commit()
+    con.close()
+    settings = {'micro_status.job_launcher': {'JOB_LOG_FOLDER': str(tmp_path / 'job_logs')}}
+    starter, poller = run_workers(db, start_while_polled, 2, args=(1,), settings=settings)
+    assert poller == []
+    status, pid = query('SELECT status, pid FROM job WHERE id = 1')[0]
+    assert status == 'running' and pid is not None
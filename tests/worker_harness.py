@@ -0,0 +1,58 @@
+"""
+Fake check_status workers: separate processes sharing one sqlite database, like the workers on the
+cluster nodes share the one on FastStore. Every process has its own WORKER_ID (host:pid), its own
+held leases and its own job processes.
+
+    results = run_workers(db_file, target, 3, args=(...), settings={'micro_status.leases': {'LEASE_TTL': 2}})
+
+target(index, barrier, *args) runs in every worker and returns something picklable, results are
+ordered by worker index. barrier lines the workers up to race on something.
+"""
+import importlib
+import multiprocessing
+import traceback
+
+WORKER_TIMEOUT = 60  # seconds
+
+
+def _bootstrap(db_file, settings, target, index, barrier, results, args):
+    try:
+        from micro_status import db
+        db.DB_LOCATION = db_file
+        for module_name, values in settings.items():
+            module = importlib.import_module(module_name)
+            for name, value in values.items():
+                setattr(module, name, value)
+        results.put((index, True, target(index, barrier, *args)))
+    except BaseException:
+        results.put((index, False, traceback.format_exc()))
+
+
+def run_workers(db_file, target, workers, args=(), settings=None, timeout=WORKER_TIMEOUT):
+    """
+    Run target in `workers` processes at the same time.
+    :param settings: module name -> {setting name: value} set in every worker before target runs
+    :return: list of what target returned, by worker index
+    """
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_bootstrap, args=(db_file, settings or {}, target, index, barrier, results, args))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    collected = {}
+    try:
+        for _ in processes:
+            index, ok, result = results.get(timeout=timeout)
+            if not ok:
+                raise AssertionError(f"worker {index} failed:\n{result}")
+            collected[index] = result
+    finally:
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+    return [collected[index] for index in range(workers)]